@@ -1,14 +1,51 @@
 import logging
+import time
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.redis import RedisStorage, Redis
 
 from app.config import settings
+from app.services.metrics import FSM_SECONDS
+
+
+class TimedRedisStorage(RedisStorage):
+    """RedisStorage с замером задержки: FSM читается и пишется почти в каждом апдейте."""
+
+    async def get_state(self, key):
+        started = time.perf_counter()
+        try:
+            return await super().get_state(key)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "get_state")
+
+    async def set_state(self, key, state=None):
+        started = time.perf_counter()
+        try:
+            return await super().set_state(key, state)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "set_state")
+
+    async def get_data(self, key):
+        started = time.perf_counter()
+        try:
+            return await super().get_data(key)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "get_data")
+
+    async def set_data(self, key, data):
+        started = time.perf_counter()
+        try:
+            return await super().set_data(key, data)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "set_data")
+
 
 # Инициализация Redis для FSM
 redis = Redis(host=settings.redis_host, port=settings.redis_port)
-storage = RedisStorage(redis=redis)
+storage = TimedRedisStorage(redis=redis)
 
 # Единый Dispatcher на всё приложение
 dp = Dispatcher(storage=storage)
@@ -19,8 +56,10 @@ def create_bot(session=None) -> Bot:
     """
     Фабрика бота.
     Если session передана — используем её,
-    иначе aiogram создаст сессию автоматически.
+    иначе aiogram создаст сессию автоматически (с другим адресом Bot API, если он задан).
     """
+    if session is None and settings.telegram_api_url != "https://api.telegram.org":
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
     if session is not None:
         return Bot(
             token=settings.bot_token,
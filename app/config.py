@@ -21,6 +21,10 @@ class Settings:
     webhook_port: int = 8443
     prodamus_key: str = os.getenv("PRODAMUS_KEY", "")
 
+    # Адреса Bot API и Telegraph (в нагрузочном тесте — локальные заглушки)
+    telegram_api_url: str = "https://api.telegram.org"
+    telegraph_url: str = "https://telegra.ph"
+
 
 def get_settings() -> Settings:
     bot_token = os.getenv("BOT_TOKEN")
@@ -36,7 +40,9 @@ def get_settings() -> Settings:
         polza_api_key=polza_key,
         redis_host=os.getenv("REDIS_HOST", "localhost"),
         redis_port=int(os.getenv("REDIS_PORT", 6379)),
-        webhook_port=int(os.getenv("WEBHOOK_PORT", 8443))
+        webhook_port=int(os.getenv("WEBHOOK_PORT", 8443)),
+        telegram_api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/"),
+        telegraph_url=os.getenv("TELEGRAPH_URL", "https://telegra.ph").rstrip("/"),
     )
 
 
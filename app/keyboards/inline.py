@@ -107,4 +107,13 @@ def buy_inline() -> InlineKeyboardMarkup:
             [InlineKeyboardButton(text="45 ген. — 675₽", callback_data="pay_45_675")],
             [InlineKeyboardButton(text="60 ген. — 900₽", callback_data="pay_60_900")],
         ]
-    )
\ No newline at end of file
+    )
+
+
+# --- Результат из кэша: запросить свежую генерацию ---
+def fresh_variant_inline(repeat_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="🎲 Новый вариант", callback_data=f"fresh_variant:{repeat_id}")],
+        ]
+    )
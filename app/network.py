@@ -1,17 +1,169 @@
 import os
+import time
+import asyncio
 import aiohttp
 import logging
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict, Any, AsyncGenerator
+from aiogram.types import InputFile
 from dotenv import load_dotenv
 
+from app.services import metrics
+
 load_dotenv()
 
 POLZA_API_KEY = os.getenv("POLZA_API_KEY")
-BASE_URL = "https://polza.ai/api/v1"
+BASE_URL = os.getenv("POLZA_BASE_URL", "https://polza.ai/api/v1")
+
+# Публичный адрес /polza/callback на нашем aiohttp-сервере (пусто — только polling).
+# Работает только вместе с секретом: без него любой мог бы будить задачи бота
+POLZA_CALLBACK_URL = os.getenv("POLZA_CALLBACK_URL", "")
+POLZA_CALLBACK_SECRET = os.getenv("POLZA_CALLBACK_SECRET", "")
+TELEGRAPH_URL = os.getenv("TELEGRAPH_URL", "https://telegra.ph").rstrip("/")
 timeout_config = aiohttp.ClientTimeout(total=600, connect=30, sock_read=300)
 
-def get_connector():
-    return aiohttp.TCPConnector(ssl=False)
+# Настройки общего пула соединений (один на процесс)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 200))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 100))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+
+# Размер куска при потоковой передаче результата из Polza в Telegram
+STREAM_CHUNK_SIZE = 256 * 1024
+VIDEO_URL_EXTENSIONS = (".mp4", ".mov", ".webm")
+IMAGE_URL_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class PolzaClient:
+    """
+    Общий HTTP-клиент процесса: одна сессия и один пул keep-alive соединений
+    для Polza, скачивания результатов и файлов Telegram.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = POLZA_API_KEY,
+        base_url: str = BASE_URL,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        dns_ttl: int = HTTP_DNS_TTL,
+    ):
+        self.base_url = base_url
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        self._connector = aiohttp.TCPConnector(
+            ssl=False,
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=timeout_config,
+            trace_configs=[metrics.http_trace_config(self.base_url)],
+        )
+        logging.info(
+            "🌐 HTTP пул создан: limit=%s per_host=%s keepalive=%ss dns_ttl=%ss",
+            self.limit, self.limit_per_host, self.keepalive_timeout, self.dns_ttl
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            logging.info("🌐 HTTP пул перед закрытием: %s", self.stats())
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("PolzaClient не запущен: вызовите init_polza_client()")
+        return self._session
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пула: сколько соединений занято и сколько простаивает по хостам."""
+        connector = self._connector
+        if connector is None or connector.closed:
+            return {"limit": self.limit, "limit_per_host": self.limit_per_host, "acquired": 0, "idle": 0, "hosts": {}}
+
+        # У aiohttp нет публичного API для этих чисел, читаем внутренние структуры аккуратно
+        idle_by_key = getattr(connector, "_conns", {}) or {}
+        acquired_by_key = getattr(connector, "_acquired_per_host", {}) or {}
+
+        hosts: Dict[str, Dict[str, int]] = {}
+        for key, conns in idle_by_key.items():
+            hosts.setdefault(f"{key.host}:{key.port}", {"acquired": 0, "idle": 0})["idle"] += len(conns)
+        for key, conns in acquired_by_key.items():
+            hosts.setdefault(f"{key.host}:{key.port}", {"acquired": 0, "idle": 0})["acquired"] += len(conns)
+
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "acquired": len(getattr(connector, "_acquired", ()) or ()),
+            "idle": sum(h["idle"] for h in hosts.values()),
+            "hosts": hosts,
+        }
+
+
+def callbacks_enabled() -> bool:
+    """Callback'и Polza включены: заданы и адрес, и секрет."""
+    if POLZA_CALLBACK_URL and not POLZA_CALLBACK_SECRET:
+        raise RuntimeError("❌ POLZA_CALLBACK_URL задан без POLZA_CALLBACK_SECRET")
+    return bool(POLZA_CALLBACK_URL)
+
+
+def add_callback_url(payload: dict) -> dict:
+    """Просит Polza уведомить нас о завершении задачи (если callback настроен)."""
+    if callbacks_enabled():
+        url = POLZA_CALLBACK_URL + ("&" if "?" in POLZA_CALLBACK_URL else "?") + f"token={POLZA_CALLBACK_SECRET}"
+        payload["callback_url"] = url
+    return payload
+
+
+polza_client: Optional[PolzaClient] = None
+polza_lock = asyncio.Lock()
+
+
+async def init_polza_client() -> PolzaClient:
+    """Создание общего клиента с защитой от двойной инициализации."""
+    global polza_client
+    if polza_client is None:
+        async with polza_lock:
+            if polza_client is None:
+                client = PolzaClient()
+                await client.start()
+                polza_client = client
+    return polza_client
+
+
+async def get_polza_client() -> PolzaClient:
+    if polza_client is not None:
+        return polza_client
+    return await init_polza_client()
+
+
+async def close_polza_client():
+    """Закрытие общего пула при остановке бота."""
+    global polza_client
+    if polza_client is not None:
+        await polza_client.close()
+        polza_client = None
+        logging.info("💤 HTTP пул закрыт")
+
 
 async def _download_content_bytes(session: aiohttp.ClientSession, url: str) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
     try:
@@ -19,9 +171,11 @@ async def _download_content_bytes(session: aiohttp.ClientSession, url: str) -> T
         if not target_url or not isinstance(target_url, str):
             return None, None, str(url)
 
+        started = time.perf_counter()
         async with session.get(target_url, timeout=aiohttp.ClientTimeout(total=300)) as response:
             if response.status != 200: return None, None, target_url
             data = await response.read()
+            metrics.observe_stage("result_download", time.perf_counter() - started)
             content_type = response.headers.get("Content-Type", "").lower()
             ext = "mp4" if "video" in content_type else "jpg"
             return data, ext, target_url
@@ -29,16 +183,75 @@ async def _download_content_bytes(session: aiohttp.ClientSession, url: str) -> T
         logging.error(f"❌ Ошибка скачивания: {e}")
         return None, None, str(url)
 
+def _guess_ext(url: str, default: Optional[str]) -> Optional[str]:
+    path = url.split("?", 1)[0].lower()
+    for ext in VIDEO_URL_EXTENSIONS + IMAGE_URL_EXTENSIONS:
+        if path.endswith(ext):
+            return "jpg" if ext == ".jpeg" else ext[1:]
+    return default
+
+
+async def fetch_result(session: aiohttp.ClientSession, url, stream: bool = False,
+                       default_ext: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    """
+    Результат генерации.
+    stream=False — скачиваем целиком (как раньше);
+    stream=True — ничего не качаем, возвращаем (None, ext, url) для StreamedInputFile.
+    """
+    if not stream:
+        return await _download_content_bytes(session, url)
+
+    target_url = url.get("url") if isinstance(url, dict) else url
+    if not target_url or not isinstance(target_url, str):
+        return None, None, str(url)
+    return None, _guess_ext(target_url, default_ext), target_url
+
+
+async def content_length(url: str) -> Optional[int]:
+    """Размер результата по HEAD-запросу, не скачивая его; None — если сервер его не сообщил."""
+    try:
+        client = await get_polza_client()
+        async with client.session.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status == 200 and response.content_length is not None:
+                return response.content_length
+    except Exception as e:
+        logging.warning("⚠️ Не удалось узнать размер %s: %s", url, e)
+    return None
+
+
+class StreamedInputFile(InputFile):
+    """
+    Файл для send_photo/send_video, который читается из URL кусками
+    прямо в multipart-загрузку Telegram, не собираясь целиком в памяти.
+    """
+
+    def __init__(self, url: str, filename: Optional[str] = None, chunk_size: int = STREAM_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.url = url
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        client = await get_polza_client()
+        timeout = aiohttp.ClientTimeout(total=300, sock_read=60)
+        started = time.perf_counter()
+        async with client.session.get(self.url, timeout=timeout) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                metrics.HTTP_BYTES.inc("out", amount=len(chunk))
+                yield chunk
+        # Результат прочитан целиком; скорость чтения задаёт и загрузка в Telegram
+        metrics.observe_stage("result_download", time.perf_counter() - started)
+
+
 async def upload_file_to_host(file_bytes: bytes, filename: str = None) -> Optional[str]:
     try:
         form = aiohttp.FormData()
         content_type = 'video/mp4' if filename and filename.endswith('.mp4') else 'image/jpeg'
         form.add_field('file', file_bytes, filename=filename or 'file.jpg', content_type=content_type)
-        async with aiohttp.ClientSession(connector=get_connector()) as session:
-            async with session.post('https://telegra.ph/upload', data=form) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return f"https://telegra.ph{data[0].get('src')}"
+        client = await get_polza_client()
+        async with client.session.post(f"{TELEGRAPH_URL}/upload", data=form) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                return f"{TELEGRAPH_URL}{data[0].get('src')}"
     except Exception as e:
         logging.error(f"❌ Ошибка Telegraph: {e}")
-    return None
\ No newline at end of file
+    return None
@@ -1,23 +1,111 @@
 import asyncio
-from typing import Any, Dict, List, Union
+import logging
+import time
+from typing import Any, Dict
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 
+from app.bot import redis
+
+ALBUM_KEY = "album:{}"
+ALBUM_TTL_MS = 60_000      # брошенные альбомы Redis удалит сам
+ALBUM_MAX_PARTS = 10       # больше Telegram в одну группу не кладёт
+ALBUM_TICK = 0.05
+
+
 class AlbumMiddleware(BaseMiddleware):
-    def __init__(self, latency: float = 0.5):
+    """
+    Собирает части альбома (media_group_id) в список Redis — работает и когда части
+    попали в разные процессы. Первая часть становится ведущей и ждёт, пока новые части
+    перестанут приходить дольше quiet-окна (оно подстраивается под реальные интервалы
+    между частями), либо пока не придут все 10. Остальные части дальше не передаются.
+    latency — верхняя граница ожидания тишины.
+    """
+
+    def __init__(self, latency: float = 0.5, min_quiet: float = 0.15, max_wait: float = 3.0):
         self.latency = latency
-        self.album_data: Dict[str, List[Message]] = {}
+        self.min_quiet = min_quiet
+        self.max_wait = max_wait
+        self.gap_ewma = latency / 3
+
+    def quiet_window(self) -> float:
+        return min(self.latency, max(self.min_quiet, self.gap_ewma * 2.5))
 
     async def __call__(self, handler, event: Message, data: Dict[str, Any]):
         if not event.media_group_id:
             return await handler(event, data)
 
+        key = ALBUM_KEY.format(event.media_group_id)
         try:
-            self.album_data[event.media_group_id].append(event)
-        except KeyError:
-            self.album_data[event.media_group_id] = [event]
-            await asyncio.sleep(self.latency)
-
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, event.model_dump_json(exclude_unset=True, by_alias=True))
+                pipe.ltrim(key, 0, ALBUM_MAX_PARTS - 1)
+                pipe.pexpire(key, ALBUM_TTL_MS)
+                pipe.set(f"{key}:last", time.time(), px=ALBUM_TTL_MS)
+                pipe.set(f"{key}:leader", 1, nx=True, px=ALBUM_TTL_MS)
+                pipe.exists(f"{key}:flushed")
+                *_, is_leader, late = await pipe.execute()
+        except Exception as e:
+            logging.warning("⚠️ Альбом %s: Redis недоступен, обрабатываем часть отдельно: %s",
+                            event.media_group_id, e)
             data['_is_last'] = True
-            data['album'] = self.album_data.pop(event.media_group_id)
-            return await handler(event, data)
\ No newline at end of file
+            data['album'] = [event]
+            return await handler(event, data)
+
+        if not is_leader:
+            return None
+        if late:
+            # Альбом уже отдан в обработку: опоздавшие части идут отдельным альбомом, а не теряются
+            logging.warning("⚠️ Альбом %s: часть пришла после сборки, обрабатываем отдельно", event.media_group_id)
+
+        album = await self._collect(key, data.get("bot"))
+        data['_is_last'] = True
+        data['album'] = album or [event]
+        return await handler(event, data)
+
+    async def _collect(self, key: str, bot):
+        started = time.monotonic()
+        last_seen = time.time()
+        parts = 1
+        while time.monotonic() - started < self.max_wait:
+            await asyncio.sleep(ALBUM_TICK)
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.llen(key)
+                    pipe.get(f"{key}:last")
+                    count, last = await pipe.execute()
+            except Exception as e:
+                logging.warning("⚠️ Альбом %s: ошибка Redis: %s", key, e)
+                break
+
+            last = float(last) if last else last_seen
+            if count > parts:
+                self._observe_gap((last - last_seen) / (count - parts))
+                parts, last_seen = count, last
+            if count >= ALBUM_MAX_PARTS or time.time() - last >= self.quiet_window():
+                break
+
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                # Вместе с частями снимаем и лидерство: следующая часть станет новым лидером
+                pipe.lrange(key, 0, -1)
+                pipe.delete(key, f"{key}:last", f"{key}:leader")
+                pipe.set(f"{key}:flushed", 1, px=ALBUM_TTL_MS)
+                raw_parts, *_ = await pipe.execute()
+        except Exception as e:
+            logging.warning("⚠️ Альбом %s: не удалось забрать части: %s", key, e)
+            return None
+
+        messages = []
+        for raw in raw_parts:
+            try:
+                messages.append(Message.model_validate_json(raw, context={"bot": bot}))
+            except Exception as e:
+                logging.warning("⚠️ Альбом %s: битая часть: %s", key, e)
+        messages.sort(key=lambda m: m.message_id)
+        logging.info("🖼 Альбом %s: %s частей за %.0f мс", key, len(messages), (time.monotonic() - started) * 1000)
+        return messages
+
+    def _observe_gap(self, gap: float):
+        if gap > 0:
+            self.gap_ewma = 0.8 * self.gap_ewma + 0.2 * gap
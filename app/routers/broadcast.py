@@ -1,11 +1,10 @@
 import os
-import logging
-import asyncio
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import database as db
+from app.services.broadcast import start_broadcast, stop_broadcasts
 
 router = Router()
 
@@ -97,44 +96,13 @@ async def broadcast_confirm(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Нет данных для рассылки.")
         return
 
-    await message.answer("🚀 Рассылка запущена...")
-
-    user_ids = await db.get_all_user_ids()
-    sent = 0
-    failed = 0
-
-    for user_id in user_ids:
-        try:
-            if content["type"] == "text":
-                await message.bot.send_message(
-                    chat_id=user_id,
-                    text=content["text"],
-                    parse_mode="HTML"
-                )
-            elif content["type"] == "photo":
-                await message.bot.send_photo(
-                    chat_id=user_id,
-                    photo=content["file_id"],
-                    caption=content.get("caption"),
-                    parse_mode="HTML"
-                )
-            elif content["type"] == "video":
-                await message.bot.send_video(
-                    chat_id=user_id,
-                    video=content["file_id"],
-                    caption=content.get("caption"),
-                    parse_mode="HTML"
-                )
-            sent += 1
-        except Exception as e:
-            failed += 1
-            logging.warning(f"⚠️ Не доставлено {user_id}: {e}")
-
-        await asyncio.sleep(0.05)
+    status = await message.answer("🚀 Рассылка запущена...")
+    start_broadcast(message.bot, content, message.chat.id, status.message_id)
 
-    await message.answer(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📨 Доставлено: <b>{sent}</b>\n"
-        f"❌ Не доставлено: <b>{failed}</b>",
-        parse_mode="HTML"
-    )
\ No newline at end of file
+
+@router.message(Command("stop_broadcast"))
+async def broadcast_stop(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    stopped = stop_broadcasts()
+    await message.answer("🛑 Рассылка остановлена." if stopped else "ℹ️ Активных рассылок нет.")
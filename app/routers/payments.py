@@ -1,6 +1,7 @@
 import asyncio
 import os
 import logging
+import secrets
 from aiohttp import web
 from aiogram import Router, types, F, Bot
 from urllib.parse import urlencode
@@ -14,7 +15,7 @@ PRODAMUS_BASE_URL = os.getenv("PRODAMUS_URL", "https://ai-photo-nano.payform.ru"
 
 # --- ФОНОВЫЕ ЗАДАЧИ ---
 
-async def process_delivery_animation(bot: Bot, user_id: int, amount: int, bonus_text: str):
+async def process_delivery_animation(bot: Bot, user_id: int, amount: int, bonus_text: str, balance: int = None):
     """Анимация зачисления, запущенная в фоне"""
     try:
         # Используем переданный объект bot вместо глобального
@@ -30,7 +31,7 @@ async def process_delivery_animation(bot: Bot, user_id: int, amount: int, bonus_
         )
         await asyncio.sleep(0.5)
 
-        current_bal = await db.get_balance(user_id)
+        current_bal = balance if balance is not None else await db.get_balance(user_id)
         await status_msg.delete()
 
         await bot.send_message(
@@ -69,24 +70,28 @@ async def prodamus_webhook(request: web.Request):
             p = str(order_data).split("_")
             user_id = int(p[0])
             amount = int(p[1])
+            bonus_amount = max(1, int(amount * 0.1))
 
-            # 1. МГНОВЕННОЕ зачисление в базу
-            await db.update_balance(user_id, amount)
-            await db.log_payment(user_id, amount, "success", str(order_data), raw_dict)
+            # Старые ссылки (user_amount) не уникальны — различаем их по номеру заказа Prodamus
+            order_key = str(order_data) if len(p) > 2 else f"{order_data}:{data.get('order_id', '')}"
+
+            # 1. Зачисление, бонус пригласителю и лог — одной командой; повтор вебхука ничего не меняет
+            settled = await db.settle_payment(order_key, user_id, amount, bonus_amount, raw_dict)
+            if settled is None:
+                logging.info("ℹ️ Платёж %s уже зачислен — повтор вебхука", order_key)
+                return web.Response(text="OK", status=200)
+            balance, referrer_id = settled
 
             # 2. Логика реферальной системы
-            referrer_id = await db.get_referrer(user_id)
             bonus_text = ""
             if referrer_id:
-                bonus_amount = max(1, int(amount * 0.1))
-                await db.update_balance(referrer_id, bonus_amount)
                 bonus_text = f"\n🎁 Ваш пригласитель получил бонус <b>{bonus_amount}</b> ⚡"
 
                 # Уведомление рефереру (в фоне)
                 asyncio.create_task(bot.send_message(chat_id=referrer_id, text="🎉 Бонус за друга!"))
 
             # 3. Запускаем анимацию "в фоне" и СРАЗУ отвечаем серверу платежей (200 OK)
-            asyncio.create_task(process_delivery_animation(bot, user_id, amount, bonus_text))
+            asyncio.create_task(process_delivery_animation(bot, user_id, amount, bonus_text, balance))
 
             return web.Response(text="OK", status=200)
         except Exception as e:
@@ -122,7 +127,8 @@ async def create_payment_link(callback: types.CallbackQuery):
     # Формируем ссылку для Продамуса
     params = {
         "do": "pay",
-        "order_id": f"{user_id}_{amount}",
+        # Суффикс делает номер заказа уникальным: по нему вебхук зачисляет платёж ровно один раз
+        "order_id": f"{user_id}_{amount}_{secrets.token_hex(4)}",
         "products[0][name]": f"Пакет {amount} молний",
         "products[0][price]": price,
         "products[0][quantity]": 1
@@ -1,3 +1,7 @@
+import json
+import os
+import time
+import uuid
 import logging
 import traceback
 import asyncio
@@ -7,15 +11,33 @@ from aiogram import Router, types, F, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.types import BufferedInputFile
 
+from app.bot import redis
+from app.network import StreamedInputFile, content_length, get_polza_client, fetch_result
 from app.states import PhotoProcess
 from app.keyboards.reply import main_kb, cancel_kb
-from app.keyboards.inline import model_inline, kling_inline
+from app.keyboards.inline import model_inline, kling_inline, fresh_variant_inline
 from app.services.telegram_file import (
     get_telegram_photo_url,
     download_telegram_file,
     bytes_to_base64_data_uri,
 )
-from app.services.generation import has_balance, generate, charge, generate_video
+from app.services.generation import (
+    has_balance,
+    generate,
+    generate_video,
+    reserve,
+    settle,
+    refund,
+    result_cache,
+    result_cache_key,
+    get_cached_result,
+    store_cached_result,
+)
+from app.services.job_queue import enqueue_job, queue_enabled
+from app.services.admission import admission, AdmissionTimeout, QueueFull, format_eta
+from app.services import metrics, tracing
+from app.services.single_flight import generation_flights
+from app.services.transcode import TELEGRAM_UPLOAD_LIMIT, transcode_to_fit
 
 router = Router()
 
@@ -29,39 +51,185 @@ MODEL_NAMES = {
 }
 
 active_tasks = set()
+metrics.gauge("bot_active_tasks", "Фоновые задачи генерации в процессе бота", lambda: len(active_tasks))
+
+# Очередь модели не дошла до задачи, пока жив холд: генерации возвращаются в finally
+QUEUE_TIMEOUT_TEXT = "⌛ Очередь к нейросети не дошла до вашего запроса — генерации возвращены. Попробуйте позже."
+# Ведомый склеенной генерации получает результат лидера бесплатно — так же, как ответ из кэша
+COALESCED_NOTE = "\n♻️ Такой же запрос уже выполнялся — отдаём его результат, генерации не списаны."
+
+# Запрос для кнопки «Новый вариант»: id — в callback_data результата, параметры — в Redis
+REPEAT_PREFIX = "fresh:job"
+REPEAT_TTL = 24 * 3600
+
+# Подготовка референсов альбома: сколько одновременно и сколько ждём каждый
+REFERENCE_CONCURRENCY = int(os.getenv("REFERENCE_CONCURRENCY", 4))
+REFERENCE_TIMEOUT = float(os.getenv("REFERENCE_TIMEOUT", 45))
+
+
+async def _prepare_image_source(
+    bot: Bot,
+    index: int,
+    file_id: str,
+    unique_id: Optional[str],
+    force_data_uri: bool,
+    semaphore: asyncio.Semaphore,
+) -> Optional[str]:
+    """Один референс: URL (кэш/Telegraph/TG), при неудаче — data URI. None, если не вышло."""
+
+    async def resolve() -> Optional[str]:
+        if not force_data_uri:
+            src = await get_telegram_photo_url(bot, file_id, unique_id)
+            if src:
+                return src
+
+        file_bytes, mime = await download_telegram_file(bot, file_id)
+        if file_bytes and mime and mime.startswith("image/"):
+            return bytes_to_base64_data_uri(file_bytes, mime)
+        return None
+
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(resolve(), timeout=REFERENCE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("⚠️ Референс #%s не подготовлен за %ss", index, REFERENCE_TIMEOUT)
+        except Exception as e:
+            logging.warning("⚠️ Референс #%s: ошибка подготовки: %s", index, e)
+        finally:
+            logging.info("photo source #%s: %.2fs", index, time.perf_counter() - started)
+        return None
 
 
 async def _build_image_sources(
     bot: Bot,
     file_ids: List[str],
     force_data_uri: bool = False,
+    unique_ids: Optional[List[str]] = None,
 ) -> List[str]:
     """
     Для каждого file_id:
     - если force_data_uri=False: сначала пробуем URL, иначе data URI
     - если force_data_uri=True: сразу data URI (без URL)
+    unique_ids (file_unique_id тех же файлов) позволяют взять уже размещённый URL из кэша.
+    Референсы готовятся параллельно (не больше REFERENCE_CONCURRENCY), порядок сохраняется,
+    неудавшиеся пропускаются.
     """
-    sources: List[str] = []
-
-    for file_id in file_ids:
-        if not force_data_uri:
-            src = await get_telegram_photo_url(bot, file_id)
-            if src:
-                sources.append(src)
-                continue
+    unique_ids = unique_ids or []
+    semaphore = asyncio.Semaphore(REFERENCE_CONCURRENCY)
+    started = time.perf_counter()
 
-        file_bytes, mime = await download_telegram_file(bot, file_id)
-        if file_bytes and mime and mime.startswith("image/"):
-            sources.append(bytes_to_base64_data_uri(file_bytes, mime))
+    results = await asyncio.gather(*(
+        _prepare_image_source(
+            bot, i, file_id, unique_ids[i] if i < len(unique_ids) else None, force_data_uri, semaphore
+        )
+        for i, file_id in enumerate(file_ids)
+    ))
+    sources: List[str] = [src for src in results if src]
 
     first_type = "none"
     if sources:
         first_type = "data_uri" if sources[0].startswith("data:") else "url"
 
-    logging.info("photo sources prepared: count=%s first_type=%s", len(sources), first_type)
+    logging.info(
+        "photo sources prepared: count=%s failed=%s first_type=%s total=%.2fs",
+        len(sources), len(file_ids) - len(sources), first_type, time.perf_counter() - started
+    )
     return sources
 
 
+def _result_input_file(result, name: str):
+    """
+    Результат генерации для отправки в Telegram.
+    Если движок вернул только URL — файл потоком идёт из Polza в Telegram без буферизации.
+    """
+    data, ext, url = result
+    if data:
+        return BufferedInputFile(data, filename=f"{name}.{ext}")
+    return StreamedInputFile(url, filename=f"{name}.{ext}")
+
+
+async def _remember_job(kind: str, job: dict) -> Optional[str]:
+    """Сохраняет параметры запроса для «Нового варианта». None — если Redis недоступен."""
+    repeat_id = uuid.uuid4().hex[:16]
+    try:
+        await redis.set(f"{REPEAT_PREFIX}:{repeat_id}", json.dumps({"kind": kind, **job}), ex=REPEAT_TTL)
+    except Exception as e:
+        logging.warning("⚠️ Не удалось сохранить запрос для нового варианта: %s", e)
+        return None
+    return repeat_id
+
+
+async def _recall_job(repeat_id: str) -> Optional[dict]:
+    try:
+        raw = await redis.get(f"{REPEAT_PREFIX}:{repeat_id}")
+    except Exception as e:
+        logging.warning("⚠️ Не удалось прочитать запрос %s: %s", repeat_id, e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+async def _fit_video_result(result):
+    """
+    Видео больше лимита Telegram на отправку ботом: скачиваем и пережимаем под лимит.
+    Размер потокового результата узнаём HEAD-запросом; остальное отправляется как есть.
+    """
+    data, ext, url = result
+    size = len(data) if data else await content_length(url)
+    if not size or size <= TELEGRAM_UPLOAD_LIMIT:
+        return result
+
+    logging.info("📹 Видео %s KB больше лимита Telegram — пережимаем", size // 1024)
+    if not data:
+        data, _, _ = await fetch_result((await get_polza_client()).session, url)
+        if not data:
+            return result
+    return await transcode_to_fit(data, max_bytes=TELEGRAM_UPLOAD_LIMIT), "mp4", url
+
+
+async def _send_cached_result(bot: Bot, chat_id: int, cache_key: Optional[str], model: str, is_video: bool,
+                              repeat_id: Optional[str] = None) -> bool:
+    """Отправляет ранее сгенерированный результат по file_id. True — если кэш сработал."""
+    file_id = await get_cached_result(cache_key)
+    if not file_id:
+        return False
+
+    caption = (
+        f"{'✅ Ваше видео готово!' if is_video else '✨ Ваше изображение готово!'} ({MODEL_NAMES.get(model)})\n"
+        "♻️ Такой запрос уже выполнялся — отдаём готовый результат, генерации не списаны."
+    )
+    # Без сохранённого запроса новый вариант не собрать — кнопку не показываем
+    keyboard = fresh_variant_inline(repeat_id) if repeat_id else main_kb()
+    try:
+        if is_video:
+            await bot.send_video(chat_id=chat_id, video=file_id, caption=caption, reply_markup=keyboard)
+        else:
+            await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, reply_markup=keyboard)
+    except Exception as e:
+        logging.warning("⚠️ Кэшированный результат не отправился, генерируем заново: %s", e)
+        await result_cache.delete(cache_key)
+        return False
+
+    logging.info("♻️ Результат %s отдан из кэша в чат %s", model, chat_id)
+    return True
+
+
+async def _dispatch_job(bot: Bot, kind: str, job: dict):
+    if queue_enabled():
+        # Задача переживёт рестарт бота: её выполнит один из процессов worker.py
+        try:
+            await enqueue_job(kind, **job)
+        except Exception:
+            await refund(job.get("hold_id"))
+            await admission.cancel(job["model"], job.get("ticket"))
+            raise
+    else:
+        handler = background_video_gen_combined if kind == "video" else background_photo_gen
+        task = asyncio.create_task(handler(bot, **job))
+        active_tasks.add(task)
+        task.add_done_callback(active_tasks.discard)
+
+
 # --- ФОНОВЫЕ ЗАДАЧИ ---
 
 async def background_photo_gen(
@@ -71,43 +239,93 @@ async def background_photo_gen(
         prompt: str,
         model: str,
         user_id: int,
+        photo_uids: Optional[List[str]] = None,
+        fresh: bool = False,
+        hold_id: Optional[str] = None,
+        ticket: Optional[str] = None,
+        repeat_id: Optional[str] = None,
 ):
+    # Генерации зарезервированы при приёме задачи; без доставленного результата — возвращаем
+    settled = False
+    # Генерацию запускал этот запрос (а не присоединился к чужой) — только тогда списываем
+    produced = False
+    status = "error"
+    # Метка модели и трасса для всех этапов этой задачи (get_file, Polza, отправка)
+    metrics.current_model.set(model)
+    tracing.start_trace("photo", model, user_id, chat_id=chat_id, fresh=fresh, references=len(photo_ids))
     try:
-        # Для Polza NanoBananaPro и Seedream референсы должны быть URL (http/https), не data URI
-        photo_sources = await _build_image_sources(bot, photo_ids, force_data_uri=False)
+        # Повторный запрос (та же модель, промпт и фото) — отдаём готовый результат без Polza
+        cache_key = result_cache_key(model, prompt, photo_uids or [])
+        if not fresh and await _send_cached_result(bot, chat_id, cache_key, model, is_video=False, repeat_id=repeat_id):
+            status = "cached"
+            return
 
-        if model in ("nanabanana_pro", "seedream"):
-            photo_sources = [
-                s for s in photo_sources
-                if isinstance(s, str) and (s.startswith("http://") or s.startswith("https://"))
-            ]
-            logging.info("%s filtered url_sources=%s", model, len(photo_sources))
+        async def produce():
+            nonlocal produced
+            produced = True
+            # Для Polza NanoBananaPro и Seedream референсы должны быть URL (http/https), не data URI
+            photo_sources = await _build_image_sources(bot, photo_ids, force_data_uri=False, unique_ids=photo_uids)
+
+            if model in ("nanabanana_pro", "seedream"):
+                photo_sources = [
+                    s for s in photo_sources
+                    if isinstance(s, str) and (s.startswith("http://") or s.startswith("https://"))
+                ]
+                logging.info("%s filtered url_sources=%s", model, len(photo_sources))
+
+            if not photo_sources:
+                return None
+
+            # К Polza идём только со слотом модели: билет получен при приёме запроса.
+            # Слот берёт лишь лидер; ведомые ждут его результат, не занимая слотов
+            async with admission.slot(model, ticket) as lease:
+                # Используем именованные аргументы для 100% защиты от перепутанны�� параметров
+                result = await generate(image_urls=photo_sources, prompt=prompt, model=model, stream=True)
+                lease.completed = bool(result and result[1])
+                return result
+
+        # Такой же запрос уже генерируется (дабл-клик, популярный пресет) — ждём его результат,
+        # а свой билет снимаем: в очереди модели он стоял бы перед билетом лидера.
+        # «Другой вариант» (fresh) просит новую генерацию и чужой результат не берёт
+        result = await generation_flights.run(
+            None if fresh else cache_key, produce, on_join=lambda: admission.cancel(model, ticket)
+        )
 
-        if not photo_sources:
+        if result is None:
             await bot.send_message(chat_id, "⚠️ Не удалось подготовить фото-референс.")
             return
 
-        # Используем именованные аргументы для 100% защиты от перепутанны�� параметров
-        result = await generate(image_urls=photo_sources, prompt=prompt, model=model)
-
-        if not result or not result[0]:
+        if not result or not result[1]:
             await bot.send_message(chat_id, "⚠️ Не удалось получить результат от нейросети.")
             return
 
-        img_bytes, ext, _ = result
-        input_file = BufferedInputFile(img_bytes, filename=f"result_{user_id}.{ext}")
-
-        await bot.send_photo(
-            chat_id=chat_id,
-            photo=input_file,
-            caption=f"✨ Ваше изображение готово! ({MODEL_NAMES.get(model)})",
-            reply_markup=main_kb(),
-        )
-        await charge(user_id, model)
+        input_file = _result_input_file(result, f"result_{user_id}")
 
+        caption = f"✨ Ваше изображение готово! ({MODEL_NAMES.get(model)})"
+        with metrics.stage_timer("telegram_send"):
+            sent = await bot.send_photo(
+                chat_id=chat_id,
+                photo=input_file,
+                caption=caption if produced else caption + COALESCED_NOTE,
+                reply_markup=main_kb(),
+            )
+        if produced:
+            await settle(user_id, model, hold_id)
+            settled = True
+        status = "ok" if produced else "coalesced"
+        await store_cached_result(cache_key, sent.photo[-1].file_id if sent.photo else None)
+
+    except AdmissionTimeout:
+        status = "timeout"
+        await bot.send_message(chat_id, QUEUE_TIMEOUT_TEXT)
     except Exception:
         logging.error("❌ [PHOTO ERROR]: %s", traceback.format_exc())
         await bot.send_message(chat_id, "⚠️ Ошибка при создании фото.")
+    finally:
+        if not settled:
+            await refund(hold_id)
+        await admission.cancel(model, ticket)
+        tracing.finish_trace(status)
 
 async def background_video_gen_combined(
     bot: Bot,
@@ -117,33 +335,85 @@ async def background_video_gen_combined(
     model: str,
     user_id: int,
     motion_video_id: Optional[str] = None,
+    photo_uid: Optional[str] = None,
+    motion_video_uid: Optional[str] = None,
+    fresh: bool = False,
+    hold_id: Optional[str] = None,
+    ticket: Optional[str] = None,
+    repeat_id: Optional[str] = None,
 ):
+    settled = False
+    produced = False
+    status = "error"
+    metrics.current_model.set(model)
+    tracing.start_trace("video", model, user_id, chat_id=chat_id, fresh=fresh)
     try:
-        photo_url = await get_telegram_photo_url(bot, photo_id)
+        final_prompt = prompt if (prompt and prompt.strip() != ".") else "High quality, cinematic"
 
-        motion_url = None
-        if motion_video_id:
-            motion_url = await get_telegram_photo_url(bot, motion_video_id)
+        reference_ids = [photo_uid] + ([motion_video_uid] if motion_video_id else [])
+        cache_key = result_cache_key(model, final_prompt, reference_ids)
+        if not fresh and await _send_cached_result(bot, chat_id, cache_key, model, is_video=True, repeat_id=repeat_id):
+            status = "cached"
+            return
 
-        final_prompt = prompt if (prompt and prompt.strip() != ".") else "High quality, cinematic"
-        result = await generate_video(photo_url, final_prompt, model, motion_video_url=motion_url)
+        async def produce():
+            nonlocal produced
+            produced = True
+            photo_url = await get_telegram_photo_url(bot, photo_id, photo_uid)
 
-        if result and result[0]:
-            video_bytes, ext, _ = result
-            video_file = BufferedInputFile(video_bytes, filename=f"video_{user_id}.{ext}")
-            await bot.send_video(
-                chat_id=chat_id,
-                video=video_file,
-                caption=f"✅ Ваше видео готово! ({MODEL_NAMES.get(model)})",
-                reply_markup=main_kb(),
-            )
-            await charge(user_id, model)
+            motion_url = None
+            if motion_video_id:
+                motion_url = await get_telegram_photo_url(bot, motion_video_id)
+
+            async with admission.slot(model, ticket) as lease:
+                result = await generate_video(
+                    photo_url, final_prompt, model, motion_video_url=motion_url, stream=True
+                )
+                lease.completed = bool(result and result[1])
+                return result
+
+        result = await generation_flights.run(
+            None if fresh else cache_key, produce, on_join=lambda: admission.cancel(model, ticket)
+        )
+
+        if result and result[1]:
+            video_file = _result_input_file(await _fit_video_result(result), f"video_{user_id}")
+            caption = f"✅ Ваше видео готово! ({MODEL_NAMES.get(model)})"
+            with metrics.stage_timer("telegram_send"):
+                sent = await bot.send_video(
+                    chat_id=chat_id,
+                    video=video_file,
+                    caption=caption if produced else caption + COALESCED_NOTE,
+                    reply_markup=main_kb(),
+                )
+            if produced:
+                await settle(user_id, model, hold_id)
+                settled = True
+            status = "ok" if produced else "coalesced"
+            await store_cached_result(cache_key, sent.video.file_id if sent.video else None)
         else:
             await bot.send_message(chat_id, "⚠️ Не удалось сгенерировать видео. Баланс сохранен.")
 
+    except AdmissionTimeout:
+        status = "timeout"
+        await bot.send_message(chat_id, QUEUE_TIMEOUT_TEXT)
     except Exception:
         logging.error("❌ [VIDEO ERROR]: %s", traceback.format_exc())
         await bot.send_message(chat_id, "⚠️ Произошла ошибка в процессе генерации видео.")
+    finally:
+        if not settled:
+            await refund(hold_id)
+        await admission.cancel(model, ticket)
+        tracing.finish_trace(status)
+
+
+async def dead_job(bot: Bot, kind: str, chat_id: int, model: str, hold_id: Optional[str] = None,
+                   ticket: Optional[str] = None, **_job):
+    """Задача не выполнилась ни одним воркером за все доставки: возвращаем генерации сразу."""
+    await refund(hold_id)
+    await admission.cancel(model, ticket)
+    what = "видео" if kind == "video" else "фото"
+    await bot.send_message(chat_id, f"⚠️ Не удалось выполнить генерацию {what} — генерации возвращены. Попробуйте ещё раз.")
 
 
 # --- ХЕНДЛЕРЫ ---
@@ -193,7 +463,10 @@ async def on_cancel_flow(callback: types.CallbackQuery, state: FSMContext):
 
 @router.message(PhotoProcess.waiting_for_photo, F.photo)
 async def on_photo(message: types.Message, state: FSMContext):
-    await state.update_data(photo_ids=[message.photo[-1].file_id])
+    await state.update_data(
+        photo_ids=[message.photo[-1].file_id],
+        photo_uids=[message.photo[-1].file_unique_id],
+    )
     data = await state.get_data()
     model = data.get("chosen_model")
 
@@ -208,7 +481,7 @@ async def on_photo(message: types.Message, state: FSMContext):
 
 @router.message(PhotoProcess.waiting_for_motion_video, F.video)
 async def on_motion_video(message: types.Message, state: FSMContext):
-    await state.update_data(motion_video_id=message.video.file_id)
+    await state.update_data(motion_video_id=message.video.file_id, motion_video_uid=message.video.file_unique_id)
     await message.answer("✍️ Опишите детали промптом (или '.'):", reply_markup=cancel_kb())
     await state.set_state(PhotoProcess.waiting_for_prompt)
 
@@ -218,42 +491,91 @@ async def on_prompt(message: types.Message, state: FSMContext):
     data = await state.get_data()
     model = data.get("chosen_model", "nanabanana")
     photo_ids = data.get("photo_ids", [])
+    photo_uids = data.get("photo_uids", [])
     user_id = message.from_user.id
     prompt = message.text or ""
 
-    if not await has_balance(user_id, model):
-        await state.clear()
-        return await message.answer("❌ Недостаточно средств.", reply_markup=main_kb())
-
     if not photo_ids:
         await state.clear()
         return await message.answer("⚠️ Фото не найдено. Начните заново.", reply_markup=main_kb())
 
+    # Очередь модели переполнена — отказываем сразу, ничего не резервируя (состояние сохраняем)
+    try:
+        admitted = await admission.admit(model, user_id)
+    except QueueFull as e:
+        return await message.answer(
+            f"🚦 Сейчас слишком много запросов к {MODEL_NAMES.get(model)}. "
+            f"Отправьте промпт ещё раз через {format_eta(e.eta)}.",
+            reply_markup=cancel_kb(),
+        )
+
+    # Проверка баланса и списание — одним запросом; по итогу задачи холд подтверждается или возвращается
+    hold_id = await reserve(user_id, model)
+    if not hold_id:
+        await admission.cancel(model, admitted.ticket)
+        await state.clear()
+        return await message.answer("❌ Недостаточно средств.", reply_markup=main_kb())
+
+    photo_uid = photo_uids[0] if photo_uids else None
+
     if model == "kling_motion":
-        motion_id = data.get("motion_video_id")
-        task = asyncio.create_task(
-            background_video_gen_combined(
-                message.bot, message.chat.id, photo_ids[0], prompt, model, user_id, motion_video_id=motion_id
-            )
+        kind, job = "video", dict(
+            chat_id=message.chat.id, photo_id=photo_ids[0], prompt=prompt, model=model, user_id=user_id,
+            motion_video_id=data.get("motion_video_id"), photo_uid=photo_uid,
+            motion_video_uid=data.get("motion_video_uid"),
         )
         time_msg = "⏳ Магия началась! Motion Control занимает 7-12 минут."
     elif "kling" in model.lower():
-        task = asyncio.create_task(
-            background_video_gen_combined(
-                message.bot, message.chat.id, photo_ids[0], prompt, model, user_id
-            )
+        kind, job = "video", dict(
+            chat_id=message.chat.id, photo_id=photo_ids[0], prompt=prompt, model=model, user_id=user_id,
+            photo_uid=photo_uid,
         )
         time_msg = "⏳ Генерация видео началась (3-5 мин)."
     else:
-        task = asyncio.create_task(
-            background_photo_gen(
-                message.bot, message.chat.id, photo_ids, prompt, model, user_id
-            )
+        kind, job = "photo", dict(
+            chat_id=message.chat.id, photo_ids=photo_ids, prompt=prompt, model=model, user_id=user_id,
+            photo_uids=photo_uids,
         )
         time_msg = "⏳ Генерация фото началась (1-2 мин)."
 
-    active_tasks.add(task)
-    task.add_done_callback(active_tasks.discard)
+    # Запрос запоминаем под своим id: кнопка «Новый вариант» у результата повторит именно его
+    repeat_id = await _remember_job(kind, job)
+    await _dispatch_job(
+        message.bot, kind, {**job, "hold_id": hold_id, "ticket": admitted.ticket, "repeat_id": repeat_id}
+    )
 
+    if admitted.position:
+        time_msg += f"\n🕒 Вы в очереди: {admitted.position}, ожидание {format_eta(admitted.eta)}."
     await message.answer(time_msg, reply_markup=main_kb())
-    await state.clear()
\ No newline at end of file
+    await state.clear()
+
+
+@router.callback_query(F.data.startswith("fresh_variant"))
+async def on_fresh_variant(callback: types.CallbackQuery):
+    """Пользователь хочет другой вариант вместо результата из кэша."""
+    # У кнопок, отправленных до появления id, его нет — такой запрос уже не восстановить
+    repeat_id = callback.data.partition(":")[2]
+    job = await _recall_job(repeat_id) if repeat_id else None
+    if not job or job.get("user_id") != callback.from_user.id:
+        return await callback.answer("Запрос устарел — начните заново.", show_alert=True)
+
+    kind = job.pop("kind")
+    try:
+        admitted = await admission.admit(job["model"], callback.from_user.id)
+    except QueueFull as e:
+        return await callback.answer(f"🚦 Очередь переполнена, попробуйте через {format_eta(e.eta)}.", show_alert=True)
+
+    hold_id = await reserve(callback.from_user.id, job["model"])
+    if not hold_id:
+        await admission.cancel(job["model"], admitted.ticket)
+        return await callback.answer("❌ Недостаточно генераций.", show_alert=True)
+
+    await _dispatch_job(
+        callback.bot, kind,
+        {**job, "fresh": True, "hold_id": hold_id, "ticket": admitted.ticket, "repeat_id": repeat_id},
+    )
+    text = "⏳ Генерируем новый вариант..."
+    if admitted.position:
+        text += f"\n🕒 Вы в очереди: {admitted.position}, ожидание {format_eta(admitted.eta)}."
+    await callback.message.answer(text, reply_markup=main_kb())
+    await callback.answer()
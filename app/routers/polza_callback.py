@@ -0,0 +1,48 @@
+import hmac
+import logging
+from aiohttp import web
+
+from app.network import POLZA_CALLBACK_SECRET
+from app.bot import redis
+from app.services.job_queue import queue_enabled
+from app.services.sharding import sharding_enabled
+from app.services.polza_poller import CALLBACK_CHANNEL, FINAL_STATUSES, get_polza_poller
+
+
+def _as_dict(payload):
+    if isinstance(payload, dict):
+        return payload
+    if isinstance(payload, list) and payload and isinstance(payload[0], dict):
+        return payload[0]
+    return {}
+
+
+async def polza_callback(request: web.Request):
+    """
+    Уведомление Polza о завершении задачи — только сигнал: ожидающая генерация сразу
+    опрашивает Polza, а статус и URL результата берёт из ответа API, а не из тела callback'а.
+    Маршрут регистрируется, только если задан POLZA_CALLBACK_SECRET.
+    """
+    token = request.query.get("token", "")
+    if not POLZA_CALLBACK_SECRET or not hmac.compare_digest(token, POLZA_CALLBACK_SECRET):
+        logging.warning("⚠️ Polza callback с неверным токеном от %s", request.remote)
+        return web.Response(text="Forbidden", status=403)
+
+    try:
+        data = _as_dict(await request.json())
+    except Exception as e:
+        logging.warning("⚠️ Polza callback: некорректный JSON: %s", e)
+        return web.Response(text="Bad Request", status=400)
+
+    request_id = data.get("id") or data.get("request_id")
+    status = data.get("status")
+
+    if not request_id or status not in FINAL_STATUSES:
+        return web.Response(text="Ignored", status=200)
+
+    woken = get_polza_poller().wake(str(request_id))
+    if not woken and (queue_enabled() or sharding_enabled()):
+        # Генерацию ждёт один из процессов worker.py или диспетчеров шардов
+        await redis.publish(CALLBACK_CHANNEL, str(request_id))
+    logging.info("📬 Polza callback %s status=%s (ожидали здесь: %s)", request_id, status, woken)
+    return web.Response(text="OK", status=200)
@@ -33,8 +33,7 @@ async def start_cmd(message: types.Message, state: FSMContext):
 
     # 2. Регистрация и баланс
     try:
-        await db.create_new_user(user_id, referrer_id)
-        balance = await db.get_balance(user_id)
+        balance = await db.get_or_create_user(user_id, referrer_id)
     except Exception as e:
         logging.error("❌ Ошибка БД при старте %s: %s", user_id, e)
         balance = "—"
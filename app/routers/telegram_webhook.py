@@ -0,0 +1,106 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.exceptions import RedisError
+
+from app.services.sharding import ShardRouter
+
+# "webhook" — апдейты приходят POST'ом на наш aiohttp-сервер; "polling" — как раньше
+UPDATES_MODE = os.getenv("TELEGRAM_UPDATES", "polling")
+# Публичный адрес сервера (например https://neuro-photo-bot.fly.dev), к нему добавляется путь
+WEBHOOK_BASE_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатываем одновременно; сверх этого Telegram ждёт ответа (backpressure)
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 256))
+# Параллельных соединений со стороны Telegram (1..100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 100))
+SHUTDOWN_GRACE = 30
+
+
+def webhook_enabled() -> bool:
+    return UPDATES_MODE == "webhook"
+
+
+class TelegramWebhook:
+    """
+    Приём апдейтов Telegram на общий aiohttp-сервер: проверяем секрет, сразу отвечаем 200
+    и обрабатываем апдейт в фоне через dp.feed_update. Одновременно — не больше concurrency:
+    когда слоты заняты, ответ задерживается, и Telegram сам снижает темп доставки.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int = WEBHOOK_CONCURRENCY,
+                 router: Optional[ShardRouter] = None):
+        self.dp = dp
+        self.bot = bot
+        # В режиме шардов апдейт не обрабатывается здесь, а уходит в поток своего диспетчера
+        self.router = router
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.running = set()
+
+    def register(self, app: web.Application, path: str = WEBHOOK_PATH):
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request):
+        if WEBHOOK_SECRET:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                logging.warning("⚠️ Telegram webhook с неверным секретом от %s", request.remote)
+                return web.Response(text="Forbidden", status=403)
+
+        try:
+            raw = await request.text()
+            update = Update.model_validate(json.loads(raw), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning("⚠️ Telegram webhook: некорректный апдейт: %s", e)
+            return web.Response(text="Bad Request", status=400)
+
+        if self.router:
+            # Отвечаем только после записи в Redis: при ошибке Telegram повторит доставку
+            try:
+                await self.router.route(update, raw)
+            except RedisError as e:
+                logging.warning("⚠️ Telegram webhook: апдейт %s не записан в Redis: %s", update.update_id, e)
+                return web.Response(text="Service Unavailable", status=503)
+            return web.Response(text="OK", status=200)
+
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return web.Response(text="OK", status=200)
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("❌ Ошибка обработки апдейта %s", update.update_id)
+        finally:
+            self.semaphore.release()
+
+    async def setup(self):
+        """Регистрирует вебхук в Telegram. Повторный вызов с других реплик безопасен."""
+        if not WEBHOOK_BASE_URL:
+            raise RuntimeError("❌ TELEGRAM_WEBHOOK_URL не задан для режима webhook")
+        await self.bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=self.dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logging.info("🌐 Webhook Telegram: %s%s (concurrency=%s)",
+                     WEBHOOK_BASE_URL.rstrip("/"), WEBHOOK_PATH, self.concurrency)
+
+    async def drain(self, timeout: float = SHUTDOWN_GRACE):
+        """Дожидаемся апдейтов в обработке перед остановкой."""
+        if self.running:
+            logging.info("⏳ Ждём завершения %s апдейтов", len(self.running))
+            await asyncio.wait(self.running, timeout=timeout)
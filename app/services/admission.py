@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.bot import redis
+from app.services.generation import COSTS
+from app.services.metrics import observe_stage
+
+# Сколько генераций каждой модели идёт одновременно во всех процессах (дальше — лимиты Polza)
+DEFAULT_MODEL_CONCURRENCY = {
+    "nanabanana": 40,
+    "nanabanana_pro": 20,
+    "seedream": 20,
+    "kling_5": 10,
+    "kling_10": 10,
+    "kling_motion": 5,
+}
+# Типичная длительность генерации, пока нет своей статистики (сек)
+DEFAULT_MODEL_DURATION = {
+    "nanabanana": 60,
+    "nanabanana_pro": 90,
+    "seedream": 60,
+    "kling_5": 240,
+    "kling_10": 300,
+    "kling_motion": 600,
+}
+# Сколько задача работает после получения слота: таймаут опроса движка (app/services/models)
+# плюс DELIVERY_MARGIN на референсы, скачивание и отправку результата
+MODEL_MAX_RUNTIME = {
+    "nanabanana": 160,
+    "nanabanana_pro": 300,
+    "seedream": 200,
+    "kling_5": 600,
+    "kling_10": 600,
+    "kling_motion": 1200,
+}
+DELIVERY_MARGIN = 300
+# Длина очереди, после которой новые запросы модели отклоняются (по умолчанию — 20 × лимит,
+# но не больше, чем модель успевает разобрать до истечения холда генераций)
+QUEUE_DEPTH_FACTOR = 20
+
+ADMISSION_PREFIX = "admission"
+# Слот без продления дольше этого считается брошенным (процесс упал) и освобождается
+SLOT_LEASE = 120
+SLOT_RENEW_INTERVAL = 30
+# Билет, который никто не ждёт дольше этого (задача потерялась), убирается из очереди.
+# Совпадает со сроком холда генераций: ожидание слота и сама задача должны в него уложиться
+TICKET_TTL = int(os.getenv("CREDIT_HOLD_TTL", 3600))
+MIN_QUEUE_WAIT = 60
+POLL_INTERVAL = 1.0
+DURATION_SAMPLES = 50
+# Класс пользователя: кто за USAGE_WINDOW принял генераций дороже HEAVY_USER_COST, тот «тяжёлый» —
+# его билеты продвигают метку в HEAVY_USER_WEIGHT раз быстрее, и разовые запросы остальных встают раньше
+USAGE_WINDOW = 3600
+HEAVY_USER_COST = int(os.getenv("HEAVY_USER_COST", 30))
+HEAVY_USER_WEIGHT = float(os.getenv("HEAVY_USER_WEIGHT", 2))
+# Нижняя граница средней длительности для ETA и длины очереди (замеры округлены до 0.1 сек)
+MIN_AVERAGE_DURATION = 1.0
+
+
+def _parse_limits(raw: str, defaults: Dict[str, int]) -> Dict[str, int]:
+    """"kling_motion=5,kling_5=10" поверх значений по умолчанию."""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        name, _, value = item.partition("=")
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            logging.warning("⚠️ Некорректный лимит модели: %s", item)
+    return limits
+
+
+MODEL_CONCURRENCY = _parse_limits(os.getenv("MODEL_CONCURRENCY", ""), DEFAULT_MODEL_CONCURRENCY)
+MODEL_QUEUE_LIMIT = _parse_limits(
+    os.getenv("MODEL_QUEUE_LIMIT", ""),
+    {model: limit * QUEUE_DEPTH_FACTOR for model, limit in MODEL_CONCURRENCY.items()},
+)
+
+# Очередь — ZSET билетов по справедливой метке, слоты — ZSET билетов по сроку аренды,
+# admitted — время приёма билетов (по нему вычищаются потерянные).
+# Метка билета = max(виртуальное время, метка прошлого билета пользователя) + вес запроса,
+# вес = стоимость модели из COSTS (× HEAVY_USER_WEIGHT для «тяжёлых» пользователей).
+# Виртуальное время и метки пользователей общие для всех моделей: кто только что запустил
+# kling_motion за 15 генераций, тот и в очереди seedream встаёт за разовыми запросами остальных,
+# а двадцать запросов одного пользователя встают не подряд, а вперемешку с чужими.
+# Место в очереди = сколько билетов впереди сверх свободных слотов.
+_PURGE = """
+local now = tonumber(ARGV[1])
+redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+local stale = redis.call('zrangebyscore', KEYS[3], '-inf', now - tonumber(ARGV[2]), 'LIMIT', 0, 100)
+for _, ticket in ipairs(stale) do
+    redis.call('zrem', KEYS[1], ticket)
+    redis.call('zrem', KEYS[3], ticket)
+end
+"""
+
+# KEYS: waiting, active, admitted, user_tags, vtime, usage пользователя
+# ARGV: now, ticket_ttl, ticket_id, limit, max_queue, user, cost, usage_window, heavy_cost, heavy_weight.
+# {-1} — очередь полна
+_ADMIT_SCRIPT = _PURGE + """
+local free = math.max(tonumber(ARGV[4]) - redis.call('zcard', KEYS[2]), 0)
+if redis.call('zcard', KEYS[1]) - free >= tonumber(ARGV[5]) then
+    return {-1, ''}
+end
+local cost = tonumber(ARGV[7])
+local weight = cost
+if tonumber(redis.call('get', KEYS[6]) or '0') >= tonumber(ARGV[9]) then
+    weight = cost * tonumber(ARGV[10])
+end
+redis.call('incrby', KEYS[6], cost)
+redis.call('expire', KEYS[6], ARGV[8])
+local vtime = tonumber(redis.call('get', KEYS[5]) or '0')
+local tag = math.max(vtime, tonumber(redis.call('hget', KEYS[4], ARGV[6]) or '0')) + weight
+redis.call('hset', KEYS[4], ARGV[6], tag)
+redis.call('expire', KEYS[4], ARGV[2])
+-- При равных метках ZSET сортирует по строке: время приёма в билете сохраняет порядок прихода
+local ticket = tag .. ':' .. string.format('%017.6f', now) .. ':' .. ARGV[3]
+redis.call('zadd', KEYS[1], tag, ticket)
+redis.call('zadd', KEYS[3], now, ticket)
+return {math.max(redis.call('zcount', KEYS[1], '-inf', tag) - free, 0), ticket}
+"""
+
+# KEYS: waiting, active, admitted, user_tags, vtime
+# ARGV: now, ticket_ttl, ticket, limit, lease, tag. 0 — слот получен, иначе место в очереди
+_ACQUIRE_SCRIPT = _PURGE + """
+if redis.call('zscore', KEYS[2], ARGV[3]) then
+    redis.call('zadd', KEYS[2], now + tonumber(ARGV[5]), ARGV[3])
+    return 0
+end
+redis.call('zadd', KEYS[1], 'NX', ARGV[6], ARGV[3])
+redis.call('zadd', KEYS[3], 'NX', now, ARGV[3])
+local free = tonumber(ARGV[4]) - redis.call('zcard', KEYS[2])
+local rank = redis.call('zrank', KEYS[1], ARGV[3])
+if rank < free then
+    redis.call('zrem', KEYS[1], ARGV[3])
+    redis.call('zrem', KEYS[3], ARGV[3])
+    redis.call('zadd', KEYS[2], now + tonumber(ARGV[5]), ARGV[3])
+    if tonumber(ARGV[6]) > tonumber(redis.call('get', KEYS[5]) or '0') then
+        redis.call('set', KEYS[5], ARGV[6])
+    end
+    return 0
+end
+return rank - math.max(free, 0) + 1
+"""
+
+
+@dataclass
+class Admission:
+    ticket: str
+    position: int      # 0 — слот свободен, иначе сколько запросов (включая этот) ждут перед слотом
+    eta: float         # ожидаемое ожидание в секундах
+
+
+@dataclass
+class SlotLease:
+    # Задача отметит успех: длительность неудачных (Polza лежит — падают за миллисекунды)
+    # в статистику не идёт, иначе ETA и лимит очереди съезжают к нулю
+    completed: bool = False
+
+
+class QueueFull(Exception):
+    def __init__(self, model: str, eta: float):
+        super().__init__(f"Очередь {model} переполнена")
+        self.model = model
+        self.eta = eta
+
+
+class AdmissionTimeout(Exception):
+    """Слот не освободился, пока жив холд генераций: задачу отменяем и возвращаем генерации."""
+
+    def __init__(self, model: str, waited: float):
+        super().__init__(f"Слот {model} не получен за {waited:.0f} сек")
+        self.model = model
+        self.waited = waited
+
+
+def _ticket_tag(ticket: str) -> float:
+    # Метка в самом билете: по ней восстанавливается место, если билет вычистили
+    try:
+        return float(ticket.split(":", 1)[0])
+    except ValueError:
+        return 0.0
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def format_eta(seconds: float) -> str:
+    minutes = math.ceil(seconds / 60)
+    if minutes <= 1:
+        return "около минуты"
+    if minutes < 60:
+        return f"~{minutes} мин"
+    return f"~{minutes // 60} ч {minutes % 60} мин"
+
+
+class AdmissionControl:
+    """
+    Ограничивает число одновременных генераций каждой модели во всех процессах.
+    Запрос получает билет при приёме (admit) — тогда же пользователь узнаёт место в очереди
+    и ETA, а если очередь уже слишком длинная, запрос отклоняется до резерва генераций.
+    Задача занимает слот (slot) только на время работы с Polza. Билеты обслуживаются по
+    справедливым меткам: запросы разных пользователей чередуются, а не идут по времени приёма.
+    При недоступном Redis ограничение не действует — генерации не блокируются.
+    """
+
+    def __init__(self, prefix: str = ADMISSION_PREFIX):
+        self.prefix = prefix
+        self._admit = redis.register_script(_ADMIT_SCRIPT)
+        self._acquire = redis.register_script(_ACQUIRE_SCRIPT)
+
+    def _keys(self, model: str):
+        # Очередь, слоты и время приёма — свои у каждой модели, справедливые метки — общие
+        queues = [f"{self.prefix}:{model}:{name}" for name in ("waiting", "active", "admitted")]
+        return queues + [f"{self.prefix}:user_tags", f"{self.prefix}:vtime"]
+
+    def limit(self, model: str) -> int:
+        return MODEL_CONCURRENCY.get(model, min(MODEL_CONCURRENCY.values()))
+
+    async def average_duration(self, model: str) -> float:
+        try:
+            samples = await redis.lrange(f"{self.prefix}:{model}:durations", 0, -1)
+        except Exception:
+            samples = []
+        values = [float(s) for s in samples]
+        if not values:
+            return DEFAULT_MODEL_DURATION.get(model, 120)
+        return max(MIN_AVERAGE_DURATION, sum(values) / len(values))
+
+    def max_wait(self, model: str) -> float:
+        """Сколько билет может ждать слот с момента приёма, чтобы задача успела до конца холда."""
+        runtime = MODEL_MAX_RUNTIME.get(model, max(MODEL_MAX_RUNTIME.values()))
+        return max(MIN_QUEUE_WAIT, TICKET_TTL - runtime - DELIVERY_MARGIN)
+
+    async def max_queue(self, model: str) -> int:
+        configured = MODEL_QUEUE_LIMIT.get(model, self.limit(model) * QUEUE_DEPTH_FACTOR)
+        # Очередь не длиннее, чем разбирается за max_wait: ETA последнего в ней — не позже дедлайна
+        rounds = int(self.max_wait(model) // await self.average_duration(model))
+        return max(0, min(configured, rounds * self.limit(model)))
+
+    async def eta(self, model: str, position: int) -> float:
+        if position <= 0:
+            return 0.0
+        return math.ceil(position / self.limit(model)) * await self.average_duration(model)
+
+    async def admit(self, model: str, user_id: int) -> Admission:
+        """Ставит запрос пользователя в очередь модели. QueueFull — если очередь переполнена."""
+        max_queue = await self.max_queue(model)
+        try:
+            position, ticket = await self._admit(
+                keys=self._keys(model) + [f"{self.prefix}:usage:{user_id}"],
+                args=[time.time(), TICKET_TTL, uuid.uuid4().hex[:12], self.limit(model), max_queue, user_id,
+                      COSTS.get(model, 1), USAGE_WINDOW, HEAVY_USER_COST, HEAVY_USER_WEIGHT],
+            )
+            position, ticket = int(position), _decode(ticket)
+        except Exception as e:
+            logging.warning("⚠️ Admission %s: Redis недоступен, пропускаем без очереди: %s", model, e)
+            return Admission(f"0:{uuid.uuid4().hex[:12]}", 0, 0.0)
+
+        if position < 0:
+            eta = await self.eta(model, max_queue)
+            logging.warning("🚫 Очередь %s переполнена (%s) — запрос отклонён", model, max_queue)
+            raise QueueFull(model, eta)
+        return Admission(ticket, position, await self.eta(model, position))
+
+    async def cancel(self, model: str, ticket: Optional[str]):
+        """Билет больше не нужен (нет генераций, ответ из кэша, задача завершилась)."""
+        if not ticket:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in self._keys(model)[:3]:
+                    pipe.zrem(key, ticket)
+                await pipe.execute()
+        except Exception as e:
+            logging.warning("⚠️ Admission %s: не удалось снять билет: %s", model, e)
+
+    @asynccontextmanager
+    async def slot(self, model: str, ticket: Optional[str] = None):
+        """Ждёт своей очереди и держит слот модели на время блока. Блок отмечает успех в SlotLease."""
+        # Задачи из очереди, принятые до появления билетов, пропускаем вперёд
+        ticket = ticket or f"0:{uuid.uuid4().hex[:12]}"
+        waited = await self._wait_for_slot(model, ticket)
+        observe_stage("admission_wait", waited or 0.0, model)
+        renew = asyncio.create_task(self._renew(model, ticket)) if waited is not None else None
+        lease = SlotLease()
+        started = time.monotonic()
+        try:
+            yield lease
+        finally:
+            if renew:
+                renew.cancel()
+            await self._release(model, ticket, time.monotonic() - started if lease.completed else None)
+
+    async def _try_acquire(self, model: str, ticket: str) -> int:
+        return int(await self._acquire(
+            keys=self._keys(model),
+            args=[time.time(), TICKET_TTL, ticket, self.limit(model), SLOT_LEASE, _ticket_tag(ticket)],
+        ))
+
+    async def _admitted_at(self, model: str, ticket: str) -> float:
+        try:
+            admitted_at = await redis.zscore(self._keys(model)[2], ticket)
+        except Exception:
+            admitted_at = None
+        return float(admitted_at) if admitted_at is not None else time.time()
+
+    async def _wait_for_slot(self, model: str, ticket: str) -> Optional[float]:
+        """
+        Секунды ожидания или None, если Redis недоступен и идём без слота.
+        AdmissionTimeout — если слот не получен за max_wait с момента приёма запроса
+        (в режиме очереди задача могла ещё и полежать в потоке до воркера).
+        """
+        started = time.monotonic()
+        deadline = await self._admitted_at(model, ticket) + self.max_wait(model)
+        while True:
+            try:
+                position = await self._try_acquire(model, ticket)
+            except Exception as e:
+                logging.warning("⚠️ Admission %s: Redis недоступен, генерируем без слота: %s", model, e)
+                return None
+            if position == 0:
+                waited = time.monotonic() - started
+                if waited > POLL_INTERVAL:
+                    logging.info("🎟 %s: слот получен после %.0f сек в очереди", model, waited)
+                return waited
+            if time.time() >= deadline:
+                waited = time.monotonic() - started
+                logging.warning("⌛ %s: слот не получен за %.0f сек (место %s) — задача отменена",
+                                model, waited, position)
+                await self.cancel(model, ticket)
+                raise AdmissionTimeout(model, waited)
+            # Разносим опросы, чтобы сотни ждущих не били в Redis одновременно
+            await asyncio.sleep(POLL_INTERVAL * random.uniform(0.8, 1.2))
+
+    async def _renew(self, model: str, ticket: str):
+        while True:
+            await asyncio.sleep(SLOT_RENEW_INTERVAL)
+            try:
+                await self._try_acquire(model, ticket)
+            except Exception as e:
+                logging.warning("⚠️ Admission %s: не удалось продлить слот: %s", model, e)
+
+    async def _release(self, model: str, ticket: str, duration: Optional[float]):
+        durations_key = f"{self.prefix}:{model}:durations"
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in self._keys(model)[:3]:
+                    pipe.zrem(key, ticket)
+                if duration is not None:
+                    pipe.lpush(durations_key, round(duration, 1))
+                    pipe.ltrim(durations_key, 0, DURATION_SAMPLES - 1)
+                await pipe.execute()
+        except Exception as e:
+            logging.warning("⚠️ Admission %s: не удалось освободить слот: %s", model, e)
+
+
+admission = AdmissionControl()
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import database as db
+
+# Лимит Telegram на рассылку — около 30 сообщений/сек на бота; держим запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", 5))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+BROADCAST_BATCH = 1000
+PROGRESS_INTERVAL = 3.0
+MAX_SEND_ATTEMPTS = 3
+DEACTIVATE_BATCH = 200
+# Владелец рассылки — этот процесс. Прогресс сохраняется раз в PROGRESS_INTERVAL и продлевает аренду;
+# run, чей владелец молчит дольше BROADCAST_LEASE, забирает другая реплика (проверка — раз в CLAIM_INTERVAL)
+BROADCAST_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+BROADCAST_LEASE = 60
+BROADCAST_CLAIM_INTERVAL = 30
+
+
+class TokenBucket:
+    """Общий на всех отправителей лимит: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """RetryAfter от Telegram — флуд-контроль общий для бота, останавливаем всех."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+@dataclass
+class BroadcastStats:
+    total: int
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: bool = False
+    resumed_from: int = 0  # сколько было обработано до рестарта
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def render(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        speed = (self.done - self.resumed_from) / elapsed
+        left = max(self.total - self.done, 0)
+        eta = f"{int(left / speed // 60)} мин {int(left / speed % 60)} сек" if speed > 0 and left else "—"
+        percent = min(100, int(self.done * 100 / self.total)) if self.total else 100
+        bar = "█" * (percent // 10) + "▒" * (10 - percent // 10)
+        title = "✅ <b>Рассылка завершена!</b>" if self.finished else "🚀 <b>Рассылка идёт...</b>"
+        if self.resumed_from and not self.finished:
+            title += " (продолжена после перезапуска)"
+        return (
+            f"{title}\n<code>{bar} {percent}%</code>\n\n"
+            f"📨 Доставлено: <b>{self.sent}</b>\n"
+            f"🚫 Заблокировали бота: <b>{self.blocked}</b>\n"
+            f"❌ Ошибки: <b>{self.failed}</b>\n"
+            f"⚡ Скорость: <b>{speed:.1f}</b>/сек, осталось: {eta}"
+        )
+
+
+async def send_content(bot: Bot, chat_id: int, content: dict):
+    if content["type"] == "text":
+        await bot.send_message(chat_id=chat_id, text=content["text"], parse_mode="HTML")
+    elif content["type"] == "photo":
+        await bot.send_photo(chat_id=chat_id, photo=content["file_id"], caption=content.get("caption"), parse_mode="HTML")
+    elif content["type"] == "video":
+        await bot.send_video(chat_id=chat_id, video=content["file_id"], caption=content.get("caption"), parse_mode="HTML")
+
+
+class BroadcastEngine:
+    """
+    Рассылка фоновой задачей: user_id читаются из Postgres пачками, отправляют
+    concurrency воркеров через общий TokenBucket, прогресс — правкой сообщения админу.
+
+    Прогресс хранится в broadcast_runs: checkpoint — наибольший user_id, до которого
+    включительно обработаны все пачки. После рестарта рассылка продолжается с него
+    (пользователи из недообработанной пачки могут получить сообщение повторно).
+    Заблокировавшие бота помечаются is_active = FALSE и дальше не рассылаются.
+    """
+
+    def __init__(self, bot: Bot, content: dict, admin_chat_id: int, status_message_id: int,
+                 rate: float = BROADCAST_RATE, concurrency: int = BROADCAST_CONCURRENCY,
+                 run_id: Optional[int] = None, stats: Optional[BroadcastStats] = None, checkpoint: int = 0):
+        self.bot = bot
+        self.content = content
+        self.admin_chat_id = admin_chat_id
+        self.status_message_id = status_message_id
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, BROADCAST_BURST)
+        self.stats: Optional[BroadcastStats] = stats
+        self.run_id = run_id
+        self.checkpoint = checkpoint
+        # Пачки в работе: [последний user_id пачки, сколько ещё не обработано]
+        self._batches: deque = deque()
+        self._unreachable = []
+        self._task: Optional[asyncio.Task] = None
+        self.stopped = False  # остановлена админом (а не рестартом процесса)
+
+    async def run(self) -> BroadcastStats:
+        self._task = asyncio.current_task()
+        if self.stats is None:
+            self.stats = BroadcastStats(total=await db.get_users_count())
+        if self.run_id is None:
+            self.run_id = await db.create_broadcast(
+                self.admin_chat_id, self.status_message_id, self.content, self.stats.total, BROADCAST_OWNER
+            )
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        producer = asyncio.create_task(self._produce(queue))
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report_loop())
+        status = "failed"
+        try:
+            await asyncio.gather(producer, *workers)
+            status = "finished"
+        except asyncio.CancelledError:
+            # При рестарте процесса run остаётся running и отпускается — его продолжит следующий процесс
+            status = "cancelled" if self.stopped else "running"
+            raise
+        finally:
+            for task in (producer, *workers, reporter):
+                task.cancel()
+            self.stats.finished = status != "running"
+            await self._flush_unreachable()
+            await self._save(status, release=status == "running")
+            if self.stats.finished:
+                await self._report()
+
+        logging.info("📢 Рассылка завершена: sent=%s blocked=%s failed=%s за %.0f сек",
+                     self.stats.sent, self.stats.blocked, self.stats.failed,
+                     time.monotonic() - self.stats.started)
+        return self.stats
+
+    async def _produce(self, queue: asyncio.Queue):
+        async for batch in db.iter_user_ids(BROADCAST_BATCH, after=self.checkpoint):
+            progress = [batch[-1], len(batch)]
+            self._batches.append(progress)
+            for user_id in batch:
+                await queue.put((user_id, progress))
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            user_id, progress = item
+            await self._deliver(user_id)
+            progress[1] -= 1
+            # Checkpoint двигаем только по полностью обработанным пачкам, по порядку
+            while self._batches and self._batches[0][1] == 0:
+                self.checkpoint = self._batches.popleft()[0]
+
+    async def _deliver(self, user_id: int):
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await send_content(self.bot, user_id, self.content)
+                self.stats.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                self.stats.retries += 1
+                logging.warning("⏳ Флуд-контроль: пауза %s сек", e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.stats.blocked += 1
+                await self._mark_unreachable(user_id)
+                return
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    self.stats.blocked += 1
+                    await self._mark_unreachable(user_id)
+                    return
+                self.stats.failed += 1
+                logging.warning(f"⚠️ Не доставлено {user_id}: {e}")
+                return
+            except Exception as e:
+                self.stats.failed += 1
+                logging.warning(f"⚠️ Не доставлено {user_id}: {e}")
+                return
+        self.stats.failed += 1
+
+    async def _mark_unreachable(self, user_id: int):
+        self._unreachable.append(user_id)
+        if len(self._unreachable) >= DEACTIVATE_BATCH:
+            await self._flush_unreachable()
+
+    async def _flush_unreachable(self):
+        user_ids, self._unreachable = self._unreachable, []
+        try:
+            await db.deactivate_users(user_ids)
+        except Exception as e:
+            logging.warning("⚠️ Не удалось пометить %s недоступных пользователей: %s", len(user_ids), e)
+
+    async def _save(self, status: str = "running", release: bool = False) -> bool:
+        """False — рассылку забрал другой процесс (наша аренда истекла). Ошибку БД считаем временной."""
+        try:
+            return await db.save_broadcast(
+                self.run_id, self.checkpoint, self.stats.sent, self.stats.failed, self.stats.blocked, status,
+                BROADCAST_OWNER, release,
+            )
+        except Exception as e:
+            logging.warning("⚠️ Не удалось сохранить прогресс рассылки %s: %s", self.run_id, e)
+            return True
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if not await self._save():
+                logging.warning("⚠️ Рассылку #%s продолжает другой процесс — здесь останавливаем", self.run_id)
+                self._task.cancel()
+                return
+            await self._report()
+
+    async def _report(self):
+        try:
+            await self.bot.edit_message_text(
+                self.stats.render(), chat_id=self.admin_chat_id, message_id=self.status_message_id, parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+        except TelegramBadRequest:
+            pass  # message is not modified
+        except Exception as e:
+            logging.warning("⚠️ Не удалось обновить прогресс рассылки: %s", e)
+
+
+active_broadcasts: Dict[asyncio.Task, BroadcastEngine] = {}
+
+
+async def _run_safely(engine: BroadcastEngine):
+    try:
+        await engine.run()
+    except asyncio.CancelledError:
+        logging.warning("🛑 Рассылка остановлена")
+        raise
+    except Exception as e:
+        logging.exception("❌ Рассылка упала: %s", e)
+        await engine.bot.send_message(engine.admin_chat_id, f"❌ Рассылка прервана ошибкой: {e}")
+
+
+def start_broadcast(bot: Bot, content: dict, admin_chat_id: int, status_message_id: int) -> asyncio.Task:
+    """Запускает рассылку в фоне; хендлер админа сразу освобождается."""
+    return _track(BroadcastEngine(bot, content, admin_chat_id, status_message_id))
+
+
+def _track(engine: BroadcastEngine) -> asyncio.Task:
+    task = asyncio.create_task(_run_safely(engine))
+    active_broadcasts[task] = engine
+    task.add_done_callback(lambda t: active_broadcasts.pop(t, None))
+    return task
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Забирает и продолжает рассылки, прерванные рестартом или падением процесса-владельца."""
+    running = {engine.run_id for engine in active_broadcasts.values()}
+    runs = [run for run in await db.claim_broadcasts(BROADCAST_OWNER, BROADCAST_LEASE) if run["id"] not in running]
+    for run in runs:
+        stats = BroadcastStats(
+            total=run["total"], sent=run["sent"], failed=run["failed"], blocked=run["blocked"],
+        )
+        stats.resumed_from = stats.done
+        engine = BroadcastEngine(
+            bot, json.loads(run["content"]), run["admin_chat_id"], run["status_message_id"],
+            run_id=run["id"], stats=stats, checkpoint=run["last_user_id"],
+        )
+        logging.info("📢 Продолжаем рассылку #%s с user_id > %s", run["id"], run["last_user_id"])
+        _track(engine)
+    return len(runs)
+
+
+async def watch_broadcasts(bot: Bot):
+    """Фоновый цикл: подхватывает рассылки, отпущенные или брошенные другими процессами."""
+    while True:
+        try:
+            await resume_broadcasts(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("❌ Не удалось возобновить рассылки: %s", e)
+        await asyncio.sleep(BROADCAST_CLAIM_INTERVAL)
+
+
+def stop_broadcasts() -> int:
+    for task, engine in list(active_broadcasts.items()):
+        engine.stopped = True
+        task.cancel()
+    return len(active_broadcasts)
+
+
+async def close_broadcasts():
+    """Остановка процесса: рассылки сохраняют прогресс и отпускаются до закрытия пула БД."""
+    tasks = list(active_broadcasts)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,112 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from app.bot import redis
+
+
+class LRUCache:
+    """Небольшой in-process кэш с TTL и вытеснением самых старых записей."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш строк: L1 в памяти процесса, L2 — общий Redis с TTL
+    (общий для всех процессов). С max_entries старые записи вытесняются по количеству,
+    иначе — по памяти политикой самого Redis.
+    Ошибки Redis не ломают вызывающий код: кэш просто промахивается.
+    """
+
+    def __init__(self, prefix: str, ttl: int, l1_size: int = 4096, l1_ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.l1 = LRUCache(l1_size, l1_ttl or ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.l1.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        try:
+            raw = await redis.get(self._key(key))
+        except Exception as e:
+            logging.warning("⚠️ Redis cache %s недоступен: %s", self.prefix, e)
+            raw = None
+
+        if raw is None:
+            self.misses += 1
+            return None
+
+        value = raw.decode() if isinstance(raw, bytes) else raw
+        self.l1.set(key, value)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        ttl = ttl or self.ttl
+        self.l1.set(key, value, min(ttl, self.l1.ttl))
+        try:
+            if self.max_entries is None:
+                await redis.set(self._key(key), value, ex=ttl)
+                return
+
+            # Ограничение по размеру: индекс ключей по времени записи, лишние старые удаляем
+            index = self._key("__index__")
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(self._key(key), value, ex=ttl)
+                pipe.zadd(index, {key: time.time()})
+                pipe.zremrangebyscore(index, "-inf", time.time() - ttl)
+                pipe.zcard(index)
+                *_, size = await pipe.execute()
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = await redis.zpopmin(index, overflow)
+                if evicted:
+                    await redis.delete(*(self._key(k.decode() if isinstance(k, bytes) else k) for k, _ in evicted))
+        except Exception as e:
+            logging.warning("⚠️ Redis cache %s: не удалось сохранить: %s", self.prefix, e)
+
+    async def delete(self, key: str):
+        self.l1.pop(key)
+        try:
+            await redis.delete(self._key(key))
+        except Exception as e:
+            logging.warning("⚠️ Redis cache %s: не удалось удалить: %s", self.prefix, e)
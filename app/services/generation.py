@@ -1,6 +1,11 @@
+import asyncio
+import hashlib
+import json
 import logging
+import os
 import traceback
-from typing import Tuple, Optional, List
+import uuid
+from typing import Tuple, Optional, List, Sequence
 
 from app.services.models.images.nanabanana import NanoBanana
 from app.services.models.images.nanabanana_pro import NanoBananaPro
@@ -8,6 +13,8 @@ from app.services.models.images.seedream import Seedream
 from app.services.models.video.kling_standard import KlingStandard
 from app.services.models.video.kling_motion import KlingMotionControl
 
+from app.services.cache import TieredCache
+from app.services import metrics
 import database as db
 
 COSTS = {
@@ -20,6 +27,40 @@ COSTS = {
 }
 
 
+# Кэш готовых результатов: ключ запроса -> file_id уже отправленного в Telegram медиа
+RESULT_CACHE_TTL = 7 * 24 * 3600
+RESULT_CACHE_MAX_ENTRIES = 200_000
+result_cache = TieredCache("gen:result", ttl=RESULT_CACHE_TTL, l1_size=2048, max_entries=RESULT_CACHE_MAX_ENTRIES)
+
+
+def _normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").split()).casefold()
+
+
+def result_cache_key(model: str, prompt: str, reference_ids: Sequence[Optional[str]]) -> Optional[str]:
+    """
+    Ключ запроса: модель + нормализованный промпт + идентификаторы содержимого референсов
+    (file_unique_id Telegram одинаков для одного и того же файла).
+    None — если хоть один референс неизвестен и кэшировать нельзя.
+    """
+    if not reference_ids or not all(reference_ids):
+        return None
+    raw = json.dumps([model, _normalize_prompt(prompt), list(reference_ids)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def get_cached_result(cache_key: Optional[str]) -> Optional[str]:
+    """file_id ранее доставленного результата или None."""
+    if not cache_key:
+        return None
+    return await result_cache.get(cache_key)
+
+
+async def store_cached_result(cache_key: Optional[str], file_id: Optional[str]):
+    if cache_key and file_id:
+        await result_cache.set(cache_key, file_id)
+
+
 async def has_balance(user_id: int, model_or_cost) -> bool:
     try:
         cost = COSTS.get(model_or_cost, model_or_cost) if isinstance(model_or_cost, str) else model_or_cost
@@ -34,29 +75,85 @@ async def charge(user_id: int, model_or_cost):
     await db.update_balance(user_id, -cost)
 
 
+# Холд живёт дольше самой долгой генерации с очередью; потом генерации возвращаются автоматически
+CREDIT_HOLD_TTL = int(os.getenv("CREDIT_HOLD_TTL", 3600))
+HOLD_SWEEP_INTERVAL = 300
+
+
+async def reserve(user_id: int, model_or_cost) -> Optional[str]:
+    """Атомарно резервирует стоимость генерации. Возвращает hold_id или None, если не хватает."""
+    cost = COSTS.get(model_or_cost, model_or_cost) if isinstance(model_or_cost, str) else model_or_cost
+    hold_id = uuid.uuid4().hex
+    try:
+        remaining = await db.reserve_credits(user_id, cost, hold_id, CREDIT_HOLD_TTL)
+    except Exception as e:
+        logging.error("❌ Не удалось зарезервировать генерации user=%s: %s", user_id, e)
+        return None
+    return hold_id if remaining is not None else None
+
+
+async def settle(user_id: int, model_or_cost, hold_id: Optional[str]):
+    """Результат доставлен: подтверждаем холд (старые задачи без холда списываем как раньше)."""
+    if not hold_id:
+        await charge(user_id, model_or_cost)
+        return
+    if not await db.commit_credits(hold_id):
+        logging.warning("⚠️ Холд %s уже закрыт — генерация user=%s не списана", hold_id, user_id)
+
+
+async def refund(hold_id: Optional[str]):
+    """Результата не будет (ошибка, кэш): возвращаем зарезервированное. Ошибки только логируем."""
+    if not hold_id:
+        return
+    try:
+        await db.release_credits(hold_id)
+    except Exception as e:
+        logging.error("❌ Не удалось вернуть холд %s: %s", hold_id, e)
+
+
+async def sweep_expired_holds():
+    """Фоновый цикл: возвращает генерации по холдам упавших задач."""
+    while True:
+        try:
+            released = await db.release_expired_holds()
+            if released:
+                logging.warning("♻️ Возвращены генерации по %s просроченным холдам", released)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("❌ Ошибка возврата просроченных холдов: %s", e)
+        await asyncio.sleep(HOLD_SWEEP_INTERVAL)
+
+
 # ================================
 # 🔥 ГЕНЕРАЦИЯ ФОТО (Диспетчер)
 # ================================
 async def generate(
     image_urls: List[str],
     prompt: str,
-    model: str
+    model: str,
+    stream: bool = False,
 ) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    with metrics.stage_timer("generate", model):
+        return await _generate(image_urls, prompt, model, stream)
+
+
+async def _generate(image_urls, prompt, model, stream):
     try:
         logging.info("--- 🛠 Выбор модели фото: %s ---", model)
 
         if model == "nanabanana":
             engine = NanoBanana()
-            return await engine.generate(prompt, image_urls=image_urls)
+            return await engine.generate(prompt, image_urls=image_urls, stream=stream)
 
         elif model == "nanabanana_pro":
             engine = NanoBananaPro()
             # ✅ КРИТИЧЕСКИЙ ФИКС: передаём референсы в PRO
-            return await engine.generate(prompt, image_urls=image_urls)
+            return await engine.generate(prompt, image_urls=image_urls, stream=stream)
 
         elif model == "seedream":
             engine = Seedream()
-            return await engine.generate(prompt, image_urls=image_urls)
+            return await engine.generate(prompt, image_urls=image_urls, stream=stream)
 
         return None, None, None
 
@@ -66,9 +163,6 @@ async def generate(
         return None, None, None
 
 
-# ================================
-# 🔥 ГЕНЕРАЦИЯ ВИДЕО (Диспетчер)
-# ================================
 # ================================
 # 🔥 ГЕНЕРАЦИЯ ВИДЕО (Диспетчер)
 # ================================
@@ -76,8 +170,14 @@ async def generate_video(
     image_url: str,
     prompt: str,
     model: str = "kling_5",
-    motion_video_url: str = None
+    motion_video_url: str = None,
+    stream: bool = False,
 ) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    with metrics.stage_timer("generate", model):
+        return await _generate_video(image_url, prompt, model, motion_video_url, stream)
+
+
+async def _generate_video(image_url, prompt, model, motion_video_url, stream):
     try:
         logging.info("--- 🎬 Выбор видео-движка: %s ---", model)
 
@@ -86,14 +186,14 @@ async def generate_video(
                 logging.error("❌ Для kling_motion нужны и фото, и видео референсы")
                 return None, None, None
             engine = KlingMotionControl()
-            return await engine.generate(prompt, image_url, motion_video_url)
+            return await engine.generate(prompt, image_url, motion_video_url, stream=stream)
 
         elif model in ("kling_5", "kling_10"):
             # ✅ Сразу задаём как строки "5" или "10"
             duration = "5" if model == "kling_5" else "10"
             engine = KlingStandard()
             img_list = [image_url] if image_url else None
-            return await engine.generate(prompt, image_urls=img_list, duration=duration)
+            return await engine.generate(prompt, image_urls=img_list, duration=duration, stream=stream)
 
         return None, None, None
 
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import Bot
+from redis.exceptions import ResponseError
+
+from app.bot import redis
+
+# "redis" — хендлеры кладут задачи в поток, генерацию делают процессы worker.py;
+# "local" — как раньше, asyncio.create_task в процессе бота
+QUEUE_MODE = os.getenv("GENERATION_QUEUE", "local")
+
+STREAM = "generation:jobs"
+DEAD_STREAM = "generation:jobs:dead"
+GROUP = "generation-workers"
+STREAM_MAXLEN = 100_000
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 50))
+# Задача без heartbeat дольше этого времени считается брошенной (воркер упал) и забирается другим
+CLAIM_IDLE_MS = 60_000
+HEARTBEAT_INTERVAL = 20
+RECLAIM_INTERVAL = 15
+MAX_DELIVERIES = 3
+# Имя consumer'а содержит pid, поэтому после каждого рестарта остаётся старый; без pending
+# и без активности дольше этого он удаляется из группы при старте воркера
+CONSUMER_PRUNE_IDLE_MS = 15 * 60_000
+
+JobHandler = Callable[..., Awaitable[Any]]
+
+
+def queue_enabled() -> bool:
+    return QUEUE_MODE == "redis"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def enqueue_job(kind: str, **payload) -> str:
+    """Кладёт задачу генерации в Redis Stream. Возвращает id записи."""
+    job_id = await redis.xadd(
+        STREAM,
+        {"kind": kind, "payload": json.dumps(payload, ensure_ascii=False), "enqueued_at": str(time.time())},
+        maxlen=STREAM_MAXLEN,
+        approximate=True,
+    )
+    job_id = _decode(job_id)
+    logging.info("📥 Задача %s поставлена в очередь: %s (user=%s)", kind, job_id, payload.get("user_id"))
+    return job_id
+
+
+async def ensure_group():
+    try:
+        await redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        logging.info("✅ Создана consumer group %s", GROUP)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+class JobWorker:
+    """
+    Читает задачи из потока через consumer group, выполняет их с ограничением
+    параллельности и подтверждает (XACK) только после завершения.
+    Задачи упавших воркеров забираются по таймауту heartbeat; задачу, которая так и не
+    выполнилась за MAX_DELIVERIES доставок, получает dead_letter(bot, kind, **payload).
+    """
+
+    def __init__(self, bot: Bot, handlers: Dict[str, JobHandler], consumer: str,
+                 concurrency: int = WORKER_CONCURRENCY, dead_letter: Optional[JobHandler] = None):
+        self.bot = bot
+        self.handlers = handlers
+        self.dead_letter = dead_letter
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self.running: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        await ensure_group()
+        await self._prune_consumers()
+        logging.info("👷 Воркер %s запущен (concurrency=%s)", self.consumer, self.concurrency)
+        reclaimer = asyncio.create_task(self._reclaim_loop())
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(self.running)
+                if free <= 0:
+                    await asyncio.wait(self.running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                try:
+                    response = await redis.xreadgroup(
+                        GROUP, self.consumer, {STREAM: ">"}, count=free, block=5000
+                    )
+                except Exception as e:
+                    logging.error("❌ Ошибка чтения очереди: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+
+                for _stream, messages in response or []:
+                    for message_id, fields in messages:
+                        self._spawn(_decode(message_id), fields)
+        finally:
+            reclaimer.cancel()
+            if self.running:
+                logging.info("⏳ Воркер %s ждёт завершения %s задач", self.consumer, len(self.running))
+                await asyncio.gather(*self.running, return_exceptions=True)
+
+    def _spawn(self, message_id: str, fields: dict):
+        task = asyncio.create_task(self._process(message_id, fields))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _process(self, message_id: str, fields: dict):
+        fields = {_decode(k): _decode(v) for k, v in fields.items()}
+        kind = fields.get("kind")
+        handler = self.handlers.get(kind)
+
+        heartbeat = asyncio.create_task(self._heartbeat(message_id))
+        try:
+            if handler is None:
+                logging.error("❌ Неизвестный тип задачи %s (%s)", kind, message_id)
+            else:
+                payload = json.loads(fields.get("payload") or "{}")
+                logging.info("⚙️ Воркер %s взял задачу %s (%s)", self.consumer, message_id, kind)
+                await handler(self.bot, **payload)
+            await redis.xack(STREAM, GROUP, message_id)
+        except asyncio.CancelledError:
+            # Без XACK задача останется в pending и будет передоставлена
+            raise
+        except Exception as e:
+            logging.error("❌ Задача %s упала: %s", message_id, e)
+        finally:
+            heartbeat.cancel()
+
+    async def _prune_consumers(self):
+        """Удаляет из группы consumer'ов прошлых запусков: без pending и давно неактивных."""
+        try:
+            consumers = await redis.xinfo_consumers(STREAM, GROUP)
+            for consumer in consumers:
+                name = _decode(consumer["name"])
+                if name == self.consumer or consumer["pending"] or consumer["idle"] < CONSUMER_PRUNE_IDLE_MS:
+                    continue
+                await redis.xgroup_delconsumer(STREAM, GROUP, name)
+                logging.info("🧹 Удалён consumer %s (неактивен %s мин)", name, consumer["idle"] // 60_000)
+        except Exception as e:
+            logging.warning("⚠️ Не удалось почистить consumer'ов: %s", e)
+
+    async def _heartbeat(self, message_id: str):
+        """Сбрасываем idle-время записи, чтобы её не забрали живые соседи."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await redis.xclaim(STREAM, GROUP, self.consumer, min_idle_time=0,
+                                   message_ids=[message_id], justid=True)
+            except Exception as e:
+                logging.warning("⚠️ heartbeat %s: %s", message_id, e)
+
+    async def _reclaim_loop(self):
+        while True:
+            await asyncio.sleep(RECLAIM_INTERVAL)
+            try:
+                await self._reclaim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("❌ Ошибка переназначения задач: %s", e)
+
+    async def _reclaim(self):
+        free = self.concurrency - len(self.running)
+        if free <= 0 or self._stopping.is_set():
+            return
+
+        pending = await redis.xpending_range(STREAM, GROUP, "-", "+", free, idle=CLAIM_IDLE_MS)
+        for entry in pending:
+            message_id = _decode(entry["message_id"])
+            claimed = await redis.xclaim(STREAM, GROUP, self.consumer, min_idle_time=CLAIM_IDLE_MS,
+                                         message_ids=[message_id])
+            if not claimed:
+                continue  # успел забрать другой воркер
+            _, fields = claimed[0]
+            if not fields:
+                # Запись уже вытеснена из потока по MAXLEN — выполнять нечего
+                await redis.xack(STREAM, GROUP, message_id)
+                continue
+
+            if entry["times_delivered"] >= MAX_DELIVERIES:
+                logging.error("☠️ Задача %s доставлялась %s раз — в dead-letter", message_id, entry["times_delivered"])
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.xadd(DEAD_STREAM, {**fields, "source_id": message_id}, maxlen=STREAM_MAXLEN, approximate=True)
+                    pipe.xack(STREAM, GROUP, message_id)
+                    await pipe.execute()
+                await self._bury(message_id, fields)
+                continue
+
+            logging.warning("♻️ Воркер %s забрал брошенную задачу %s (доставка #%s)",
+                            self.consumer, message_id, entry["times_delivered"] + 1)
+            self._spawn(message_id, fields)
+
+    async def _bury(self, message_id: str, fields: dict):
+        """Задача ушла в dead-letter: сразу возвращаем генерации и сообщаем пользователю."""
+        if self.dead_letter is None:
+            return
+        fields = {_decode(k): _decode(v) for k, v in fields.items()}
+        try:
+            payload = json.loads(fields.get("payload") or "{}")
+            await self.dead_letter(self.bot, fields.get("kind"), **payload)
+        except Exception as e:
+            logging.error("❌ Не удалось обработать dead-letter задачу %s: %s", message_id, e)
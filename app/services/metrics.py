@@ -0,0 +1,241 @@
+import bisect
+import contextvars
+import hmac
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import TraceConfig, web
+
+from app.services.tracing import add_span
+
+# Токен для /metrics (?token= или Authorization: Bearer). Без него /metrics отдаётся только
+# на внутреннем METRICS_PORT (worker.py) — на публичный порт webhook маршрут не монтируется
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Порт отдельного /metrics для процессов без aiohttp-сервера (worker.py): METRICS_PORT + номер процесса
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Секунды: от быстрых запросов к Telegram до генерации Motion Control
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Модель текущей задачи генерации: задаётся в начале задачи, её видят все этапы внутри
+current_model = contextvars.ContextVar("current_model", default="none")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for values, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {value}")
+        return lines
+
+
+class Histogram:
+    """На горячем пути — bisect и два сложения; накопительные суммы считаются при сборе."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам..., +Inf, сумма]
+        self.series: Dict[LabelValues, List[float]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labelvalues: str):
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series[labelvalues] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Collected:
+    """Значение читается только при сборе (размер пула, число задач) — на горячем пути ничего."""
+
+    def __init__(self, name: str, documentation: str,
+                 collect: Callable[[], Union[float, Dict[LabelValues, float], None]],
+                 labelnames: Sequence[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        try:
+            value = self.collect()
+        except Exception as e:
+            logging.debug("metrics: %s не собран: %s", self.name, e)
+            return []
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, sample in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {sample}")
+        return lines
+
+
+REGISTRY: List[Union[Counter, Histogram, Collected]] = []
+
+
+def gauge(name: str, documentation: str, collect, labelnames: Sequence[str] = ()) -> Collected:
+    return Collected(name, documentation, collect, labelnames)
+
+
+def counter_from(name: str, documentation: str, collect, labelnames: Sequence[str] = ()) -> Collected:
+    """Счётчик, который уже ведётся в другом объекте (например, опросы Polza)."""
+    return Collected(name, documentation, collect, labelnames, kind="counter")
+
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds", "Длительность этапов генерации", ("stage", "model"),
+)
+HTTP_BYTES = Counter("bot_http_bytes_total", "Байты через общий HTTP-пул и в Telegram", ("direction",))
+FSM_SECONDS = Histogram("bot_fsm_redis_seconds", "Задержка операций FSM в Redis", ("op",), buckets=FAST_BUCKETS)
+
+
+# Этапы bot_stage_seconds и условие, при котором процесс вообще может их записать.
+# Гистограмма появляется только после первого замера; bot_stage_available отличает
+# «этап не случался» (1) от «в этом процессе этап не записать» (0, например нет ffmpeg)
+STAGES: Dict[str, Callable[[], bool]] = {
+    "admission_wait": lambda: True,
+    "get_file": lambda: True,
+    "reference_download": lambda: True,
+    "telegraph_upload": lambda: True,
+    "polza_submit": lambda: True,
+    "completion": lambda: True,
+    "generate": lambda: True,
+    # В stream-режиме — время чтения результата из Polza, которое идёт параллельно telegram_send
+    "result_download": lambda: True,
+    "ffmpeg": lambda: shutil.which("ffmpeg") is not None,
+    "telegram_send": lambda: True,
+}
+gauge(
+    "bot_stage_available", "1 — этап может быть записан этим процессом, 0 — нет",
+    lambda: {(stage,): int(available()) for stage, available in STAGES.items()}, ("stage",),
+)
+
+
+def observe_stage(stage: str, seconds: float, model: Optional[str] = None):
+    """Гистограмма этапа и span в трассе текущей задачи (если она есть)."""
+    STAGE_SECONDS.observe(seconds, stage, model or current_model.get())
+    add_span(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, model: Optional[str] = None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, model)
+
+
+def http_trace_config(polza_base_url: str) -> TraceConfig:
+    """
+    Трассировка общей сессии aiohttp: байты в обе стороны и время отправки задачи в Polza
+    (POST {base}/media) — без правок в каждом движке.
+    """
+    submit_url = polza_base_url.rstrip("/") + "/media"
+    trace = TraceConfig()
+
+    async def on_request_start(_session, ctx, params):
+        ctx.started = time.perf_counter()
+
+    async def on_request_end(_session, ctx, params):
+        if params.method == "POST" and str(params.url) == submit_url:
+            observe_stage("polza_submit", time.perf_counter() - ctx.started)
+
+    async def on_request_chunk_sent(_session, _ctx, params):
+        HTTP_BYTES.inc("out", amount=len(params.chunk))
+
+    async def on_response_chunk_received(_session, _ctx, params):
+        HTTP_BYTES.inc("in", amount=len(params.chunk))
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace.on_response_chunk_received.append(on_response_chunk_received)
+    return trace
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    if METRICS_TOKEN:
+        # Сравнение за постоянное время: токен не подбирается по задержке ответа
+        token = request.query.get("token", "").encode()
+        auth = request.headers.get("Authorization", "").encode()
+        if not (hmac.compare_digest(token, METRICS_TOKEN.encode())
+                or hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}".encode())):
+            return web.Response(status=403)
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """Отдельный /metrics для процессов без своего aiohttp-сервера."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logging.info("📈 /metrics на порту %s", port)
+    return runner
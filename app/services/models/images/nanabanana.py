@@ -1,7 +1,6 @@
-import asyncio
 import logging
-import aiohttp
-from app.network import BASE_URL, POLZA_API_KEY, get_connector, timeout_config, _download_content_bytes
+from app.network import BASE_URL, POLZA_API_KEY, get_polza_client, add_callback_url, fetch_result
+from app.services.polza_poller import get_polza_poller
 
 
 def _as_dict(payload):
@@ -21,7 +20,7 @@ class NanoBanana:
             "Content-Type": "application/json"
         }
 
-    async def generate(self, prompt: str, image_urls: list = None):
+    async def generate(self, prompt: str, image_urls: list = None, stream: bool = False):
         payload_input = {
             "prompt": prompt,
             "aspect_ratio": "1:1",
@@ -37,57 +36,49 @@ class NanoBanana:
             "input": payload_input,
             "async": True
         }
+        add_callback_url(payload)
 
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout_config) as session:
-            try:
-                logging.info("🍌 Nano Banana Request: %s", self.model_id)
+        session = (await get_polza_client()).session
+        try:
+            logging.info("🍌 Nano Banana Request: %s", self.model_id)
 
-                async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
-                    if resp.status not in (200, 201):
-                        err = await resp.text()
-                        logging.error("❌ Nano Banana Start Error: %s", err)
-                        return None, None, None
+            async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
+                if resp.status not in (200, 201):
+                    err = await resp.text()
+                    logging.error("❌ Nano Banana Start Error: %s", err)
+                    return None, None, None
 
-                    raw_data = await resp.json(content_type=None)
-                    data = _as_dict(raw_data)
-                    request_id = data.get("id") or data.get("request_id")
+                raw_data = await resp.json(content_type=None)
+                data = _as_dict(raw_data)
+                request_id = data.get("id") or data.get("request_id")
 
-                    if not request_id:
-                        logging.error("❌ Nano Banana: не найден request_id. raw=%r", raw_data)
-                        return None, None, None
+                if not request_id:
+                    logging.error("❌ Nano Banana: не найден request_id. raw=%r", raw_data)
+                    return None, None, None
 
-                for _ in range(40):
-                    await asyncio.sleep(4)
+            res = await get_polza_poller().wait(request_id, self.model_id, interval=4, timeout=4 * 40)
+            if not res:
+                return None, None, None
 
-                    async with session.get(f"{BASE_URL}/media/{request_id}", headers=self.headers) as r:
-                        if r.status != 200:
-                            continue
+            if res.get("status") == "completed":
+                data_obj = _as_dict(res.get("data"))
+                final_url = data_obj.get("url") or res.get("url")
 
-                        raw_res = await r.json(content_type=None)
-                        res = _as_dict(raw_res)
-                        status = res.get("status")
+                if not final_url:
+                    # fallback: иногда может быть массив outputs
+                    outputs = res.get("outputs")
+                    if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
+                        final_url = outputs[0].get("url")
 
-                        if status == "completed":
-                            data_obj = _as_dict(res.get("data"))
-                            final_url = data_obj.get("url") or res.get("url")
+                if not final_url:
+                    logging.error("❌ Nano Banana completed без url. raw=%r", res)
+                    return None, None, None
 
-                            if not final_url:
-                                # fallback: иногда может быть массив outputs
-                                outputs = res.get("outputs")
-                                if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
-                                    final_url = outputs[0].get("url")
+                return await fetch_result(session, final_url, stream=stream, default_ext="jpg")
 
-                            if not final_url:
-                                logging.error("❌ Nano Banana completed без url. raw=%r", raw_res)
-                                return None, None, None
+            logging.error("❌ Nano Banana Failed: %s | raw=%r", res.get("error"), res)
 
-                            return await _download_content_bytes(session, final_url)
-
-                        if status in ("failed", "cancelled"):
-                            logging.error("❌ Nano Banana Failed: %s | raw=%r", res.get("error"), raw_res)
-                            break
-
-            except Exception as e:
-                logging.error("❌ Nano Banana Exception: %s", e)
+        except Exception as e:
+            logging.error("❌ Nano Banana Exception: %s", e)
 
         return None, None, None
\ No newline at end of file
@@ -1,7 +1,6 @@
-import asyncio
 import logging
-import aiohttp
-from app.network import BASE_URL, POLZA_API_KEY, get_connector, timeout_config, _download_content_bytes
+from app.network import BASE_URL, POLZA_API_KEY, get_polza_client, add_callback_url, fetch_result
+from app.services.polza_poller import get_polza_poller
 
 
 def _as_dict(payload):
@@ -46,7 +45,8 @@ class NanoBananaPro:
             "Content-Type": "application/json"
         }
 
-    async def generate(self, prompt: str, image_urls=None, resolution: str = "1K", aspect_ratio: str = "1:1"):
+    async def generate(self, prompt: str, image_urls=None, resolution: str = "1K", aspect_ratio: str = "1:1",
+                       stream: bool = False):
         payload_input = {
             "prompt": prompt,
             "aspect_ratio": aspect_ratio if self.is_pro or aspect_ratio != "auto" else "1:1",
@@ -69,51 +69,44 @@ class NanoBananaPro:
             "input": payload_input,
             "async": True
         }
-
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout_config) as session:
-            try:
-                logging.info("🍌 Nano Banana %s Request", "PRO" if self.is_pro else "Base")
-
-                async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
-                    if resp.status not in (200, 201):
-                        logging.error("❌ API Error: %s", await resp.text())
-                        return None, None, None
-
-                    raw_data = await resp.json(content_type=None)
-                    data = _as_dict(raw_data)
-                    request_id = data.get("id") or data.get("request_id")
-                    if not request_id:
-                        logging.error("❌ request_id не найден. raw=%r", raw_data)
-                        return None, None, None
-
-                max_attempts = 60 if self.is_pro else 30
-                for _ in range(max_attempts):
-                    await asyncio.sleep(5)
-                    async with session.get(f"{BASE_URL}/media/{request_id}", headers=self.headers) as r:
-                        if r.status != 200:
-                            continue
-
-                        raw_res = await r.json(content_type=None)
-                        res = _as_dict(raw_res)
-                        status = res.get("status")
-
-                        if status == "completed":
-                            data_obj = _as_dict(res.get("data"))
-                            final_url = data_obj.get("url") or res.get("url")
-                            if not final_url:
-                                outputs = res.get("outputs")
-                                if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
-                                    final_url = outputs[0].get("url")
-                            if not final_url:
-                                logging.error("❌ completed без url. raw=%r", raw_res)
-                                return None, None, None
-                            return await _download_content_bytes(session, final_url)
-
-                        if status in ("failed", "error", "cancelled"):
-                            logging.error("❌ Generation failed: %s | raw=%r", res.get("error"), raw_res)
-                            break
-
-            except Exception as e:
-                logging.error("❌ Exception in NanoBananaPro: %s", e)
+        add_callback_url(payload)
+
+        session = (await get_polza_client()).session
+        try:
+            logging.info("🍌 Nano Banana %s Request", "PRO" if self.is_pro else "Base")
+
+            async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
+                if resp.status not in (200, 201):
+                    logging.error("❌ API Error: %s", await resp.text())
+                    return None, None, None
+
+                raw_data = await resp.json(content_type=None)
+                data = _as_dict(raw_data)
+                request_id = data.get("id") or data.get("request_id")
+                if not request_id:
+                    logging.error("❌ request_id не найден. raw=%r", raw_data)
+                    return None, None, None
+
+            max_attempts = 60 if self.is_pro else 30
+            res = await get_polza_poller().wait(request_id, self.model_id, interval=5, timeout=5 * max_attempts)
+            if not res:
+                return None, None, None
+
+            if res.get("status") == "completed":
+                data_obj = _as_dict(res.get("data"))
+                final_url = data_obj.get("url") or res.get("url")
+                if not final_url:
+                    outputs = res.get("outputs")
+                    if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
+                        final_url = outputs[0].get("url")
+                if not final_url:
+                    logging.error("❌ completed без url. raw=%r", res)
+                    return None, None, None
+                return await fetch_result(session, final_url, stream=stream, default_ext="jpg")
+
+            logging.error("❌ Generation failed: %s | raw=%r", res.get("error"), res)
+
+        except Exception as e:
+            logging.error("❌ Exception in NanoBananaPro: %s", e)
 
         return None, None, None
\ No newline at end of file
@@ -1,8 +1,7 @@
-import asyncio
 import logging
-import aiohttp
 from typing import Optional, Tuple
-from app.network import BASE_URL, POLZA_API_KEY, get_connector, timeout_config, _download_content_bytes
+from app.network import BASE_URL, POLZA_API_KEY, get_polza_client, add_callback_url, fetch_result
+from app.services.polza_poller import get_polza_poller
 
 
 def _as_dict(payload):
@@ -47,7 +46,8 @@ class Seedream:
             "Content-Type": "application/json"
         }
 
-    async def generate(self, prompt: str, image_urls=None, quality: str = "basic", aspect_ratio: str = "1:1") -> Tuple[
+    async def generate(self, prompt: str, image_urls=None, quality: str = "basic", aspect_ratio: str = "1:1",
+                       stream: bool = False) -> Tuple[
         Optional[bytes], Optional[str], Optional[str]]:
         # Ограничение промпта по доке (до 3000 символов)
         prompt = prompt[:3000]
@@ -69,53 +69,46 @@ class Seedream:
             "input": payload_input,
             "async": True
         }
-
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout_config) as session:
-            try:
-                logging.info("🌊 Seedream Request (Quality: %s)", quality)
-                async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
-                    if resp.status not in (200, 201):
-                        logging.error("❌ Seedream Error: %s", await resp.text())
-                        return None, None, None
-
-                    raw_data = await resp.json(content_type=None)
-                    data = _as_dict(raw_data)
-                    request_id = data.get("id") or data.get("request_id")
-
-                    if not request_id:
-                        logging.error("❌ Seedream request_id не найден. raw=%r", raw_data)
-                        return None, None, None
-
-                # Polling: Seedream довольно быстрая (проверка каждые 5 сек)
-                for attempt in range(40):  # До ~200 секунд
-                    await asyncio.sleep(5)
-                    async with session.get(f"{BASE_URL}/media/{request_id}", headers=self.headers) as r:
-                        if r.status != 200:
-                            continue
-
-                        raw_res = await r.json(content_type=None)
-                        res = _as_dict(raw_res)
-                        status = res.get("status")
-
-                        if status == "completed":
-                            data_obj = _as_dict(res.get("data"))
-                            final_url = data_obj.get("url") or res.get("url")
-                            if not final_url:
-                                outputs = res.get("outputs")
-                                if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
-                                    final_url = outputs[0].get("url")
-
-                            if not final_url:
-                                logging.error("❌ Seedream completed без url. raw=%r", raw_res)
-                                return None, None, None
-
-                            return await _download_content_bytes(session, final_url)
-
-                        if status in ("failed", "error", "cancelled"):
-                            logging.error("❌ Seedream Failed: %s | raw=%r", res.get("error"), raw_res)
-                            break
-
-            except Exception as e:
-                logging.error("❌ Seedream Exception: %s", e)
+        add_callback_url(payload)
+
+        session = (await get_polza_client()).session
+        try:
+            logging.info("🌊 Seedream Request (Quality: %s)", quality)
+            async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
+                if resp.status not in (200, 201):
+                    logging.error("❌ Seedream Error: %s", await resp.text())
+                    return None, None, None
+
+                raw_data = await resp.json(content_type=None)
+                data = _as_dict(raw_data)
+                request_id = data.get("id") or data.get("request_id")
+
+                if not request_id:
+                    logging.error("❌ Seedream request_id не найден. raw=%r", raw_data)
+                    return None, None, None
+
+            # Polling: Seedream довольно быстрая (проверка каждые 5 сек, до ~200 секунд)
+            res = await get_polza_poller().wait(request_id, self.model_id, interval=5, timeout=5 * 40)
+            if not res:
+                return None, None, None
+
+            if res.get("status") == "completed":
+                data_obj = _as_dict(res.get("data"))
+                final_url = data_obj.get("url") or res.get("url")
+                if not final_url:
+                    outputs = res.get("outputs")
+                    if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
+                        final_url = outputs[0].get("url")
+
+                if not final_url:
+                    logging.error("❌ Seedream completed без url. raw=%r", res)
+                    return None, None, None
+
+                return await fetch_result(session, final_url, stream=stream, default_ext="jpg")
+
+            logging.error("❌ Seedream Failed: %s | raw=%r", res.get("error"), res)
+
+        except Exception as e:
+            logging.error("❌ Seedream Exception: %s", e)
 
         return None, None, None
\ No newline at end of file
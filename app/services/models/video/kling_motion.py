@@ -1,7 +1,6 @@
-import asyncio
 import logging
-import aiohttp
-from app.network import BASE_URL, POLZA_API_KEY, get_connector, timeout_config, _download_content_bytes
+from app.network import BASE_URL, POLZA_API_KEY, get_polza_client, add_callback_url, fetch_result
+from app.services.polza_poller import get_polza_poller
 
 
 class KlingMotionControl:
@@ -13,12 +12,14 @@ class KlingMotionControl:
             "Content-Type": "application/json"
         }
 
-    async def generate(self, prompt: str, char_image_url: str, motion_video_url: str, orientation: str = "image"):
+    async def generate(self, prompt: str, char_image_url: str, motion_video_url: str, orientation: str = "image",
+                       stream: bool = False):
         """
         Перенос движения с видео на фото.
         char_image_url: фото персонажа.
         motion_video_url: видео с эталонным движением.
         orientation: 'image' (до 10с) или 'video' (до 30с).
+        stream: не скачивать результат, а вернуть URL для потоковой отправки.
         """
 
         payload_input = {
@@ -35,35 +36,34 @@ class KlingMotionControl:
             "input": payload_input,
             "async": True
         }
+        add_callback_url(payload)
 
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout_config) as session:
-            try:
-                logging.info(f"💃 Kling Motion Control Start (Mode: {self.mode})")
-                async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
-                    if resp.status not in (200, 201):
-                        logging.error(f"❌ Motion Control Error: {await resp.text()}")
-                        return None, None, None
+        session = (await get_polza_client()).session
+        try:
+            logging.info(f"💃 Kling Motion Control Start (Mode: {self.mode})")
+            async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
+                if resp.status not in (200, 201):
+                    logging.error(f"❌ Motion Control Error: {await resp.text()}")
+                    return None, None, None
 
-                    data = await resp.json()
-                    request_id = data.get("id")
+                data = await resp.json()
+                request_id = data.get("id")
+                if not request_id:
+                    logging.error(f"❌ Motion Control: не найден request_id. raw={data}")
+                    return None, None, None
 
-                # Polling: Технология сложная, может занять время
-                for attempt in range(120):  # До 20 минут
-                    await asyncio.sleep(10)
-                    async with session.get(f"{BASE_URL}/media/{request_id}", headers=self.headers) as r:
-                        if r.status != 200: continue
-                        res = await r.json()
-                        status = res.get("status")
+            # Polling: Технология сложная, может занять время (до 20 минут)
+            res = await get_polza_poller().wait(request_id, self.model_id, interval=10, timeout=10 * 120)
+            if not res:
+                return None, None, None
 
-                        if status == "completed":
-                            final_url = res.get("data", {}).get("url")
-                            return await _download_content_bytes(session, final_url)
+            if res.get("status") == "completed":
+                final_url = res.get("data", {}).get("url")
+                return await fetch_result(session, final_url, stream=stream, default_ext="mp4")
 
-                        if status in ("failed", "cancelled"):
-                            logging.error(f"❌ Motion Control Failed: {res.get('error')}")
-                            break
+            logging.error(f"❌ Motion Control Failed: {res.get('error')}")
 
-            except Exception as e:
-                logging.error(f"❌ Motion Control Exception: {e}")
+        except Exception as e:
+            logging.error(f"❌ Motion Control Exception: {e}")
 
         return None, None, None
\ No newline at end of file
@@ -1,8 +1,7 @@
-import asyncio
 import logging
-import aiohttp
 from typing import Optional, Tuple
-from app.network import BASE_URL, POLZA_API_KEY, get_connector, timeout_config, _download_content_bytes
+from app.network import BASE_URL, POLZA_API_KEY, get_polza_client, add_callback_url, fetch_result
+from app.services.polza_poller import get_polza_poller
 
 def _as_dict(payload):
     if isinstance(payload, dict):
@@ -45,7 +44,8 @@ class KlingStandard:
             "Content-Type": "application/json"
         }
 
-    async def generate(self, prompt: str, image_urls=None, duration="5") -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    async def generate(self, prompt: str, image_urls=None, duration="5",
+                       stream: bool = False) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
         try:
             # Ограничение промпта (обычно до 2500 символов)
             prompt = prompt[:2500]
@@ -72,51 +72,44 @@ class KlingStandard:
                 "input": payload_input,
                 "async": True
             }
-
-            async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout_config) as session:
-                logging.info(f"🎬 Запуск Kling 2.5 Turbo (Duration: {duration_str}s)")
-                async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
-                    if resp.status not in (200, 201):
-                        logging.error(f"❌ Kling API Error: {await resp.text()}")
-                        return None, None, None
-
-                    raw_data = await resp.json(content_type=None)
-                    data = _as_dict(raw_data)
-                    request_id = data.get("id") or data.get("request_id")
-
-                    if not request_id:
-                        logging.error(f"❌ Kling request_id не найден. raw={raw_data}")
-                        return None, None, None
-
-                # Polling: ждём генерацию (до 10 минут)
-                for attempt in range(60):
-                    await asyncio.sleep(10)
-                    async with session.get(f"{BASE_URL}/media/{request_id}", headers=self.headers) as r:
-                        if r.status != 200:
-                            continue
-
-                        raw_res = await r.json(content_type=None)
-                        res = _as_dict(raw_res)
-                        status = res.get("status")
-
-                        if status == "completed":
-                            data_obj = _as_dict(res.get("data"))
-                            final_url = data_obj.get("url") or res.get("url")
-                            if not final_url:
-                                outputs = res.get("outputs")
-                                if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
-                                    final_url = outputs[0].get("url")
-
-                            if not final_url:
-                                logging.error(f"❌ Kling completed без url. raw={raw_res}")
-                                return None, None, None
-
-                            # ✅ Исправленный баг с кортежем (возвращаем напрямую)
-                            return await _download_content_bytes(session, final_url)
-
-                        if status in ("failed", "error", "cancelled"):
-                            logging.error(f"❌ Kling Failed: {res.get('error')} | raw={raw_res}")
-                            break
+            add_callback_url(payload)
+
+            session = (await get_polza_client()).session
+            logging.info(f"🎬 Запуск Kling 2.5 Turbo (Duration: {duration_str}s)")
+            async with session.post(f"{BASE_URL}/media", headers=self.headers, json=payload) as resp:
+                if resp.status not in (200, 201):
+                    logging.error(f"❌ Kling API Error: {await resp.text()}")
+                    return None, None, None
+
+                raw_data = await resp.json(content_type=None)
+                data = _as_dict(raw_data)
+                request_id = data.get("id") or data.get("request_id")
+
+                if not request_id:
+                    logging.error(f"❌ Kling request_id не найден. raw={raw_data}")
+                    return None, None, None
+
+            # Polling: ждём генерацию (до 10 минут)
+            res = await get_polza_poller().wait(request_id, self.model_id, interval=10, timeout=10 * 60)
+            if not res:
+                return None, None, None
+
+            if res.get("status") == "completed":
+                data_obj = _as_dict(res.get("data"))
+                final_url = data_obj.get("url") or res.get("url")
+                if not final_url:
+                    outputs = res.get("outputs")
+                    if isinstance(outputs, list) and outputs and isinstance(outputs[0], dict):
+                        final_url = outputs[0].get("url")
+
+                if not final_url:
+                    logging.error(f"❌ Kling completed без url. raw={res}")
+                    return None, None, None
+
+                # ✅ Исправленный баг с кортежем (возвращаем напрямую)
+                return await fetch_result(session, final_url, stream=stream, default_ext="mp4")
+
+            logging.error(f"❌ Kling Failed: {res.get('error')} | raw={res}")
 
         except Exception as e:
             logging.error(f"❌ Kling Exception: {e}")
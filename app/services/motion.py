@@ -1,68 +1,28 @@
 import logging
 import traceback
 import asyncio
-import os
-from io import BytesIO
 
 # Импорты aiogram
 from aiogram.types import BufferedInputFile
 
 # Импорты из твоего проекта
-from app.network import process_motion_control
+from app.services.models.video.kling_motion import KlingMotionControl
 from app.services.generation import charge
+from app.services.transcode import transcode_to_fit
+from app.services.telegram_file import telegram_file_url
+from app.services import metrics, tracing
 
+# Порог, выше которого видео пережимаем перед отправкой (для стабильной отправки)
+MOTION_MAX_BYTES = 7 * 1024 * 1024
 
-async def compress_video(video_bytes: bytes, user_id: int, quality: str = "medium") -> bytes:
+
+async def compress_video(video_bytes: bytes, user_id: int, max_bytes: int = MOTION_MAX_BYTES) -> bytes:
     """
-    Сжимает видео используя ffmpeg с низким приоритетом (nice), чтобы не вешать бота.
+    Сжимает видео под max_bytes через общий пул ffmpeg (без временных файлов,
+    параллельные задачи одного пользователя друг другу не мешают).
     """
-    quality_presets = {
-        "low": {"crf": 32, "preset": "faster"},
-        "medium": {"crf": 28, "preset": "medium"},
-        "high": {"crf": 23, "preset": "slow"}
-    }
-
-    params = quality_presets.get(quality, quality_presets["medium"])
-    input_file = f"/tmp/motion_input_{user_id}.mp4"
-    output_file = f"/tmp/motion_output_{user_id}.mp4"
-
-    try:
-        with open(input_file, 'wb') as f:
-            f.write(video_bytes)
-
-        # Проверяем наличие ffmpeg перед запуском
-        cmd = [
-            'nice', '-n', '15',
-            'ffmpeg', '-i', input_file,
-            '-c:v', 'libx264', '-crf', str(params['crf']),
-            '-preset', params['preset'],
-            '-c:a', 'aac', '-b:a', '128k',
-            '-y', output_file
-        ]
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-
-        await asyncio.wait_for(process.wait(), timeout=300)
-
-        if os.path.exists(output_file):
-            with open(output_file, 'rb') as f:
-                return f.read()
-        return video_bytes
-
-    except Exception as e:
-        logging.error(f"❌ Ошибка сжатия: {e}")
-        return video_bytes
-    finally:
-        for f_path in [input_file, output_file]:
-            if os.path.exists(f_path):
-                try:
-                    os.remove(f_path)
-                except:
-                    pass
+    logging.info(f"📹 Сжимаем видео для {user_id} под {max_bytes // 1024} KB")
+    return await transcode_to_fit(video_bytes, max_bytes=max_bytes)
 
 
 async def save_video_to_telegram(bot, video_bytes: bytes, user_id: int) -> str:
@@ -84,30 +44,33 @@ async def save_video_to_telegram(bot, video_bytes: bytes, user_id: int) -> str:
 
 async def background_motion_gen(bot, chat_id: int, char_photo_id: str, motion_video_id: str,
                                 prompt: str, user_id: int, mode: str = "720p",
-                                character_orientation: str = "image", cost_model: str = "kling_motion_720p"):
+                                character_orientation: str = "image", cost_model: str = "kling_motion"):
     """Оптимизированная фоновая задача для Kling Motion."""
+    status = "error"
+    metrics.current_model.set("kling_motion")
+    tracing.start_trace("motion", "kling_motion", user_id, chat_id=chat_id, mode=mode)
     try:
         logging.info(f"🎭 [MOTION] Старт задачи для {user_id}")
 
         # 1. Получаем ссылки на файлы (используем bot.token, так как os.getenv может подвести)
         try:
-            photo_file = await asyncio.wait_for(bot.get_file(char_photo_id), timeout=30)
-            video_file = await asyncio.wait_for(bot.get_file(motion_video_id), timeout=30)
+            with metrics.stage_timer("get_file"):
+                photo_file = await asyncio.wait_for(bot.get_file(char_photo_id), timeout=30)
+                video_file = await asyncio.wait_for(bot.get_file(motion_video_id), timeout=30)
         except Exception as e:
             logging.error(f"❌ Ошибка получения файлов от TG: {e}")
             await bot.send_message(chat_id, "⚠️ Telegram не успел отдать файлы. Попробуйте еще раз.")
             return
 
-        # Важно: берем токен из объекта бота, который точно инициализирован
-        current_token = bot.token
-        char_url = f"https://api.telegram.org/file/bot{current_token}/{photo_file.file_path}"
-        motion_url = f"https://api.telegram.org/file/bot{current_token}/{video_file.file_path}"
+        char_url = telegram_file_url(photo_file.file_path)
+        motion_url = telegram_file_url(video_file.file_path)
 
         # 2. Запрос к API Kling (ожидаем завершения генерации)
         # Внутри process_motion_control должен быть цикл ожидания статуса 'completed'
-        result_bytes, _, _ = await process_motion_control(
-            prompt, char_url, motion_url, mode=mode, character_orientation=character_orientation
-        )
+        with metrics.stage_timer("generate"):
+            result_bytes, _, _ = await KlingMotionControl(mode=mode).generate(
+                prompt, char_url, motion_url, orientation=character_orientation
+            )
 
         if not result_bytes:
             logging.error(f"❌ API не вернуло байты видео для {user_id}")
@@ -115,17 +78,19 @@ async def background_motion_gen(bot, chat_id: int, char_photo_id: str, motion_vi
             return
 
         # 3. Сжатие, если файл больше 7МБ (для стабильной отправки)
-        if len(result_bytes) > 7 * 1024 * 1024:
+        if len(result_bytes) > MOTION_MAX_BYTES:
             logging.info(f"📹 Видео слишком тяжелое ({len(result_bytes) // 1024} KB), сжимаем...")
             result_bytes = await compress_video(result_bytes, user_id)
 
         # 4. Отправка пользователю
         logging.info(f"📤 Отправка готового видео пользователю {user_id}...")
-        file_id = await save_video_to_telegram(bot, result_bytes, user_id)
+        with metrics.stage_timer("telegram_send"):
+            file_id = await save_video_to_telegram(bot, result_bytes, user_id)
 
         if file_id:
             # Списываем баланс только при успешной отправке
             await charge(user_id, cost_model)
+            status = "ok"
             logging.info(f"✅ Успешно завершено для {user_id}")
         else:
             # Если save_video_to_telegram вернул None, значит была ошибка в BufferedInputFile
@@ -134,4 +99,6 @@ async def background_motion_gen(bot, chat_id: int, char_photo_id: str, motion_vi
     except Exception as e:
         logging.error(f"❌ Критическая ошибка Motion: {e}")
         logging.error(traceback.format_exc())
-        await bot.send_message(chat_id, "⚠️ Произошла внутренняя ошибка при обработке видео.")
\ No newline at end of file
+        await bot.send_message(chat_id, "⚠️ Произошла внутренняя ошибка при обработке видео.")
+    finally:
+        tracing.finish_trace(status)
\ No newline at end of file
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+
+from app.bot import redis
+
+# Сколько последних завершений храним на модель (в памяти и в Redis)
+HISTORY_SIZE = 500
+# Пока замеров меньше — опрашиваем со старым фиксированным интервалом модели
+MIN_SAMPLES = 20
+
+MIN_INTERVAL = 1.0   # чаще этого не опрашиваем даже в «плотной» зоне
+DENSE_STEPS = 20     # сколько проверок укладываем между p10 и p90
+TAIL_FACTOR = 0.25   # в хвосте пауза растёт пропорционально опозданию
+MAX_INTERVAL_FACTOR = 3.0  # и не превышает 3x фиксированного интервала модели
+
+REDIS_KEY = "polza:latency:{model}"
+
+
+def _quantile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+class CompletionStats:
+    """
+    Распределение времени выполнения задач Polza по моделям бота.
+    По нему планируется опрос: редко до p10, плотно вокруг медианы, с backoff в хвосте.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE, min_samples: int = MIN_SAMPLES):
+        self.history_size = history_size
+        self.min_samples = min_samples
+        self.samples: Dict[str, Deque[float]] = {}
+        self._quantiles: Dict[str, tuple] = {}
+        self._loaded: Set[str] = set()
+        # Ссылки на фоновые записи в Redis, чтобы задачи не собрал GC до завершения
+        self._persisting: Set[asyncio.Task] = set()
+
+    async def ensure_loaded(self, model: str):
+        """Подтягивает историю модели из Redis один раз за жизнь процесса."""
+        if model in self._loaded:
+            return
+        self._loaded.add(model)
+        try:
+            raw = await redis.lrange(REDIS_KEY.format(model=model), 0, self.history_size - 1)
+            history = self.samples.setdefault(model, deque(maxlen=self.history_size))
+            # В Redis новые значения слева — добавляем от старых к новым
+            for value in reversed(raw):
+                history.append(float(value))
+            self._quantiles.pop(model, None)
+            logging.info("📈 История времени генерации %s: %s замеров", model, len(history))
+        except Exception as e:
+            logging.warning("⚠️ Не удалось загрузить историю времени %s: %s", model, e)
+
+    def record(self, model: str, seconds: float):
+        history = self.samples.setdefault(model, deque(maxlen=self.history_size))
+        history.append(seconds)
+        self._quantiles.pop(model, None)
+        task = asyncio.create_task(self._persist(model, seconds))
+        self._persisting.add(task)
+        task.add_done_callback(self._persisting.discard)
+
+    async def _persist(self, model: str, seconds: float):
+        key = REDIS_KEY.format(model=model)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.lpush(key, round(seconds, 2))
+                pipe.ltrim(key, 0, self.history_size - 1)
+                await pipe.execute()
+        except Exception as e:
+            logging.warning("⚠️ Не удалось сохранить время генерации %s: %s", model, e)
+
+    def quantiles(self, model: str) -> Optional[tuple]:
+        """(p10, p50, p90) или None, если замеров пока мало."""
+        history = self.samples.get(model)
+        if not history or len(history) < self.min_samples:
+            return None
+        cached = self._quantiles.get(model)
+        if cached is None:
+            values = sorted(history)
+            cached = (_quantile(values, 0.1), _quantile(values, 0.5), _quantile(values, 0.9))
+            self._quantiles[model] = cached
+        return cached
+
+    def next_delay(self, model: str, elapsed: float, default_interval: float) -> float:
+        """Пауза до следующей проверки задачи, которая выполняется уже elapsed секунд."""
+        q = self.quantiles(model)
+        if q is None:
+            return default_interval
+
+        p10, p50, p90 = q
+        dense = min(default_interval, max(MIN_INTERVAL, (p90 - p10) / DENSE_STEPS))
+
+        if elapsed < p10:
+            # До p10 почти никто не завершается: сразу прыгаем к началу «плотной» зоны
+            return max(MIN_INTERVAL, p10 - elapsed)
+        if elapsed < p90:
+            # Около медианы проверяем чаще всего, к краям зоны — в 2 раза реже
+            spread = max(p90 - p10, 1e-6)
+            distance = abs(elapsed - p50) / spread
+            return min(default_interval, dense * (1 + 2 * distance))
+
+        # Хвост: пауза растёт вместе с опозданием
+        tail = max(dense, (elapsed - p90) * TAIL_FACTOR)
+        return min(default_interval * MAX_INTERVAL_FACTOR, tail)
+
+    def summary(self) -> Dict[str, dict]:
+        out = {}
+        for model, history in self.samples.items():
+            q = self.quantiles(model)
+            out[model] = {"samples": len(history), "p10_p50_p90": q and tuple(round(v, 1) for v in q)}
+        return out
+
+
+completion_stats = CompletionStats()
@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+import aiohttp
+
+from app.network import BASE_URL, callbacks_enabled, get_polza_client
+from app.services.poll_schedule import completion_stats
+from app.services import metrics
+
+# Статусы, после которых задача в Polza больше не изменится
+FINAL_STATUSES = ("completed", "failed", "error", "cancelled")
+
+POLL_TICK = 1.0          # как часто планировщик просыпается, если нет более ранних проверок
+POLL_MAX_PARALLEL = 32   # сколько GET /media/{id} одновременно уходит в общий пул
+# Статус — короткий ответ: зависший GET не должен держать место до таймаутов общей сессии (10 мин)
+POLL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+# С callback'ами опрос остаётся только страховкой на случай потерянного уведомления
+SAFETY_POLL_INTERVAL = 30.0
+# Callback может прийти раньше, чем движок начал ждать задачу — помним такие недолго
+EARLY_WAKEUP_TTL = 600.0
+EARLY_WAKEUP_MAX = 1000
+# Канал, через который callback из процесса бота доходит до процессов-воркеров
+CALLBACK_CHANNEL = "polza:callbacks"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _as_dict(payload):
+    if isinstance(payload, dict):
+        return payload
+    if isinstance(payload, list) and payload and isinstance(payload[0], dict):
+        return payload[0]
+    return {}
+
+
+@dataclass
+class PendingJob:
+    request_id: str
+    model: str
+    interval: float
+    deadline: float
+    next_check: float
+    future: asyncio.Future
+    # Ключ статистики времени — модель бота (kling_5 и kling_10 у Polza — одна модель)
+    stats_model: str = ""
+    started_at: float = field(default_factory=time.monotonic)
+    # Предыдущий опрос: задача завершилась где-то между ним и опросом, увидевшим результат
+    last_poll_at: float = 0.0
+    # Когда пришёл callback о завершении: точнее середины между опросами
+    woken_at: Optional[float] = None
+    polls: int = 0
+    checking: bool = False
+
+
+class PolzaPoller:
+    """
+    Один опрашивающий цикл на процесс вместо отдельного цикла в каждом движке.
+    Движок отправляет задачу и ждёт future, который резолвится,
+    когда Polza вернёт финальный статус (или истечёт таймаут).
+    """
+
+    def __init__(
+        self,
+        tick: float = POLL_TICK,
+        max_parallel: int = POLL_MAX_PARALLEL,
+        safety_interval: Optional[float] = SAFETY_POLL_INTERVAL if callbacks_enabled() else None,
+    ):
+        self.tick = tick
+        self.max_parallel = max_parallel
+        self.safety_interval = safety_interval
+        self.jobs: Dict[str, PendingJob] = {}
+        self.early_wakeups: Dict[str, float] = {}
+        self.polls_total = 0
+        self.poll_errors = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._checks: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="polza-poller")
+            logging.info("🔁 Polza poller запущен (tick=%ss, parallel=%s)", self.tick, self.max_parallel)
+
+    def subscribe_callbacks(self):
+        """Получать callback'и, пришедшие в другой процесс (режим очереди с воркерами)."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen_callbacks(), name="polza-callbacks")
+
+    async def close(self):
+        for task in (self._task, self._listener):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._listener = None
+        for check in list(self._checks):
+            check.cancel()
+        self._checks.clear()
+        for job in self.jobs.values():
+            if not job.future.done():
+                job.future.cancel()
+        self.jobs.clear()
+
+    async def wait(self, request_id: str, model: str, interval: float, timeout: float) -> Optional[dict]:
+        """
+        Регистрирует request_id и ждёт финальный ответ Polza.
+        Возвращает dict ответа (status completed/failed/...) или None по таймауту.
+        """
+        stats_model = metrics.current_model.get()
+        if stats_model == "none":
+            stats_model = model
+        await completion_stats.ensure_loaded(stats_model)
+
+        job = self.jobs.get(request_id)
+        if job is None:
+            now = time.monotonic()
+            job = PendingJob(
+                request_id=request_id,
+                model=model,
+                interval=interval,
+                deadline=now + timeout,
+                next_check=now + self._next_delay(stats_model, 0.0, interval),
+                future=asyncio.get_running_loop().create_future(),
+                stats_model=stats_model,
+                started_at=now,
+                last_poll_at=now,
+            )
+            self.jobs[request_id] = job
+            if self.early_wakeups.pop(request_id, None) is not None:
+                # Callback пришёл раньше, чем мы начали ждать: проверяем сразу
+                job.next_check = now
+            self._wakeup.set()
+
+        try:
+            result = await asyncio.shield(job.future)
+            if result and result.get("status") == "completed":
+                # Здесь контекст задачи генерации — метка модели та же, что у остальных этапов
+                metrics.observe_stage("completion", time.monotonic() - job.started_at)
+            return result
+        except asyncio.CancelledError:
+            # Ожидающий ушёл (отмена задачи) — больше не опрашиваем
+            if self.jobs.get(request_id) is job:
+                self.jobs.pop(request_id, None)
+                job.future.cancel()
+            raise
+
+    def resolve(self, request_id: str, result: Optional[dict], completed_at: Optional[float] = None) -> bool:
+        """
+        Завершает ожидание задачи. Возвращает True, если кто-то её ждал.
+        completed_at — оценка момента завершения (monotonic); по умолчанию — сейчас (callback).
+        """
+        job = self.jobs.pop(request_id, None)
+        if job is None or job.future.done():
+            return False
+        if result and result.get("status") == "completed":
+            elapsed = (completed_at or time.monotonic()) - job.started_at
+            completion_stats.record(job.stats_model, elapsed)
+            logging.info("✅ Polza %s: %s готово за %.1fs (%s опросов)", job.model, request_id, elapsed, job.polls)
+        job.future.set_result(result)
+        return True
+
+    def wake(self, request_id: str) -> bool:
+        """
+        Callback Polza: задача, похоже, завершилась — опрашиваем её сейчас, не дожидаясь расписания.
+        Тело callback'а не используется: статус и URL результата берём только из GET к Polza.
+        Возвращает True, если задачу ждут в этом процессе; иначе запоминаем на случай, если wait() ещё впереди.
+        """
+        now = time.monotonic()
+        job = self.jobs.get(request_id)
+        if job is not None:
+            job.woken_at = job.woken_at or now
+            job.next_check = now
+            self._wakeup.set()
+            return True
+
+        if len(self.early_wakeups) >= EARLY_WAKEUP_MAX:
+            self.early_wakeups = {
+                rid: at for rid, at in self.early_wakeups.items() if now - at < EARLY_WAKEUP_TTL
+            }
+        if len(self.early_wakeups) < EARLY_WAKEUP_MAX:
+            self.early_wakeups[request_id] = now
+        return False
+
+    def _next_delay(self, model: str, elapsed: float, interval: float) -> float:
+        delay = completion_stats.next_delay(model, elapsed, interval)
+        if self.safety_interval:
+            delay = max(delay, self.safety_interval)
+        return delay
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self.jobs), "polls_total": self.polls_total, "poll_errors": self.poll_errors}
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def check(job: PendingJob):
+            try:
+                async with semaphore:
+                    await self._check(job)
+            finally:
+                job.checking = False
+
+        while True:
+            try:
+                now = time.monotonic()
+                # Задача, чей прошлый опрос ещё идёт, ждёт его ответа, а не второго запроса
+                due = [job for job in self.jobs.values() if job.next_check <= now and not job.checking]
+
+                for job in due:
+                    if now >= job.deadline:
+                        logging.error("❌ Polza %s: таймаут ожидания %s после %s опросов",
+                                      job.model, job.request_id, job.polls)
+                        self.resolve(job.request_id, None)
+                        continue
+                    # Следующая проверка планируется заранее, чтобы не опросить задачу дважды
+                    job.next_check = now + self._next_delay(job.stats_model, now - job.started_at, job.interval)
+
+                # Каждый опрос — отдельная задача: медленный ответ не задерживает следующие проверки
+                for job in due:
+                    if job.request_id not in self.jobs:
+                        continue
+                    job.checking = True
+                    task = asyncio.create_task(check(job))
+                    self._checks.add(task)
+                    task.add_done_callback(self._checks.discard)
+
+                self._wakeup.clear()
+                if self.jobs:
+                    sleep_for = min(job.next_check for job in self.jobs.values()) - time.monotonic()
+                    sleep_for = max(0.0, min(sleep_for, self.tick))
+                else:
+                    sleep_for = None
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+                except asyncio.TimeoutError:
+                    pass
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("❌ Ошибка в цикле Polza poller: %s", e)
+                await asyncio.sleep(self.tick)
+
+    async def _listen_callbacks(self):
+        from app.bot import redis
+
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(CALLBACK_CHANNEL)
+                    logging.info("📡 Подписка на %s", CALLBACK_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        request_id = _decode(message["data"])
+                        if request_id:
+                            self.wake(request_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("❌ Подписка на callback'и Polza оборвалась: %s", e)
+                await asyncio.sleep(self.tick)
+
+    async def _check(self, job: PendingJob):
+        job.polls += 1
+        self.polls_total += 1
+        previous_poll, job.last_poll_at = job.last_poll_at, time.monotonic()
+        try:
+            client = await get_polza_client()
+            async with client.session.get(
+                f"{BASE_URL}/media/{job.request_id}", headers=client.headers, timeout=POLL_REQUEST_TIMEOUT
+            ) as r:
+                if r.status != 200:
+                    self.poll_errors += 1
+                    return
+                res = _as_dict(await r.json(content_type=None))
+        except Exception as e:
+            self.poll_errors += 1
+            logging.warning("⚠️ Polza poll %s: %s", job.request_id, e)
+            return
+
+        if res.get("status") in FINAL_STATUSES:
+            # Опрос видит завершение с опозданием до целого интервала — берём середину интервала,
+            # иначе распределение (и с ним расписание опросов) смещается на полпаузы вправо.
+            # Если разбудил callback, момент завершения известен точнее
+            completed_at = job.woken_at or (previous_poll + job.last_poll_at) / 2
+            self.resolve(job.request_id, res, completed_at=completed_at)
+        else:
+            # Callback не подтвердился опросом — задача ещё идёт
+            job.woken_at = None
+
+
+polza_poller: Optional[PolzaPoller] = None
+
+metrics.counter_from("bot_polza_polls_total", "Опросы статуса задач Polza",
+                     lambda: polza_poller.polls_total if polza_poller else None)
+metrics.counter_from("bot_polza_poll_errors_total", "Неудачные опросы Polza",
+                     lambda: polza_poller.poll_errors if polza_poller else None)
+metrics.gauge("bot_polza_pending_jobs", "Задачи Polza в ожидании результата",
+              lambda: len(polza_poller.jobs) if polza_poller else None)
+
+
+def get_polza_poller() -> PolzaPoller:
+    global polza_poller
+    if polza_poller is None:
+        polza_poller = PolzaPoller()
+    polza_poller.start()
+    return polza_poller
+
+
+async def close_polza_poller():
+    global polza_poller
+    if polza_poller is not None:
+        await polza_poller.close()
+        polza_poller = None
+        logging.info("💤 Polza poller остановлен")
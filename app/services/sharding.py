@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.exceptions import RedisError, ResponseError
+
+from app.bot import redis
+
+# Число процессов-диспетчеров; 1 — один процесс, как раньше
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", 1))
+SHARD_STREAM = "updates:shard:{}"
+SHARD_GROUP = "dispatchers"
+SHARD_MAXLEN = 50_000
+# Сколько апдейтов один диспетчер обрабатывает одновременно (разных пользователей)
+SHARD_CONCURRENCY = int(os.getenv("SHARD_CONCURRENCY", 256))
+# Redis недоступен: короткие повторы XADD на апдейт, затем супервизор ждёт с растущей паузой
+ROUTE_ATTEMPTS = 3
+ROUTE_RETRY_DELAY = 0.2
+POLL_BACKOFF_MIN = 1.0
+POLL_BACKOFF_MAX = 30.0
+
+
+def sharding_enabled() -> bool:
+    return BOT_SHARDS > 1
+
+
+def shard_for(key: int, shards: int = BOT_SHARDS) -> int:
+    return int(key) % shards
+
+
+def update_user_id(update: Update) -> int:
+    """Чей апдейт: по нему выбирается шард, чтобы FSM пользователя шла по порядку."""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ShardRouter:
+    """Входная сторона супервизора: кладёт апдейт в поток шарда его пользователя."""
+
+    def __init__(self, shards: int = BOT_SHARDS):
+        self.shards = shards
+        self.routed = [0] * shards
+
+    async def route(self, update: Update, raw: Optional[str] = None):
+        shard = shard_for(update_user_id(update), self.shards)
+        if raw is None:
+            raw = update.model_dump_json(exclude_unset=True, by_alias=True)
+        stream = SHARD_STREAM.format(shard)
+        for attempt in range(1, ROUTE_ATTEMPTS + 1):
+            try:
+                await redis.xadd(stream, {"update": raw}, maxlen=SHARD_MAXLEN, approximate=True)
+                break
+            except RedisError as e:
+                logging.warning("⚠️ XADD в %s не удался (попытка %s/%s): %s", stream, attempt, ROUTE_ATTEMPTS, e)
+                if attempt == ROUTE_ATTEMPTS:
+                    raise
+                await asyncio.sleep(ROUTE_RETRY_DELAY * 2 ** (attempt - 1))
+        self.routed[shard] += 1
+
+
+async def poll_updates(bot: Bot, dp: Dispatcher, router: ShardRouter, stop: asyncio.Event):
+    """Long polling в супервизоре: апдейты не обрабатываем, а раздаём по шардам."""
+    await bot.delete_webhook(drop_pending_updates=True)
+    allowed = dp.resolve_used_update_types()
+    offset = None
+    backoff = POLL_BACKOFF_MIN
+    stopped = asyncio.create_task(stop.wait())
+    while not stop.is_set():
+        fetch = asyncio.create_task(bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed))
+        await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not fetch.done():
+            fetch.cancel()
+            break
+        try:
+            updates = fetch.result()
+        except Exception as e:
+            logging.error("❌ getUpdates: %s", e)
+            await asyncio.sleep(1)
+            continue
+        try:
+            for update in updates:
+                await router.route(update)
+                offset = update.update_id + 1
+        except RedisError as e:
+            # offset не сдвинут дальше неразданного апдейта: Telegram вернёт его в следующем getUpdates
+            logging.warning("⚠️ Раздача апдейтов по шардам остановлена, повтор через %.0f с: %s", backoff, e)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+            continue
+        backoff = POLL_BACKOFF_MIN
+
+
+class ShardConsumer:
+    """
+    Диспетчер одного шарда: читает свой поток через consumer group и скармливает апдейты в dp.
+    Апдейты одного пользователя выполняются строго по очереди, разных — параллельно.
+    Исключение — сообщения одного альбома: они идут вместе (их собирает AlbumMiddleware),
+    но после всех предыдущих апдейтов пользователя.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, index: int, concurrency: int = SHARD_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.stream = SHARD_STREAM.format(index)
+        # Имя постоянное: после рестарта процесс дочитывает свои неподтверждённые апдейты
+        self.consumer = f"shard-{index}"
+        self.concurrency = concurrency
+        self.running = set()
+        self.tails: Dict[int, List[asyncio.Task]] = {}
+        self.albums: Dict[int, Tuple[str, List[asyncio.Task]]] = {}
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        try:
+            await redis.xgroup_create(self.stream, SHARD_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        logging.info("📡 Диспетчер %s запущен (concurrency=%s)", self.consumer, self.concurrency)
+        # Сначала — свои неподтверждённые апдейты (процесс перезапустился посреди обработки)
+        pending = await redis.xreadgroup(SHARD_GROUP, self.consumer, {self.stream: "0"})
+        for _stream, batch in pending or []:
+            for message_id, fields in batch:
+                self._schedule(_decode(message_id), fields)
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(self.running)
+                if free <= 0:
+                    await asyncio.wait(self.running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    response = await redis.xreadgroup(
+                        SHARD_GROUP, self.consumer, {self.stream: ">"}, count=free, block=2000
+                    )
+                except Exception as e:
+                    logging.error("❌ Ошибка чтения %s: %s", self.stream, e)
+                    await asyncio.sleep(1)
+                    continue
+
+                for _stream, batch in response or []:
+                    for message_id, fields in batch:
+                        self._schedule(_decode(message_id), fields)
+        finally:
+            if self.running:
+                logging.info("⏳ %s ждёт завершения %s апдейтов", self.consumer, len(self.running))
+                await asyncio.gather(*self.running, return_exceptions=True)
+
+    def _schedule(self, message_id: str, fields: dict):
+        raw = _decode(fields.get(b"update", fields.get("update")))
+        if not raw:
+            asyncio.create_task(redis.xack(self.stream, SHARD_GROUP, message_id))
+            return
+        try:
+            update = Update.model_validate(json.loads(raw), context={"bot": self.bot})
+        except Exception as e:
+            logging.error("❌ Некорректный апдейт %s: %s", message_id, e)
+            asyncio.create_task(redis.xack(self.stream, SHARD_GROUP, message_id))
+            return
+
+        user_id = update_user_id(update)
+        group_id = getattr(update.message, "media_group_id", None) if update.message else None
+        album = self.albums.get(user_id)
+
+        if group_id and album and album[0] == group_id:
+            # Следующее фото того же альбома: ждёт то же, что и первое, а не само первое
+            previous = album[1]
+            task = asyncio.create_task(self._process(message_id, update, previous))
+            self.tails[user_id] = self.tails.get(user_id, []) + [task]
+        else:
+            previous = self.tails.get(user_id, [])
+            task = asyncio.create_task(self._process(message_id, update, previous))
+            self.tails[user_id] = [task]
+            if group_id:
+                self.albums[user_id] = (group_id, previous)
+            else:
+                self.albums.pop(user_id, None)
+
+        self.running.add(task)
+        task.add_done_callback(lambda t: self._done(t, user_id))
+
+    def _done(self, task: asyncio.Task, user_id: int):
+        self.running.discard(task)
+        tail = self.tails.get(user_id)
+        if tail and all(t.done() for t in tail):
+            self.tails.pop(user_id, None)
+            self.albums.pop(user_id, None)
+
+    async def _process(self, message_id: str, update: Update, previous: List[asyncio.Task]):
+        if previous:
+            await asyncio.gather(*previous, return_exceptions=True)
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("❌ Ошибка обработки апдейта %s", update.update_id)
+        finally:
+            try:
+                await redis.xack(self.stream, SHARD_GROUP, message_id)
+            except Exception as e:
+                logging.warning("⚠️ XACK %s: %s", message_id, e)
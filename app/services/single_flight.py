@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.bot import redis
+from app.services.admission import DELIVERY_MARGIN, MODEL_MAX_RUNTIME
+from app.services.job_queue import queue_enabled
+
+# "redis" — одинаковые запросы склеиваются между всеми процессами (воркеры очереди),
+# "local" — только внутри процесса
+FLIGHT_MODE = os.getenv("SINGLE_FLIGHT", "redis" if queue_enabled() else "local")
+# Lock лидера — короткая аренда: лидер продлевает её, пока генерирует, а при падении процесса
+# lock быстро истекает. Ведомый ждёт не дольше самой долгой генерации (опрос kling_motion)
+FLIGHT_LOCK_TTL = 60
+FLIGHT_LOCK_RENEW_INTERVAL = 20
+FLIGHT_WAIT_TIMEOUT = max(MODEL_MAX_RUNTIME.values()) + DELIVERY_MARGIN
+FLIGHT_RESULT_TTL = 10 * 60
+FLIGHT_POLL_INTERVAL = 1.0
+
+# Снимаем lock, только если он всё ещё наш
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Продлеваем lock, только если он всё ещё наш
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class SingleFlight:
+    """
+    Одинаковые одновременные генерации выполняются один раз: второй запрос с тем же ключом
+    не запускает новую задачу Polza, а ждёт результат уже идущей.
+
+    В процессе — общий asyncio.Task на ключ. Между процессами — lock в Redis (SET NX):
+    лидер генерирует и публикует результат (URL для стриминга), ведомые его забирают.
+    Делиться через Redis можно только URL-результатом; байты ведомые генерируют сами.
+
+    on_join вызывается, когда запрос присоединяется к чужой генерации: ведомый снимает
+    свой билет очереди модели, иначе билеты ведомых стояли бы в очереди перед лидером.
+    """
+
+    def __init__(self, prefix: str, distributed: bool):
+        self.prefix = prefix
+        self.distributed = distributed
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+        self.coalesced_remote = 0
+
+    async def run(self, key: Optional[str], factory: Callable[[], Awaitable[Any]],
+                  on_join: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        if not key:
+            return await factory()
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._lead(key, factory, on_join))
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.inflight.pop(key, None) if self.inflight.get(key) is t else None)
+        else:
+            self.coalesced += 1
+            logging.info("🔗 Запрос %s присоединён к уже идущей генерации", key[:12])
+            await self._joined(on_join)
+
+        # shield: отмена одного ожидающего не должна отменять генерацию для остальных
+        return await asyncio.shield(task)
+
+    async def _joined(self, on_join: Optional[Callable[[], Awaitable[Any]]]):
+        if on_join is None:
+            return
+        try:
+            await on_join()
+        except Exception as e:
+            logging.warning("⚠️ Single-flight: ошибка on_join: %s", e)
+
+    async def _lead(self, key: str, factory: Callable[[], Awaitable[Any]],
+                    on_join: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        if not self.distributed:
+            return await factory()
+
+        lock_key = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + FLIGHT_WAIT_TIMEOUT
+        joined = False
+
+        while True:
+            try:
+                acquired = await redis.set(lock_key, token, nx=True, ex=FLIGHT_LOCK_TTL)
+            except Exception as e:
+                logging.warning("⚠️ Single-flight: Redis недоступен, генерируем сами: %s", e)
+                return await factory()
+            if acquired:
+                break
+
+            if not joined:
+                # Генерирует другой процесс: этот запрос (и присоединённые к нему) — ведомые
+                joined = True
+                await self._joined(on_join)
+            shared = await self._wait_remote(lock_key, key, deadline)
+            if shared is not None:
+                self.coalesced_remote += 1
+                return shared
+            if time.monotonic() >= deadline:
+                return await factory()
+            # Лидер закончил без общего результата (ошибка / байты) — пробуем стать лидером сами
+
+        renew = asyncio.create_task(self._renew(lock_key, token))
+        try:
+            result = await factory()
+            await self._publish(key, token, result)
+            return result
+        finally:
+            renew.cancel()
+            try:
+                await redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                logging.warning("⚠️ Single-flight: не удалось снять lock %s: %s", key[:12], e)
+
+    async def _renew(self, lock_key: str, token: str):
+        while True:
+            await asyncio.sleep(FLIGHT_LOCK_RENEW_INTERVAL)
+            try:
+                if not await redis.eval(_RENEW_SCRIPT, 1, lock_key, token, FLIGHT_LOCK_TTL):
+                    logging.warning("⚠️ Single-flight: lock %s потерян, ведомые станут лидерами", lock_key[-12:])
+                    return
+            except Exception as e:
+                logging.warning("⚠️ Single-flight: не удалось продлить lock: %s", e)
+
+    async def _publish(self, key: str, token: str, result):
+        # (bytes, ext, url): в stream-режиме bytes=None, и URL может стримить каждый ведомый
+        if not result or result[0] is not None or not result[2]:
+            return
+        try:
+            await redis.set(
+                f"{self.prefix}:result:{key}:{token}",
+                json.dumps([result[1], result[2]]),
+                ex=FLIGHT_RESULT_TTL,
+            )
+        except Exception as e:
+            logging.warning("⚠️ Single-flight: не удалось опубликовать результат: %s", e)
+
+    async def _wait_remote(self, lock_key: str, key: str, deadline: float):
+        try:
+            leader = await redis.get(lock_key)
+            if leader is None:
+                return None
+            result_key = f"{self.prefix}:result:{key}:{_decode(leader)}"
+            logging.info("🔗 Запрос %s ждёт генерацию другого процесса", key[:12])
+
+            while time.monotonic() < deadline:
+                await asyncio.sleep(FLIGHT_POLL_INTERVAL)
+                raw, current = await redis.mget(result_key, lock_key)
+                if raw:
+                    ext, url = json.loads(raw)
+                    return None, ext, url
+                if current != leader:
+                    # Лидер снял lock (результат пишется до снятия) — делиться нечем
+                    return None
+        except Exception as e:
+            logging.warning("⚠️ Single-flight: ошибка ожидания лидера: %s", e)
+        return None
+
+
+generation_flights = SingleFlight("gen:flight", distributed=FLIGHT_MODE == "redis")
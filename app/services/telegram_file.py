@@ -1,63 +1,129 @@
 import base64
+import hashlib
+import json
+import time
 import aiohttp
 import logging
 from aiogram import Bot
 from typing import Optional, Tuple
 
 from app.config import settings
-from app.network import get_connector
+from app.network import get_polza_client
+from app.services.cache import TieredCache
+from app.services.metrics import observe_stage
 
 
 VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
 
+# Ссылка на скачивание из getFile гарантированно живёт не меньше часа
+FILE_INFO_TTL = 55 * 60
+# Ссылки telegra.ph постоянные, держим месяц
+REFERENCE_URL_TTL = 30 * 24 * 3600
+
+# file_id -> {"file_path", "file_unique_id"}
+file_info_cache = TieredCache("tg:file", ttl=FILE_INFO_TTL, l1_size=4096)
+# uid:{file_unique_id} / sha:{sha256 содержимого} -> уже размещённый URL
+reference_cache = TieredCache("tg:ref", ttl=REFERENCE_URL_TTL, l1_size=4096, l1_ttl=6 * 3600)
+
+
+def telegram_file_url(file_path: str) -> str:
+    return f"{settings.telegram_api_url}/file/bot{settings.bot_token}/{file_path}"
+
 
 def _is_video(path: str) -> bool:
     lower = path.lower()
     return any(lower.endswith(ext) for ext in VIDEO_EXTENSIONS)
 
 
-async def get_telegram_photo_url(bot: Bot, file_id: str) -> Optional[str]:
+async def _get_file_info(bot: Bot, file_id: str) -> Tuple[str, str]:
+    """bot.get_file с кэшем на время жизни ссылки. Возвращает (file_path, file_unique_id)."""
+    cached = await file_info_cache.get(file_id)
+    if cached:
+        info = json.loads(cached)
+        return info["file_path"], info["file_unique_id"]
+
+    file = await bot.get_file(file_id)
+    await file_info_cache.set(
+        file_id, json.dumps({"file_path": file.file_path, "file_unique_id": file.file_unique_id})
+    )
+    return file.file_path, file.file_unique_id
+
+
+async def get_telegram_photo_url(bot: Bot, file_id: str, file_unique_id: Optional[str] = None) -> Optional[str]:
     """
     Для видео возвращает прямую ссылку Telegram.
     Для фото пытается загрузить в Telegraph и вернуть постоянную ссылку.
+    Уже размещённые фото берутся из кэша по file_unique_id, а затем по хэшу содержимого.
     На любой ошибке возвращает tg_url как fallback (а не None), если удалось получить file_path.
     """
     tg_url: Optional[str] = None
+    timings = {}
+    stage_started = time.perf_counter()
+
+    def mark(stage: str):
+        nonlocal stage_started
+        now = time.perf_counter()
+        timings[stage] = now - stage_started
+        stage_started = now
 
     try:
-        file = await bot.get_file(file_id)
-        tg_url = f"https://api.telegram.org/file/bot{settings.bot_token}/{file.file_path}"
+        if file_unique_id:
+            cached = await reference_cache.get(f"uid:{file_unique_id}")
+            if cached:
+                return cached
 
-        if _is_video(file.file_path):
+        file_path, unique_id = await _get_file_info(bot, file_id)
+        mark("get_file")
+        tg_url = telegram_file_url(file_path)
+
+        if _is_video(file_path):
             return tg_url
 
+        if unique_id and unique_id != file_unique_id:
+            cached = await reference_cache.get(f"uid:{unique_id}")
+            if cached:
+                return cached
+
         timeout = aiohttp.ClientTimeout(total=40, connect=10, sock_read=20)
+        session = (await get_polza_client()).session
 
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout) as session:
-            async with session.get(tg_url) as resp:
-                if resp.status != 200:
-                    logging.warning("⚠️ Не удалось скачать файл из TG для Telegraph, status=%s", resp.status)
-                    return tg_url
-                file_data = await resp.read()
-
-            form = aiohttp.FormData()
-            form.add_field("file", file_data, filename="image.jpg", content_type="image/jpeg")
-
-            async with session.post("https://telegra.ph/upload", data=form) as up_resp:
-                if up_resp.status != 200:
-                    logging.warning("⚠️ Telegraph upload status=%s", up_resp.status)
-                    return tg_url
-
-                result = await up_resp.json(content_type=None)
-                # Telegraph обычно возвращает list[{"src": "..."}]
-                if isinstance(result, list) and result and isinstance(result[0], dict):
-                    path = result[0].get("src")
-                    if path:
-                        return f"https://telegra.ph{path}"
-
-                logging.warning("⚠️ Неожиданный ответ Telegraph: type=%s body=%r", type(result).__name__, result)
+        async with session.get(tg_url, timeout=timeout) as resp:
+            if resp.status != 200:
+                logging.warning("⚠️ Не удалось скачать файл из TG для Telegraph, status=%s", resp.status)
+                return tg_url
+            file_data = await resp.read()
+        mark("reference_download")
+
+        content_hash = hashlib.sha256(file_data).hexdigest()
+        cached = await reference_cache.get(f"sha:{content_hash}")
+        if cached:
+            if unique_id:
+                await reference_cache.set(f"uid:{unique_id}", cached)
+            return cached
+
+        form = aiohttp.FormData()
+        form.add_field("file", file_data, filename="image.jpg", content_type="image/jpeg")
+
+        async with session.post(f"{settings.telegraph_url}/upload", data=form, timeout=timeout) as up_resp:
+            mark("telegraph_upload")
+            if up_resp.status != 200:
+                logging.warning("⚠️ Telegraph upload status=%s", up_resp.status)
                 return tg_url
 
+            result = await up_resp.json(content_type=None)
+            # Telegraph обычно возвращает list[{"src": "..."}]
+            if isinstance(result, list) and result and isinstance(result[0], dict):
+                path = result[0].get("src")
+                if path:
+                    hosted_url = f"{settings.telegraph_url}{path}"
+                    await reference_cache.set(f"sha:{content_hash}", hosted_url)
+                    if unique_id:
+                        await reference_cache.set(f"uid:{unique_id}", hosted_url)
+                    return hosted_url
+
+            logging.warning("⚠️ Неожиданный ответ Telegraph: type=%s body=%r", type(result).__name__, result)
+            return tg_url
+
     except Exception as e:
         logging.error("❌ Ошибка в get_telegram_photo_url: %s", e)
 
@@ -66,6 +132,15 @@ async def get_telegram_photo_url(bot: Bot, file_id: str) -> Optional[str]:
             return tg_url
         return None
 
+    finally:
+        for stage, seconds in timings.items():
+            observe_stage(stage, seconds)
+        if timings:
+            logging.info(
+                "📎 reference stages: %s",
+                " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+            )
+
 
 async def download_telegram_file(bot: Bot, file_id: str) -> Tuple[Optional[bytes], str]:
     """
@@ -73,10 +148,10 @@ async def download_telegram_file(bot: Bot, file_id: str) -> Tuple[Optional[bytes
     Поддерживает видео до 500МБ и фото до 50МБ.
     """
     try:
-        file = await bot.get_file(file_id)
-        tg_url = f"https://api.telegram.org/file/bot{settings.bot_token}/{file.file_path}"
+        file_path, _ = await _get_file_info(bot, file_id)
+        tg_url = telegram_file_url(file_path)
 
-        is_video = _is_video(file.file_path)
+        is_video = _is_video(file_path)
         mime = "video/mp4" if is_video else "image/jpeg"
 
         timeout = aiohttp.ClientTimeout(total=600 if is_video else 120, connect=30)
@@ -84,20 +159,20 @@ async def download_telegram_file(bot: Bot, file_id: str) -> Tuple[Optional[bytes
 
         logging.info("📥 Скачивание %s...", "видео" if is_video else "фото")
 
-        async with aiohttp.ClientSession(connector=get_connector(), timeout=timeout) as session:
-            async with session.get(tg_url) as resp:
-                if resp.status != 200:
-                    logging.error("❌ TG file download status=%s", resp.status)
+        session = (await get_polza_client()).session
+        async with session.get(tg_url, timeout=timeout) as resp:
+            if resp.status != 200:
+                logging.error("❌ TG file download status=%s", resp.status)
+                return None, ""
+
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(1024 * 1024):
+                data.extend(chunk)
+                if len(data) > max_size:
+                    logging.error("❌ Превышен лимит размера файла: %s bytes", len(data))
                     return None, ""
 
-                data = bytearray()
-                async for chunk in resp.content.iter_chunked(1024 * 1024):
-                    data.extend(chunk)
-                    if len(data) > max_size:
-                        logging.error("❌ Превышен лимит размера файла: %s bytes", len(data))
-                        return None, ""
-
-                return bytes(data), mime
+            return bytes(data), mime
 
     except Exception as e:
         logging.error("❌ Ошибка скачивания: %s", e)
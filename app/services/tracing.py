@@ -0,0 +1,151 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+# Трассы задач генерации: одна строка JSON на задачу, файл ротируется по размеру.
+# У каждого процесса свой файл (logs/traces.bot.jsonl, logs/traces.worker-0.jsonl, ...):
+# RotatingFileHandler не делит файл между процессами — ротация в одном рвёт запись в других
+TRACE_LOG = os.getenv("TRACE_LOG", "logs/traces.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", 50 * 1024 * 1024))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", 5))
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+
+
+class Trace:
+    __slots__ = ("trace_id", "kind", "model", "user_id", "attrs", "started_at", "t0", "spans")
+
+    def __init__(self, kind: str, model: str, user_id: Optional[int], **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.model = model
+        self.user_id = user_id
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, started: float, duration: float, **attrs):
+        span = {"name": name, "start": round(started - self.t0, 4), "duration": round(duration, 4)}
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def record(self, status: str, **attrs) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "model": self.model,
+            "user_id": self.user_id,
+            "started_at": round(self.started_at, 3),
+            "total": round(time.perf_counter() - self.t0, 4),
+            "status": status,
+            **self.attrs,
+            **attrs,
+            "spans": self.spans,
+        }
+
+
+# Трасса текущей задачи: этапы внутри (сеть, движки, ffmpeg) пишут в неё, не зная о задаче
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace(kind: str, model: str, user_id: Optional[int] = None, **attrs) -> Optional[Trace]:
+    if not TRACING_ENABLED:
+        return None
+    trace = Trace(kind, model, user_id, **attrs)
+    current_trace.set(trace)
+    return trace
+
+
+def add_span(name: str, seconds: float, **attrs):
+    """Этап, который только что закончился и длился seconds."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - seconds, seconds, **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started, **attrs)
+
+
+def finish_trace(status: str = "ok", **attrs):
+    """Дописывает трассу в лог. Сериализация и запись — в потоке QueueListener, не в event loop."""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    current_trace.set(None)
+    _writer().info(trace.record(status, **attrs))
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, separators=(",", ":"))
+
+
+class _PassThroughQueueHandler(QueueHandler):
+    # Очередь внутри процесса: запись не нужно готовить к pickle, JSON соберёт поток записи
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_logger: Optional[logging.Logger] = None
+_listener: Optional[QueueListener] = None
+_process_name = "bot"
+
+
+def set_process_name(name: str):
+    """Имя процесса в имени файла трасс; задаётся до первой трассы (worker.py, shard.py)."""
+    global _process_name
+    _process_name = name
+
+
+def trace_log_path() -> str:
+    root, ext = os.path.splitext(TRACE_LOG)
+    return f"{root}.{_process_name}{ext}"
+
+
+def _writer() -> logging.Logger:
+    global _logger, _listener
+    if _logger is not None:
+        return _logger
+
+    logger = logging.getLogger("traces")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    path = trace_log_path()
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        file_handler = RotatingFileHandler(
+            path, maxBytes=TRACE_LOG_MAX_BYTES, backupCount=TRACE_LOG_BACKUPS, encoding="utf-8"
+        )
+    except OSError as e:
+        logging.error("❌ Трассы не пишутся: %s", e)
+        logger.addHandler(logging.NullHandler())
+        _logger = logger
+        return logger
+
+    file_handler.setFormatter(_JsonLineFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(_PassThroughQueueHandler(records))
+    _listener = QueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+    _logger = logger
+    return logger
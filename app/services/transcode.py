@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import struct
+import tempfile
+import time
+from typing import Optional, Tuple
+
+from app.services.metrics import observe_stage
+
+# Лимит Telegram Bot API на отправку файла
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+# Одновременных ffmpeg на процесс: по умолчанию половина ядер, остальное — боту
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+TRANSCODE_TIMEOUT = 300
+AUDIO_BITRATE = 96_000
+MIN_VIDEO_BITRATE = 150_000
+# Запас на контейнер и неточность ABR за один проход
+SIZE_MARGIN = 0.92
+
+_slots = asyncio.Semaphore(TRANSCODE_WORKERS)
+
+
+def mp4_duration(data: bytes) -> Optional[float]:
+    """Длительность MP4 из moov/mvhd — без ffprobe и без записи на диск."""
+
+    def boxes(start: int, end: int):
+        pos = start
+        while pos + 8 <= end:
+            size, kind = struct.unpack(">I4s", data[pos:pos + 8])
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header:
+                return
+            yield kind, pos + header, pos + size
+            pos += size
+
+    try:
+        for kind, body, end in boxes(0, len(data)):
+            if kind != b"moov":
+                continue
+            for sub, sub_body, _ in boxes(body, end):
+                if sub != b"mvhd":
+                    continue
+                version = data[sub_body]
+                if version == 1:
+                    timescale, duration = struct.unpack(">IQ", data[sub_body + 20:sub_body + 32])
+                else:
+                    timescale, duration = struct.unpack(">II", data[sub_body + 12:sub_body + 20])
+                return duration / timescale if timescale else None
+    except (struct.error, IndexError):
+        pass
+    return None
+
+
+def target_video_bitrate(duration: float, max_bytes: int) -> int:
+    """Битрейт видео (бит/с), при котором файл влезет в max_bytes за один проход."""
+    total = max_bytes * 8 * SIZE_MARGIN / max(duration, 0.1)
+    return max(MIN_VIDEO_BITRATE, int(total - AUDIO_BITRATE))
+
+
+def _scale_filter(video_bitrate: int) -> Optional[str]:
+    # На низком битрейте меньшее разрешение выглядит лучше, чем «мыло» в 1080p
+    if video_bitrate < 400_000:
+        return "scale=-2:'min(480,ih)'"
+    if video_bitrate < 900_000:
+        return "scale=-2:'min(720,ih)'"
+    return None
+
+
+def _memfile(name: str, data: bytes = b"") -> Tuple[str, int]:
+    """
+    Файл для ffmpeg: memfd в памяти (по нему можно seek'аться), без memfd — временный файл.
+    Возвращает (путь для ffmpeg, fd).
+    """
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create(name, 0)
+        path = f"/dev/fd/{fd}"
+    else:
+        fd, path = tempfile.mkstemp(prefix=f"{name}-", suffix=".mp4")
+    if data:
+        os.write(fd, data)
+        os.lseek(fd, 0, os.SEEK_SET)
+    return path, fd
+
+
+def _read_all(fd: int) -> bytes:
+    size = os.lseek(fd, 0, os.SEEK_END)
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _close(path: str, fd: int):
+    os.close(fd)
+    if not path.startswith("/dev/fd/"):
+        os.unlink(path)
+
+
+def _rate_args(video_bitrate: Optional[int]) -> list:
+    if video_bitrate is None:
+        return ["-crf", "28"]
+    return ["-b:v", str(video_bitrate), "-maxrate", str(video_bitrate), "-bufsize", str(video_bitrate * 2)]
+
+
+async def _encode(input_path: str, input_fd: int, video_bitrate: Optional[int], preset: str) -> Optional[bytes]:
+    """Один проход ffmpeg из memfd в memfd. None — ошибка или таймаут."""
+    output_path, output_fd = _memfile("transcode-output")
+    try:
+        scale = _scale_filter(video_bitrate) if video_bitrate else None
+        cmd = [
+            "nice", "-n", "15",
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-i", input_path,
+            "-c:v", "libx264", "-preset", preset, *_rate_args(video_bitrate),
+            *(["-vf", scale] if scale else []),
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", str(AUDIO_BITRATE),
+            # moov в начале файла: Telegram берёт из него длительность и превью
+            "-movflags", "+faststart",
+            "-f", "mp4", output_path,
+        ]
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            pass_fds=(input_fd, output_fd) if input_path.startswith("/dev/fd/") else (),
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=TRANSCODE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logging.error("❌ ffmpeg не уложился в %s сек", TRANSCODE_TIMEOUT)
+            return None
+        if process.returncode != 0:
+            logging.error("❌ ffmpeg завершился с кодом %s: %s", process.returncode, stderr.decode(errors="ignore")[-500:])
+            return None
+        return _read_all(output_fd) or None
+    finally:
+        _close(output_path, output_fd)
+
+
+async def transcode_to_fit(video_bytes: bytes, max_bytes: int = TELEGRAM_UPLOAD_LIMIT,
+                           preset: str = "veryfast") -> bytes:
+    """
+    Перекодирует видео в H.264/AAC под лимит размера (ABR по длительности). Если ABR
+    промахнулся, второй проход — с битрейтом, уменьшенным на величину промаха.
+    Вход и выход — memfd (обычный MP4 с moov в начале), временные файлы — только без memfd.
+    Одновременно работает не больше TRANSCODE_WORKERS ffmpeg. При ошибке — исходные байты.
+    """
+    duration = mp4_duration(video_bytes)
+    if duration:
+        video_bitrate = target_video_bitrate(duration, max_bytes)
+    else:
+        video_bitrate = None
+        logging.warning("⚠️ Длительность видео не определена — сжимаем по CRF без гарантии размера")
+
+    async with _slots:
+        started = time.perf_counter()
+        input_path, input_fd = _memfile("transcode-input", video_bytes)
+        try:
+            output = await _encode(input_path, input_fd, video_bitrate, preset)
+            if output and video_bitrate and len(output) > max_bytes and video_bitrate > MIN_VIDEO_BITRATE:
+                video_bitrate = max(MIN_VIDEO_BITRATE, int(video_bitrate * max_bytes / len(output) * SIZE_MARGIN))
+                logging.info("🎞 Промах ABR: %s KB при лимите %s KB — второй проход", len(output) // 1024, max_bytes // 1024)
+                output = await _encode(input_path, input_fd, video_bitrate, preset) or output
+        except Exception as e:
+            logging.error(f"❌ Ошибка сжатия: {e}")
+            return video_bytes
+        finally:
+            _close(input_path, input_fd)
+
+    if not output:
+        return video_bytes
+
+    observe_stage("ffmpeg", time.perf_counter() - started)
+    logging.info(
+        "🎞 Транскодинг: %s KB → %s KB за %.1f сек (длительность %s сек, видео %s кбит/с)",
+        len(video_bytes) // 1024, len(output) // 1024, time.perf_counter() - started,
+        f"{duration:.1f}" if duration else "?", video_bitrate // 1000 if video_bitrate else "crf",
+    )
+    return output if len(output) < len(video_bytes) else video_bytes
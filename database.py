@@ -3,8 +3,12 @@ import logging
 import asyncio
 import asyncpg
 import json
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
+from app.services import metrics
+
 load_dotenv()
 
 # Настройки подключения
@@ -16,96 +20,462 @@ DB_CONFIG = {
     "port": int(os.getenv("DB_PORT", 5432))
 }
 
+# Размер пула на процесс; супервизор шардов делит общий лимит между диспетчерами
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 5))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 20))
+
 db_pool = None
 db_lock = asyncio.Lock()
+repo: Optional["Repository"] = None
+
+
+def _pool_usage():
+    if db_pool is None:
+        return None
+    size, idle = db_pool.get_size(), db_pool.get_idle_size()
+    return {("in_use",): size - idle, ("idle",): idle, ("max",): db_pool.get_max_size()}
+
+
+metrics.gauge("bot_db_pool_connections", "Соединения пула asyncpg", _pool_usage, ("state",))
+
+
+class Repository:
+    """
+    Доступ к данным поверх пула. Создаётся один раз в init_db.
+
+    SQL — константы класса: asyncpg готовит каждый текст запроса один раз на соединение
+    (кэш prepared statements), дальше идут только Bind/Execute.
+    Методы принимают conn, чтобы несколько операций шли через одно соединение:
+
+        async with db.repo.connection() as conn:
+            balance = await db.repo.get_or_create_user(user_id, conn=conn)
+            refs = await db.repo.get_referrals_count(user_id, conn=conn)
+    """
+
+    # Одна команда: вставка нового пользователя или чтение существующего (без лишней записи строки).
+    # Пользователь, снова написавший боту, перестаёт считаться недоступным для рассылок.
+    # Обычный случай — активный пользователь: только чтение, без блокировки строки.
+    # Upsert — лишь для нового или вернувшегося после блокировки (is_active снова TRUE)
+    GET_USER = "SELECT balance, is_active FROM users WHERE user_id = $1"
+    UPSERT_USER = """
+        INSERT INTO users (user_id, balance, referrer_id) VALUES ($1, 1, $2)
+        ON CONFLICT (user_id) DO UPDATE SET is_active = TRUE
+        RETURNING balance, (xmax = 0) AS created
+    """
+    CREATE_USER = "INSERT INTO users (user_id, balance, referrer_id) VALUES ($1, 1, $2) ON CONFLICT (user_id) DO NOTHING"
+    USERS_COUNT = "SELECT COUNT(*) FROM users WHERE is_active"
+    UPDATE_BALANCE = "UPDATE users SET balance = GREATEST(0, balance + $1) WHERE user_id = $2"
+    GET_REFERRER = "SELECT referrer_id FROM users WHERE user_id = $1"
+    REFERRALS_COUNT = "SELECT COUNT(*) FROM users WHERE referrer_id = $1"
+    ALL_USER_IDS = "SELECT user_id FROM users"
+    USER_IDS_PAGE = "SELECT user_id FROM users WHERE user_id > $1 AND is_active ORDER BY user_id LIMIT $2"
+    DEACTIVATE_USERS = "UPDATE users SET is_active = FALSE WHERE user_id = ANY($1::bigint[]) AND is_active"
+
+    # --- Рассылки: прогресс сохраняется, после рестарта продолжаем с last_user_id ---
+    # Рассылку ведёт один процесс — владелец (owner); сохранение прогресса продлевает его аренду
+    # (heartbeat) и проходит, только пока владелец не сменился. При остановке процесс отпускает run
+    CREATE_BROADCAST = """
+        INSERT INTO broadcast_runs (admin_chat_id, status_message_id, content, total, owner, heartbeat)
+        VALUES ($1, $2, $3::jsonb, $4, $5, now())
+        RETURNING id
+    """
+    SAVE_BROADCAST = """
+        UPDATE broadcast_runs
+        SET last_user_id = $2, sent = $3, failed = $4, blocked = $5, status = $6, updated_at = now(),
+            heartbeat = now(), owner = CASE WHEN $8 THEN NULL ELSE owner END
+        WHERE id = $1 AND owner = $7
+    """
+    # Незавершённые рассылки без живого владельца; SKIP LOCKED — две реплики не заберут одну и ту же
+    CLAIM_BROADCASTS = """
+        UPDATE broadcast_runs SET owner = $1, heartbeat = now()
+        WHERE id IN (
+            SELECT id FROM broadcast_runs
+            WHERE status = 'running' AND (owner IS NULL OR heartbeat < now() - make_interval(secs => $2))
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    """
+    LOG_PAYMENT = "INSERT INTO payment_logs (user_id, amount, status) VALUES ($1, $2, $3)"
+
+    # Зачисление платежа одной командой, идемпотентно по order_num:
+    # повтор вебхука упирается в уникальный order_num, и дальше ничего не выполняется.
+    # Пользователя, которого ещё нет, создаём со стартовой генерацией, как create_user.
+    SETTLE_PAYMENT = """
+        WITH logged AS (
+            INSERT INTO payment_logs (user_id, amount, status, order_num, raw_data)
+            VALUES ($1, $2, 'success', $3, $4::jsonb)
+            ON CONFLICT (order_num) DO NOTHING
+            RETURNING user_id
+        ), credited AS (
+            INSERT INTO users (user_id, balance)
+            SELECT user_id, 1 + $2 FROM logged
+            ON CONFLICT (user_id) DO UPDATE SET balance = users.balance + $2
+            RETURNING user_id, balance, referrer_id
+        ), bonus AS (
+            UPDATE users r SET balance = r.balance + $5
+            FROM credited c
+            WHERE $5 > 0 AND r.user_id = c.referrer_id AND c.referrer_id <> c.user_id
+            RETURNING r.user_id
+        )
+        SELECT c.balance, (SELECT user_id FROM bonus) AS bonus_referrer_id FROM credited c
+    """
+
+    # --- Резервирование генераций ---
+    # Списание при приёме задачи одной командой (проверка + debit атомарны),
+    # по завершении — commit или возврат. Незакрытые холды (упавшие задачи) возвращает release_expired_holds.
+    RESERVE_CREDITS = """
+        WITH debit AS (
+            UPDATE users SET balance = balance - $2
+            WHERE user_id = $1 AND balance >= $2
+            RETURNING balance
+        ), hold AS (
+            INSERT INTO credit_holds (hold_id, user_id, amount, expires_at)
+            SELECT $3, $1, $2, now() + make_interval(secs => $4) FROM debit
+        )
+        SELECT balance FROM debit
+    """
+    COMMIT_CREDITS = "UPDATE credit_holds SET status = 'committed', settled_at = now() WHERE hold_id = $1 AND status = 'held'"
+    RELEASE_CREDITS = """
+        WITH released AS (
+            UPDATE credit_holds SET status = 'released', settled_at = now()
+            WHERE hold_id = $1 AND status = 'held'
+            RETURNING user_id, amount
+        )
+        UPDATE users u SET balance = u.balance + r.amount
+        FROM released r WHERE u.user_id = r.user_id
+        RETURNING u.balance
+    """
+    RELEASE_EXPIRED_HOLDS = """
+        WITH expired AS (
+            UPDATE credit_holds SET status = 'expired', settled_at = now()
+            WHERE status = 'held' AND expires_at < now()
+            RETURNING user_id, amount
+        ), refunded AS (
+            UPDATE users u SET balance = u.balance + e.amount
+            FROM (SELECT user_id, SUM(amount) AS amount FROM expired GROUP BY user_id) e
+            WHERE u.user_id = e.user_id
+        )
+        SELECT COUNT(*) FROM expired
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    def connection(self):
+        """Соединение из пула на несколько операций подряд."""
+        return self.pool.acquire()
+
+    @asynccontextmanager
+    async def _conn(self, conn=None):
+        if conn is not None:
+            yield conn
+        else:
+            async with self.pool.acquire() as acquired:
+                yield acquired
+
+    async def get_or_create_user(self, user_id: int, referrer_id: int = None, conn=None) -> Tuple[int, bool]:
+        """(баланс, создан_ли_сейчас): существующего читаем, пишем только нового или вернувшегося."""
+        async with self._conn(conn) as c:
+            row = await c.fetchrow(self.GET_USER, int(user_id))
+            if row and row["is_active"]:
+                return int(row["balance"]), False
+            row = await c.fetchrow(self.UPSERT_USER, int(user_id), int(referrer_id) if referrer_id else None)
+            return int(row["balance"]), row["created"]
+
+    async def create_user(self, user_id: int, referrer_id: int = None, conn=None):
+        async with self._conn(conn) as c:
+            await c.execute(self.CREATE_USER, int(user_id), int(referrer_id) if referrer_id else None)
+
+    async def get_users_count(self, conn=None) -> int:
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.USERS_COUNT) or 0
+
+    async def update_balance(self, user_id: int, amount: int, conn=None):
+        async with self._conn(conn) as c:
+            await c.execute(self.UPDATE_BALANCE, int(amount), int(user_id))
+
+    async def get_referrer(self, user_id: int, conn=None):
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.GET_REFERRER, int(user_id))
+
+    async def get_referrals_count(self, user_id: int, conn=None) -> int:
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.REFERRALS_COUNT, int(user_id)) or 0
+
+    async def get_all_user_ids(self, conn=None):
+        async with self._conn(conn) as c:
+            rows = await c.fetch(self.ALL_USER_IDS)
+            return [row["user_id"] for row in rows]
+
+    async def iter_user_ids(self, batch_size: int = 1000, after: int = 0):
+        """user_id пачками по первичному ключу: память не растёт с числом пользователей."""
+        last = after
+        while True:
+            async with self.pool.acquire() as c:
+                rows = await c.fetch(self.USER_IDS_PAGE, int(last), int(batch_size))
+            if not rows:
+                return
+            yield [row["user_id"] for row in rows]
+            last = rows[-1]["user_id"]
+
+    async def deactivate_users(self, user_ids, conn=None):
+        async with self._conn(conn) as c:
+            await c.execute(self.DEACTIVATE_USERS, [int(u) for u in user_ids])
+
+    async def create_broadcast(self, admin_chat_id: int, status_message_id: int, content: dict, total: int,
+                               owner: str, conn=None) -> int:
+        async with self._conn(conn) as c:
+            return await c.fetchval(
+                self.CREATE_BROADCAST, int(admin_chat_id), int(status_message_id),
+                json.dumps(content, ensure_ascii=False), int(total), owner
+            )
+
+    async def save_broadcast(self, run_id: int, last_user_id: int, sent: int, failed: int, blocked: int,
+                             status: str, owner: str, release: bool = False, conn=None) -> bool:
+        async with self._conn(conn) as c:
+            result = await c.execute(
+                self.SAVE_BROADCAST, int(run_id), int(last_user_id), sent, failed, blocked, status, owner, release
+            )
+            return result.endswith(" 1")
+
+    async def claim_broadcasts(self, owner: str, lease_seconds: float, conn=None):
+        async with self._conn(conn) as c:
+            return await c.fetch(self.CLAIM_BROADCASTS, owner, float(lease_seconds))
+
+    async def log_payment(self, user_id: int, amount: int, status: str, conn=None):
+        async with self._conn(conn) as c:
+            await c.execute(self.LOG_PAYMENT, int(user_id), int(amount), str(status))
+
+    async def settle_payment(self, order_num: str, user_id: int, amount: int, referral_bonus: int,
+                             raw_data: dict = None, conn=None):
+        """Запись None — этот order_num уже зачислен."""
+        async with self._conn(conn) as c:
+            return await c.fetchrow(
+                self.SETTLE_PAYMENT,
+                int(user_id), int(amount), str(order_num),
+                json.dumps(raw_data, ensure_ascii=False) if raw_data else None,
+                int(referral_bonus),
+            )
+
+    async def reserve_credits(self, user_id: int, amount: int, hold_id: str, ttl_seconds: int, conn=None):
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.RESERVE_CREDITS, int(user_id), int(amount), str(hold_id), float(ttl_seconds))
+
+    async def commit_credits(self, hold_id: str, conn=None) -> bool:
+        async with self._conn(conn) as c:
+            status = await c.execute(self.COMMIT_CREDITS, str(hold_id))
+            return status.endswith(" 1")
+
+    async def release_credits(self, hold_id: str, conn=None):
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.RELEASE_CREDITS, str(hold_id))
+
+    async def release_expired_holds(self, conn=None) -> int:
+        async with self._conn(conn) as c:
+            return await c.fetchval(self.RELEASE_EXPIRED_HOLDS) or 0
+
 
 async def init_db():
     """Инициализация пула соединений с защитой от двойного создания."""
-    global db_pool
+    global db_pool, repo
     if db_pool is None:
         async with db_lock:
             if db_pool is None:
                 try:
                     db_pool = await asyncpg.create_pool(
                         **DB_CONFIG,
-                        min_size=5,
-                        max_size=20
+                        min_size=min(DB_POOL_MIN, DB_POOL_MAX),
+                        max_size=DB_POOL_MAX
                     )
                     logging.info("✅ Пул соединений с локальной БД создан")
+                    await ensure_schema()
+                    repo = Repository(db_pool)
                 except Exception as e:
                     logging.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА БД: {e}")
                     raise e
 
+async def get_repo() -> Repository:
+    """Репозиторий; после старта — без захода в init_db."""
+    if repo is None:
+        await init_db()
+    return repo
+
+# Объекты, которые бот создаёт сам, и DDL для каждого («таблица.колонка» — колонка).
+# На старте — один запрос к каталогу; DDL выполняется только для недостающего:
+# ALTER TABLE берёт ACCESS EXCLUSIVE и на каждом рестарте вставал бы в очередь за транзакциями
+SCHEMA_OBJECTS = (
+    ("credit_holds", """
+        CREATE TABLE IF NOT EXISTS credit_holds (
+            hold_id TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'held',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL,
+            settled_at TIMESTAMPTZ
+        )
+    """),
+    ("credit_holds_expiry_idx", """
+        CREATE INDEX IF NOT EXISTS credit_holds_expiry_idx
+            ON credit_holds (expires_at) WHERE status = 'held'
+    """),
+    ("payment_logs", """
+        CREATE TABLE IF NOT EXISTS payment_logs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            amount INTEGER,
+            status TEXT,
+            created_at TIMESTAMPTZ DEFAULT now()
+        )
+    """),
+    ("payment_logs.order_num", "ALTER TABLE payment_logs ADD COLUMN IF NOT EXISTS order_num TEXT"),
+    ("payment_logs.raw_data", "ALTER TABLE payment_logs ADD COLUMN IF NOT EXISTS raw_data JSONB"),
+    ("payment_logs_order_num_key",
+     "CREATE UNIQUE INDEX IF NOT EXISTS payment_logs_order_num_key ON payment_logs (order_num)"),
+    ("users.is_active", "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE"),
+    ("broadcast_runs", """
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            id BIGSERIAL PRIMARY KEY,
+            admin_chat_id BIGINT NOT NULL,
+            status_message_id BIGINT NOT NULL,
+            content JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """),
+    ("broadcast_runs.owner", "ALTER TABLE broadcast_runs ADD COLUMN IF NOT EXISTS owner TEXT"),
+    ("broadcast_runs.heartbeat", "ALTER TABLE broadcast_runs ADD COLUMN IF NOT EXISTS heartbeat TIMESTAMPTZ"),
+)
+# Миграция не ждёт блокировку дольше этого: иначе за ней встают все запросы к таблице
+SCHEMA_LOCK_TIMEOUT = "5s"
+
+EXISTING_SCHEMA_OBJECTS = """
+    SELECT name FROM unnest($1::text[]) AS name WHERE to_regclass(name) IS NOT NULL
+    UNION ALL
+    SELECT table_name || '.' || column_name FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name || '.' || column_name = ANY($2::text[])
+"""
+
+
+async def ensure_schema():
+    """Создаёт недостающие таблицы, колонки и индексы бота; если всё на месте — только читает каталог."""
+    relations = [name for name, _ in SCHEMA_OBJECTS if "." not in name]
+    columns = [name for name, _ in SCHEMA_OBJECTS if "." in name]
+    async with db_pool.acquire() as conn:
+        existing = {row[0] for row in await conn.fetch(EXISTING_SCHEMA_OBJECTS, relations, columns)}
+        missing = [(name, ddl) for name, ddl in SCHEMA_OBJECTS if name not in existing]
+        if not missing:
+            return
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{SCHEMA_LOCK_TIMEOUT}'")
+            for name, ddl in missing:
+                await conn.execute(ddl)
+        logging.info("🛠 Схема БД: созданы %s", ", ".join(name for name, _ in missing))
+
 async def close_db():
     """Закрытие пула при остановке бота."""
-    global db_pool
+    global db_pool, repo
     if db_pool:
         await db_pool.close()
+        db_pool = None
+        repo = None
         logging.info("💤 Пул соединений с БД закрыт")
 
+# --- Функции модуля: прежний API поверх Repository ---
+
 async def get_users_count():
-    await init_db()
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval("SELECT COUNT(*) FROM users") or 0
+    return await (await get_repo()).get_users_count()
 
 async def create_new_user(user_id: int, referrer_id: int = None):
-    await init_db()
     try:
-        async with db_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO users (user_id, balance, referrer_id) VALUES ($1, 1, $2) ON CONFLICT (user_id) DO NOTHING",
-                int(user_id), int(referrer_id) if referrer_id else None
-            )
-            return True
+        await (await get_repo()).create_user(user_id, referrer_id)
+        return True
     except Exception as e:
         logging.error(f"❌ Ошибка create_new_user {user_id}: {e}")
         return False
 
+async def get_or_create_user(user_id: int, referrer_id: int = None) -> int:
+    """Баланс пользователя; нового регистрирует."""
+    balance, _created = await (await get_repo()).get_or_create_user(user_id, referrer_id)
+    return balance
+
 async def get_balance(user_id: int):
-    await init_db()
-    async with db_pool.acquire() as conn:
-        balance = await conn.fetchval("SELECT balance FROM users WHERE user_id = $1", int(user_id))
-        if balance is None:
-            await create_new_user(user_id)
-            return 1
-        return int(balance)
+    return await get_or_create_user(user_id)
 
 async def update_balance(user_id: int, amount: int):
-    await init_db()
-    async with db_pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE users SET balance = GREATEST(0, balance + $1) WHERE user_id = $2",
-            int(amount), int(user_id)
-        )
-        return True
+    await (await get_repo()).update_balance(user_id, amount)
+    return True
 
 async def get_referrer(user_id: int):
     """Возвращает ID того, кто пригласил данного пользователя (нужно для платежей)"""
-    await init_db()
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval("SELECT referrer_id FROM users WHERE user_id = $1", int(user_id))
+    return await (await get_repo()).get_referrer(user_id)
 
 async def log_payment(user_id: int, amount: int, status: str, order_id: str = None, raw_data: dict = None):
-    await init_db()
     try:
         # Превращаем raw_data в строку JSON для хранения в БД, если нужно
         raw_json = json.dumps(raw_data) if raw_data else None
-        async with db_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO payment_logs (user_id, amount, status) VALUES ($1, $2, $3)",
-                int(user_id), int(amount), str(status)
-            )
+        await (await get_repo()).log_payment(user_id, amount, status)
     except Exception as e:
         logging.error(f"❌ Ошибка log_payment: {e}")
 
 async def get_referrals_count(user_id: int):
-    await init_db()
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval("SELECT COUNT(*) FROM users WHERE referrer_id = $1", int(user_id)) or 0
+    return await (await get_repo()).get_referrals_count(user_id)
 
 async def get_all_user_ids():
     """Возвращает список всех user_id из базы."""
-    await init_db()
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id FROM users")
-        return [row["user_id"] for row in rows]
\ No newline at end of file
+    return await (await get_repo()).get_all_user_ids()
+
+async def settle_payment(order_num: str, user_id: int, amount: int, referral_bonus: int, raw_data: dict = None):
+    """
+    Зачисляет платёж, бонус пригласителю и пишет лог с сырым payload — одной командой.
+    Возвращает (новый баланс, id пригласителя, если бонус начислен) или None для повторного order_num.
+    """
+    row = await (await get_repo()).settle_payment(order_num, user_id, amount, referral_bonus, raw_data)
+    if row is None:
+        return None
+    return int(row["balance"]), row["bonus_referrer_id"]
+
+async def iter_user_ids(batch_size: int = 1000, after: int = 0):
+    """Асинхронный генератор пачек user_id (для рассылок)."""
+    async for batch in (await get_repo()).iter_user_ids(batch_size, after):
+        yield batch
+
+async def deactivate_users(user_ids):
+    """Помечает пользователей, заблокировавших бота: их не считаем и не рассылаем."""
+    if user_ids:
+        await (await get_repo()).deactivate_users(user_ids)
+
+async def create_broadcast(admin_chat_id: int, status_message_id: int, content: dict, total: int, owner: str) -> int:
+    return await (await get_repo()).create_broadcast(admin_chat_id, status_message_id, content, total, owner)
+
+async def save_broadcast(run_id: int, last_user_id: int, sent: int, failed: int, blocked: int, status: str,
+                         owner: str, release: bool = False) -> bool:
+    """Сохраняет прогресс и продлевает аренду. False — рассылку уже ведёт другой процесс."""
+    return await (await get_repo()).save_broadcast(run_id, last_user_id, sent, failed, blocked, status, owner, release)
+
+async def claim_broadcasts(owner: str, lease_seconds: float):
+    """Забирает незавершённые рассылки, у которых нет живого владельца."""
+    return await (await get_repo()).claim_broadcasts(owner, lease_seconds)
+
+async def reserve_credits(user_id: int, amount: int, hold_id: str, ttl_seconds: int):
+    """Списывает amount, если хватает баланса, и создаёт холд. Возвращает остаток или None."""
+    return await (await get_repo()).reserve_credits(user_id, amount, hold_id, ttl_seconds)
+
+async def commit_credits(hold_id: str) -> bool:
+    """Подтверждает списание. False — холд уже закрыт (например, истёк и возвращён)."""
+    return await (await get_repo()).commit_credits(hold_id)
+
+async def release_credits(hold_id: str):
+    """Возвращает зарезервированные генерации. Возвращает новый баланс или None, если холд уже закрыт."""
+    return await (await get_repo()).release_credits(hold_id)
+
+async def release_expired_holds() -> int:
+    """Возвращает генерации по просроченным холдам. Возвращает число закрытых холдов."""
+    return await (await get_repo()).release_expired_holds()
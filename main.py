@@ -1,6 +1,7 @@
 import asyncio
 import os
 import logging
+import signal
 import ssl
 
 # ВАЖНО: конфиг логирования до импортов app.*,
@@ -10,19 +11,30 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+# Режим шардов: пулы БД/HTTP делятся между процессами — до импорта database и app.network
+from app.services.sharding import BOT_SHARDS, ShardRouter, poll_updates, sharding_enabled
+import shard
+if sharding_enabled():
+    shard.configure_pools(BOT_SHARDS)
+
 from aiohttp import web
 from aiogram import Bot
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
 
-from app.bot import dp, settings
+from app.bot import dp, settings, create_bot
 from app.routers import setup_routers
 from app.routers.payments import prodamus_webhook
+from app.routers.polza_callback import polza_callback
+from app.routers.telegram_webhook import TelegramWebhook, webhook_enabled
 from app.routers.album_middleware import AlbumMiddleware
+from app.network import callbacks_enabled, init_polza_client, close_polza_client
+from app.services.polza_poller import close_polza_poller
+from app.services.generation import sweep_expired_holds
+from app.services.broadcast import close_broadcasts, watch_broadcasts
+from app.services.metrics import METRICS_TOKEN, handle_metrics
 import database as db
 
 # --- КОНФИГУРАЦИЯ ---
-WEBHOOK_PORT = 8443
+WEBHOOK_PORT = settings.webhook_port  # WEBHOOK_PORT из окружения, по умолчанию 8443
 WEBHOOK_SSL_CERT = "/root/botchattelegram/certs/cert.pem"
 WEBHOOK_SSL_PRIV = "/root/botchattelegram/certs/private.key"
 
@@ -30,12 +42,10 @@ WEBHOOK_SSL_PRIV = "/root/botchattelegram/certs/private.key"
 async def main():
     # 1. Инициализация базы данных
     await db.init_db()
+    await init_polza_client()
 
     # 2. Инициализация бота
-    bot = Bot(
-        token=settings.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
+    bot = create_bot()
 
     # 3. Роутеры и middleware
     setup_routers(dp)
@@ -50,10 +60,25 @@ async def main():
     dp.message.middleware(AlbumMiddleware(latency=0.6))
     logging.info("✅ База и роутеры готовы")
 
-    # 4. Сервер webhook для платежей
+    # 4. Сервер webhook для платежей и уведомлений Polza
     app = web.Application(client_max_size=100 * 1024 * 1024)
     app["bot"] = bot
     app.router.add_post("/payments/prodamus", prodamus_webhook)
+    if callbacks_enabled():
+        app.router.add_post("/polza/callback", polza_callback)
+    # Порт webhook публичный: /metrics на нём — только под токеном
+    if METRICS_TOKEN:
+        app.router.add_get("/metrics", handle_metrics)
+    else:
+        logging.info("ℹ️ METRICS_TOKEN не задан — /metrics на порту webhook не отдаётся")
+
+    # В режиме шардов этот процесс — супервизор: апдейты только раздаются диспетчерам
+    shard_router = ShardRouter() if sharding_enabled() else None
+
+    telegram_webhook = None
+    if webhook_enabled():
+        telegram_webhook = TelegramWebhook(dp, bot, router=shard_router)
+        telegram_webhook.register(app)
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -69,21 +94,70 @@ async def main():
     await site.start()
     logging.info("💳 Сервер платежей запущен на порту %s", WEBHOOK_PORT)
 
-    # 5. Polling
-    logging.info("🚀 Запуск Polling...")
+    # Возврат генераций по холдам задач, которые так и не завершились
+    holds_sweeper = asyncio.create_task(sweep_expired_holds())
+
+    # Рассылки, прерванные рестартом, продолжаются с сохранённого места — в одном процессе из всех
+    # (при шардах — в процессе-диспетчере админа)
+    broadcast_watcher = asyncio.create_task(watch_broadcasts(bot)) if not shard_router else None
+
+    shard_processes = shard.spawn_shards(BOT_SHARDS) if shard_router else []
+
+    # 5. Приём апдейтов: webhook на этом же сервере или polling
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if telegram_webhook:
+            await run_webhook(bot, telegram_webhook)
+        elif shard_router:
+            logging.info("🚀 Запуск Polling (раздача по %s шардам)...", BOT_SHARDS)
+            await poll_updates(bot, dp, shard_router, _stop_event())
+        else:
+            logging.info("🚀 Запуск Polling...")
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     except Exception as e:
-        logging.exception("❌ Критическая ошибка в polling: %s", e)
+        logging.exception("❌ Критическая ошибка в приёме апдейтов: %s", e)
     finally:
         logging.info("♻️ Завершение работы: очистка ресурсов...")
+        holds_sweeper.cancel()
+        if broadcast_watcher:
+            broadcast_watcher.cancel()
+        # Рассылки сохраняют прогресс в БД — до закрытия пула
+        await close_broadcasts()
         await runner.cleanup()
+        if telegram_webhook:
+            await telegram_webhook.drain()
+        if shard_processes:
+            await asyncio.to_thread(shard.stop_shards, shard_processes)
         await bot.session.close()
+        await close_polza_poller()
+        await close_polza_client()
         await db.close_db()
         logging.info("🛑 Процесс завершен")
 
 
+def _stop_event() -> asyncio.Event:
+    """Событие, которое выставляется по SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+async def run_webhook(bot: Bot, telegram_webhook: TelegramWebhook):
+    """Режим webhook: работаем до SIGTERM/SIGINT. Вебхук при остановке не снимаем —
+    его используют другие реплики, и по нему fly будит остановленную машину."""
+    stop = _stop_event()
+
+    await dp.emit_startup(bot=bot)
+    await telegram_webhook.setup()
+    logging.info("🚀 Приём апдейтов через webhook")
+    try:
+        await stop.wait()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(process)d - %(message)s"
+)
+
+# Общие лимиты ресурсов машины: супервизор делит их между процессами-диспетчерами
+TOTAL_DB_POOL = int(os.getenv("TOTAL_DB_POOL", 80))
+TOTAL_HTTP_POOL = int(os.getenv("TOTAL_HTTP_POOL", 800))
+
+
+async def run_shard(index: int):
+    from app.bot import dp, create_bot
+    from app.routers import setup_routers
+    from app.routers.album_middleware import AlbumMiddleware
+    from app.network import init_polza_client, close_polza_client
+    from app.services.polza_poller import close_polza_poller, get_polza_poller
+    from app.services.broadcast import close_broadcasts, watch_broadcasts
+    from app.services.sharding import ShardConsumer, shard_for
+    from app.routers.broadcast import ADMIN_ID
+    from app.services import tracing
+    import database as db
+
+    tracing.set_process_name(f"shard-{index}")
+    await db.init_db()
+    await init_polza_client()
+    bot = create_bot()
+
+    setup_routers(dp)
+    dp.message.middleware(AlbumMiddleware(latency=0.6))
+    # Callback'и Polza принимает супервизор и пересылает через Redis
+    get_polza_poller().subscribe_callbacks()
+
+    # Команды админа приходят в его шард — там же живут и его рассылки
+    broadcast_watcher = asyncio.create_task(watch_broadcasts(bot)) if shard_for(ADMIN_ID) == index else None
+
+    consumer = ShardConsumer(dp, bot, index)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    await dp.emit_startup(bot=bot)
+    try:
+        await consumer.run()
+    finally:
+        if broadcast_watcher:
+            broadcast_watcher.cancel()
+        await close_broadcasts()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        await close_polza_poller()
+        await close_polza_client()
+        await db.close_db()
+        logging.info("🛑 Диспетчер %s остановлен", index)
+
+
+def _process_main(index: int):
+    asyncio.run(run_shard(index))
+
+
+def configure_pools(count: int):
+    """
+    Делит пулы БД и HTTP между count диспетчерами и супервизором. Вызывать до импорта
+    database/app.network: размеры читаются из окружения при импорте (дочерние процессы его наследуют).
+    """
+    per_process = count + 1
+    os.environ["DB_POOL_MAX"] = str(max(2, TOTAL_DB_POOL // per_process))
+    os.environ["DB_POOL_MIN"] = "2"
+    os.environ["HTTP_POOL_LIMIT"] = str(max(20, TOTAL_HTTP_POOL // per_process))
+    os.environ["HTTP_POOL_LIMIT_PER_HOST"] = str(max(10, TOTAL_HTTP_POOL // per_process // 2))
+
+
+def spawn_shards(count: int):
+    """Запускает count процессов-диспетчеров."""
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_process_main, args=(i,), name=f"dispatcher-{i}") for i in range(count)]
+    for p in processes:
+        p.start()
+    logging.info("🚀 Запущено %s процессов-диспетчеров (БД пул %s, HTTP пул %s на процесс)",
+                 count, os.getenv("DB_POOL_MAX"), os.getenv("HTTP_POOL_LIMIT"))
+    return processes
+
+
+def stop_shards(processes, timeout: float = 60):
+    for p in processes:
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+    for p in processes:
+        p.join(timeout)
@@ -0,0 +1,208 @@
+"""Lua-скрипты admission против настоящего Redis (TEST_REDIS_URL)."""
+import asyncio
+import time
+import uuid
+
+import pytest
+from redis.asyncio import Redis
+
+from app.services import admission as admission_module
+from app.services.admission import AdmissionControl, AdmissionTimeout, QueueFull
+from app.services.single_flight import SingleFlight
+
+MODEL = "nanabanana"
+
+
+def scenario(redis_url, monkeypatch, limit=2, max_queue=10):
+    """Запускает тело теста с отдельным клиентом и префиксом ключей; ключи удаляются после."""
+
+    def decorator(body):
+        async def main():
+            client = Redis.from_url(redis_url)
+            monkeypatch.setattr(admission_module, "redis", client)
+            monkeypatch.setitem(admission_module.MODEL_CONCURRENCY, MODEL, limit)
+            monkeypatch.setitem(admission_module.MODEL_QUEUE_LIMIT, MODEL, max_queue)
+            control = AdmissionControl(prefix=f"test:admission:{uuid.uuid4().hex[:8]}")
+            try:
+                await body(control, client)
+            finally:
+                keys = await client.keys(f"{control.prefix}:*")
+                if keys:
+                    await client.delete(*keys)
+                await client.aclose()
+
+        asyncio.run(main())
+
+    return decorator
+
+
+def test_admit_acquire_release(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=2)
+    async def body(control, client):
+        first = await control.admit(MODEL, user_id=1)
+        second = await control.admit(MODEL, user_id=2)
+        third = await control.admit(MODEL, user_id=3)
+        assert (first.position, second.position, third.position) == (0, 0, 1)
+        assert third.eta > 0
+
+        assert await control._try_acquire(MODEL, first.ticket) == 0
+        assert await control._try_acquire(MODEL, second.ticket) == 0
+        assert await control._try_acquire(MODEL, third.ticket) == 1
+        # Равные метки (у каждого пользователя первый билет) обслуживаются в порядке приёма
+        assert first.ticket < second.ticket < third.ticket
+
+        waiting, active, admitted = control._keys(MODEL)[:3]
+        assert await client.zcard(active) == 2
+        assert await client.zcard(waiting) == 1
+
+        await control._release(MODEL, first.ticket, duration=12.0)
+        assert await control._try_acquire(MODEL, third.ticket) == 0
+        assert await client.zcard(waiting) == 0
+        assert await client.zcard(admitted) == 0
+        assert await client.lrange(f"{control.prefix}:{MODEL}:durations", 0, -1) == [b"12.0"]
+
+
+def test_renew_extends_lease(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch)
+    async def body(control, client):
+        ticket = (await control.admit(MODEL, user_id=1)).ticket
+        assert await control._try_acquire(MODEL, ticket) == 0
+        active = control._keys(MODEL)[1]
+        # Имитируем почти истёкшую аренду: продление сдвигает её на SLOT_LEASE от текущего момента
+        await client.zadd(active, {ticket: time.time() + 1})
+        assert await control._try_acquire(MODEL, ticket) == 0
+        assert await client.zscore(active, ticket) > time.time() + admission_module.SLOT_LEASE - 5
+
+
+def test_expired_lease_frees_slot(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1)
+    async def body(control, client):
+        crashed = (await control.admit(MODEL, user_id=1)).ticket
+        waiting = (await control.admit(MODEL, user_id=2)).ticket
+        assert await control._try_acquire(MODEL, crashed) == 0
+        assert await control._try_acquire(MODEL, waiting) == 1
+        # Процесс с первым билетом упал и не продлевает аренду
+        await client.zadd(control._keys(MODEL)[1], {crashed: time.time() - 1})
+        assert await control._try_acquire(MODEL, waiting) == 0
+
+
+def test_users_interleave_by_fair_tag(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1)
+    async def body(control, client):
+        heavy = [(await control.admit(MODEL, user_id=1)).ticket for _ in range(3)]
+        light = (await control.admit(MODEL, user_id=2)).ticket
+        assert await control._try_acquire(MODEL, heavy[0]) == 0
+        # Одиночный запрос второго пользователя встаёт сразу за первым билетом первого
+        assert await control._try_acquire(MODEL, light) == 1
+        assert await control._try_acquire(MODEL, heavy[1]) == 2
+        await control._release(MODEL, heavy[0], duration=1.0)
+        assert await control._try_acquire(MODEL, light) == 0
+
+
+def test_tags_weighted_by_cost_across_models(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1)
+    async def body(control, client):
+        monkeypatch.setitem(admission_module.MODEL_CONCURRENCY, "kling_motion", 1)
+        # Первый пользователь только что занял kling_motion (15 генераций), второй ещё ничего не запускал
+        await control.admit("kling_motion", user_id=1)
+        blocker = (await control.admit(MODEL, user_id=3)).ticket
+        after_kling = (await control.admit(MODEL, user_id=1)).ticket
+        casual = [(await control.admit(MODEL, user_id=user)).ticket for user in (4, 5)]
+        assert await control._try_acquire(MODEL, blocker) == 0
+        # Запрос дешёвой модели пользователя с дорогой генерацией встаёт за разовыми запросами других
+        assert [await control._try_acquire(MODEL, t) for t in casual] == [1, 2]
+        assert await control._try_acquire(MODEL, after_kling) == 3
+
+
+def test_heavy_users_advance_faster(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1, max_queue=100)
+    async def body(control, client):
+        monkeypatch.setattr(admission_module, "HEAVY_USER_COST", 3)
+        tags = [admission_module._ticket_tag((await control.admit(MODEL, user_id=1)).ticket) for _ in range(5)]
+        # Первые 3 генерации — обычный вес 1, дальше пользователь «тяжёлый» и вес удваивается
+        assert tags == [1, 2, 3, 5, 7]
+        assert int(await client.get(f"{control.prefix}:usage:1")) == 5
+        assert 0 < await client.ttl(f"{control.prefix}:usage:1") <= admission_module.USAGE_WINDOW
+
+
+def test_queue_full(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1, max_queue=2)
+    async def body(control, client):
+        for user in range(3):
+            await control.admit(MODEL, user_id=user)
+        with pytest.raises(QueueFull):
+            await control.admit(MODEL, user_id=99)
+
+
+def test_queue_limited_by_hold_ttl(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=2, max_queue=1000)
+    async def body(control, client):
+        # Ждать можно столько, чтобы разобрать 3 круга по 2 задачи: очередь — не больше 6
+        monkeypatch.setattr(control, "max_wait", lambda model: 3 * 60)
+        await client.lpush(f"{control.prefix}:{MODEL}:durations", 60)
+        assert await control.max_queue(MODEL) == 6
+
+
+def test_fast_failures_do_not_break_queue_limit(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=2)
+    async def body(control, client):
+        durations = f"{control.prefix}:{MODEL}:durations"
+        # Старые замеры, округлённые до нуля, не делят на ноль
+        await client.lpush(durations, 0.0, 0.0)
+        assert await control.average_duration(MODEL) == admission_module.MIN_AVERAGE_DURATION
+        assert (await control.admit(MODEL, user_id=1)).position == 0
+
+        async with control.slot(MODEL) as lease:
+            pass
+        async with control.slot(MODEL) as lease:
+            await asyncio.sleep(0.2)
+            lease.completed = True
+        # Неудачная генерация в статистику не попала, успешная — попала
+        recorded = await client.lrange(durations, 0, -1)
+        assert len(recorded) == 3 and float(recorded[0]) >= 0.2
+
+
+def test_slot_wait_deadline_cancels_ticket(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1)
+    async def body(control, client):
+        monkeypatch.setattr(admission_module, "POLL_INTERVAL", 0.05)
+        holder = (await control.admit(MODEL, user_id=1)).ticket
+        late = (await control.admit(MODEL, user_id=2)).ticket
+        # Ждать слот можно 0.3 сек с момента приёма, а первый билет держит его дольше
+        monkeypatch.setattr(control, "max_wait", lambda model: 0.3)
+        async with control.slot(MODEL, holder):
+            with pytest.raises(AdmissionTimeout):
+                async with control.slot(MODEL, late):
+                    pytest.fail("слот не должен был освободиться")
+        waiting, active, admitted = control._keys(MODEL)[:3]
+        assert await client.zcard(waiting) == 0
+        assert await client.zcard(admitted) == 0
+        assert await client.zcard(active) == 0
+
+
+def test_flight_leader_behind_followers_gets_slot(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, limit=1)
+    async def body(control, client):
+        monkeypatch.setattr(admission_module, "POLL_INTERVAL", 0.05)
+        # Ведомые приняты раньше лидера: их билеты стоят в очереди перед ним
+        followers = [(await control.admit(MODEL, user_id=user)).ticket for user in (1, 2)]
+        leader = (await control.admit(MODEL, user_id=3)).ticket
+        flights = SingleFlight(f"{control.prefix}:flight", distributed=False)
+        generated = []
+
+        def request(ticket):
+            async def produce():
+                async with control.slot(MODEL, ticket):
+                    generated.append(ticket)
+                    await asyncio.sleep(0.1)
+                    return "result"
+
+            return flights.run("key", produce, on_join=lambda: control.cancel(MODEL, ticket))
+
+        first = asyncio.create_task(request(leader))
+        await asyncio.sleep(0)
+        results = await asyncio.wait_for(asyncio.gather(first, *map(request, followers)), timeout=3)
+
+        assert results == ["result"] * 3
+        assert generated == [leader]
+        assert await client.zcard(control._keys(MODEL)[0]) == 0
@@ -0,0 +1,48 @@
+"""Сборка альбома в Redis: части из разных процессов и опоздавшие части (TEST_REDIS_URL)."""
+import asyncio
+import datetime
+import uuid
+
+from aiogram.types import Chat, Message
+from redis.asyncio import Redis
+
+from app.routers import album_middleware as album_module
+from app.routers.album_middleware import AlbumMiddleware
+
+
+def _part(group: str, message_id: int) -> Message:
+    return Message(message_id=message_id, date=datetime.datetime.now(), chat=Chat(id=1, type="private"),
+                   media_group_id=group)
+
+
+def test_album_parts_are_collected_once_and_late_parts_are_not_lost(redis_url, monkeypatch):
+    group = f"test-{uuid.uuid4().hex[:8]}"
+    albums = []
+
+    async def handler(event, data):
+        albums.append([m.message_id for m in data["album"]])
+
+    async def main():
+        client = Redis.from_url(redis_url)
+        monkeypatch.setattr(album_module, "redis", client)
+        # Два экземпляра — как два процесса, между которыми разошлись части альбома
+        first, second = AlbumMiddleware(latency=0.3), AlbumMiddleware(latency=0.3)
+        try:
+            async def deliver(middleware, message_id, delay):
+                await asyncio.sleep(delay)
+                await middleware(handler, _part(group, message_id), {})
+
+            await asyncio.gather(deliver(first, 1, 0), deliver(second, 2, 0.05), deliver(first, 3, 0.1))
+            assert albums == [[1, 2, 3]]
+            key = album_module.ALBUM_KEY.format(group)
+            assert await client.exists(key, f"{key}:leader") == 0
+
+            await deliver(second, 4, 0)
+            assert albums == [[1, 2, 3], [4]]
+        finally:
+            keys = await client.keys(f"{album_module.ALBUM_KEY.format(group)}*")
+            if keys:
+                await client.delete(*keys)
+            await client.aclose()
+
+    asyncio.run(main())
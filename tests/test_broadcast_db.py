@@ -0,0 +1,87 @@
+"""Аренда рассылок между процессами против настоящего Postgres (TEST_DB_DSN)."""
+import asyncio
+
+import asyncpg
+
+import database
+from app.services import broadcast
+
+CONTENT = {"type": "text", "text": "привет"}
+
+
+def run_with_repo(db_dsn, schema, monkeypatch, body):
+    async def main():
+        pool = await asyncpg.create_pool(db_dsn, min_size=1, max_size=3, server_settings={"search_path": schema})
+        monkeypatch.setattr(database, "db_pool", pool)
+        monkeypatch.setattr(database, "repo", database.Repository(pool))
+        try:
+            await database.ensure_schema()
+            await body(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        await asyncio.sleep(0.01)
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+def test_run_is_claimed_by_one_process(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        run_id = await database.create_broadcast(1, 2, CONTENT, 10, owner="a")
+
+        # Владелец жив — вторая реплика рассылку не берёт
+        assert await database.claim_broadcasts("b", 60) == []
+        assert await database.save_broadcast(run_id, 5, 5, 0, 0, "running", owner="a") is True
+
+        # Владелец молчит дольше аренды — рассылку забирает другая реплика, и старый её больше не пишет
+        await pool.execute("UPDATE broadcast_runs SET heartbeat = now() - interval '2 minutes'")
+        assert [run["id"] for run in await database.claim_broadcasts("b", 60)] == [run_id]
+        assert await database.claim_broadcasts("c", 60) == []
+        assert await database.save_broadcast(run_id, 9, 9, 0, 0, "running", owner="a") is False
+        assert await pool.fetchval("SELECT last_user_id FROM broadcast_runs") == 5
+
+        # Остановка процесса отпускает run: следующий процесс забирает его сразу
+        assert await database.save_broadcast(run_id, 7, 7, 0, 0, "running", owner="b", release=True) is True
+        claimed = await database.claim_broadcasts("c", 60)
+        assert [(run["owner"], run["last_user_id"]) for run in claimed] == [("c", 7)]
+
+        await database.save_broadcast(run_id, 10, 10, 0, 0, "finished", owner="c")
+        await pool.execute("UPDATE broadcast_runs SET owner = NULL")
+        assert await database.claim_broadcasts("d", 60) == []
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
+
+
+def test_shutdown_saves_and_releases_before_pool_closes(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        await pool.executemany("INSERT INTO users (user_id) VALUES ($1)", [(i,) for i in range(1, 201)])
+        bot = FakeBot()
+        broadcast.start_broadcast(bot, CONTENT, admin_chat_id=1, status_message_id=2)
+        await asyncio.sleep(0.3)
+
+        await broadcast.close_broadcasts()
+        assert not broadcast.active_broadcasts
+
+        run = await pool.fetchrow("SELECT * FROM broadcast_runs")
+        assert run["status"] == "running" and run["owner"] is None
+        assert 0 < run["sent"] <= len(bot.sent) < 200
+
+        # Другой процесс продолжает с сохранённого места
+        resumed = FakeBot()
+        monkeypatch.setattr(broadcast, "BROADCAST_OWNER", "next-process")
+        assert await broadcast.resume_broadcasts(resumed) == 1
+        await asyncio.gather(*broadcast.active_broadcasts)
+        assert min(resumed.sent) > run["last_user_id"]
+        assert await pool.fetchval("SELECT status FROM broadcast_runs") == "finished"
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
@@ -0,0 +1,111 @@
+"""LRUCache (вытеснение, TTL) и TieredCache против настоящего Redis (TEST_REDIS_URL)."""
+import asyncio
+import time
+import types
+import uuid
+
+import pytest
+from redis.asyncio import Redis
+
+from app.services import cache as cache_module
+from app.services.cache import LRUCache, TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", types.SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+    return now
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert len(lru) == 2
+
+
+def test_lru_ttl(clock):
+    lru = LRUCache(maxsize=10, ttl=60)
+    lru.set("a", 1)
+    lru.set("short", 2, ttl=5)
+
+    clock[0] += 10
+    assert lru.get("short") is None
+    assert lru.get("a") == 1
+    assert len(lru) == 1
+
+    clock[0] += 60
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def scenario(redis_url, monkeypatch, **cache_kwargs):
+    def decorator(body):
+        async def main():
+            client = Redis.from_url(redis_url)
+            monkeypatch.setattr(cache_module, "redis", client)
+            cache = TieredCache(f"test:cache:{uuid.uuid4().hex[:8]}", **cache_kwargs)
+            try:
+                await body(cache, client)
+            finally:
+                keys = await client.keys(f"{cache.prefix}:*")
+                if keys:
+                    await client.delete(*keys)
+                await client.aclose()
+
+        asyncio.run(main())
+        return body
+
+    return decorator
+
+
+def test_l2_is_shared_and_expires(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, ttl=60)
+    async def body(cache, client):
+        await cache.set("k", "v")
+        assert 0 < await client.ttl(cache._key("k")) <= 60
+
+        # Другой процесс: пустой L1, значение приходит из Redis и оседает в L1
+        other = TieredCache(cache.prefix, ttl=60)
+        assert await other.get("k") == "v"
+        assert other.l1.get("k") == "v"
+
+        await cache.set("short", "v", ttl=1)
+        await asyncio.sleep(1.2)
+        assert await TieredCache(cache.prefix, ttl=60).get("short") is None
+
+        await cache.delete("k")
+        assert await cache.get("k") is None
+        assert await client.exists(cache._key("k")) == 0
+
+
+def test_max_entries_evicts_oldest(redis_url, monkeypatch):
+    @scenario(redis_url, monkeypatch, ttl=60, max_entries=3)
+    async def body(cache, client):
+        for i in range(5):
+            await cache.set(f"k{i}", str(i))
+
+        assert await client.zcard(cache._key("__index__")) == 3
+        assert [await client.exists(cache._key(f"k{i}")) for i in range(5)] == [0, 0, 1, 1, 1]
+
+
+def test_redis_errors_are_misses(monkeypatch):
+    async def main():
+        client = Redis.from_url("redis://127.0.0.1:1", socket_connect_timeout=0.5)
+        monkeypatch.setattr(cache_module, "redis", client)
+        cache = TieredCache("test:cache:down", ttl=60)
+
+        await cache.set("k", "v")
+        assert await cache.get("k") == "v"   # из L1
+        cache.l1.pop("k")
+        assert await cache.get("k") is None
+        await cache.delete("k")
+        await client.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""Склеенные одинаковые генерации: платит только запрос, запустивший генерацию."""
+import asyncio
+import types
+from contextlib import asynccontextmanager
+
+from app.routers import photo
+from app.services.admission import SlotLease
+from app.services.single_flight import SingleFlight
+
+
+class FakeAdmission:
+    def __init__(self):
+        self.cancelled = []
+
+    @asynccontextmanager
+    async def slot(self, model, ticket=None):
+        yield SlotLease()
+
+    async def cancel(self, model, ticket):
+        self.cancelled.append(ticket)
+
+
+class FakeBot:
+    def __init__(self):
+        self.captions = []
+
+    async def send_photo(self, chat_id, photo, caption, reply_markup):
+        self.captions.append((chat_id, caption))
+        return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id=f"file-{chat_id}")])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        raise AssertionError(text)
+
+
+def test_only_leader_is_charged(monkeypatch):
+    settled, refunded, generated = [], [], []
+
+    async def generate(**kwargs):
+        generated.append(kwargs["model"])
+        await asyncio.sleep(0.05)
+        return b"image", "png", None
+
+    async def build_sources(*args, **kwargs):
+        return ["https://cdn.example/ref.jpg"]
+
+    async def settle(user_id, model, hold_id):
+        settled.append(hold_id)
+
+    async def refund(hold_id):
+        refunded.append(hold_id)
+
+    async def no_cache(*args, **kwargs):
+        return None
+
+    admission = FakeAdmission()
+    monkeypatch.setattr(photo, "admission", admission)
+    monkeypatch.setattr(photo, "generation_flights", SingleFlight("test:flight", distributed=False))
+    monkeypatch.setattr(photo, "generate", generate)
+    monkeypatch.setattr(photo, "_build_image_sources", build_sources)
+    monkeypatch.setattr(photo, "settle", settle)
+    monkeypatch.setattr(photo, "refund", refund)
+    monkeypatch.setattr(photo, "get_cached_result", no_cache)
+    monkeypatch.setattr(photo, "store_cached_result", no_cache)
+
+    async def main():
+        bot = FakeBot()
+        request = dict(photo_ids=["a"], prompt="кот", model="nanabanana", photo_uids=["ua"])
+        await asyncio.gather(
+            photo.background_photo_gen(bot, chat_id=1, user_id=1, hold_id="h1", ticket="t1", **request),
+            photo.background_photo_gen(bot, chat_id=2, user_id=2, hold_id="h2", ticket="t2", **request),
+        )
+        return dict(bot.captions)
+
+    captions = asyncio.run(main())
+    assert generated == ["nanabanana"]
+    assert settled == ["h1"]
+    assert refunded == ["h2"]
+    assert photo.COALESCED_NOTE not in captions[1]
+    assert captions[2].endswith(photo.COALESCED_NOTE)
+    # Билет ведомого снят при присоединении, лидера — по завершении задачи
+    assert admission.cancelled == ["t2", "t1", "t2"]
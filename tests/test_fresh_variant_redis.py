@@ -0,0 +1,29 @@
+"""Кнопка «Новый вариант» повторяет запрос своего результата, а не последний (TEST_REDIS_URL)."""
+import asyncio
+
+from redis.asyncio import Redis
+
+from app.routers import photo
+
+
+def test_each_result_keeps_its_own_job(redis_url, monkeypatch):
+    async def main():
+        client = Redis.from_url(redis_url)
+        monkeypatch.setattr(photo, "redis", client)
+        first = dict(chat_id=1, photo_ids=["a"], prompt="кот", model="nanabanana", user_id=7, photo_uids=["ua"])
+        second = dict(chat_id=1, photo_ids=["b"], prompt="пёс", model="seedream", user_id=7, photo_uids=["ub"])
+        try:
+            first_id = await photo._remember_job("photo", first)
+            second_id = await photo._remember_job("photo", second)
+            assert first_id != second_id
+
+            # Новый промпт не затирает запрос, под которым уже отправлен результат
+            assert await photo._recall_job(first_id) == {"kind": "photo", **first}
+            assert await photo._recall_job(second_id) == {"kind": "photo", **second}
+            assert await photo._recall_job("missing") is None
+            assert 0 < await client.ttl(f"{photo.REPEAT_PREFIX}:{first_id}") <= photo.REPEAT_TTL
+        finally:
+            await client.delete(*(f"{photo.REPEAT_PREFIX}:{i}" for i in (first_id, second_id)))
+            await client.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Очередь задач на Redis Streams: чистка consumer'ов и dead-letter (TEST_REDIS_URL)."""
+import asyncio
+import json
+import uuid
+
+from redis.asyncio import Redis
+
+from app.services import job_queue
+from app.services.job_queue import JobWorker
+
+
+def scenario(redis_url, monkeypatch):
+    """Отдельный поток и группа на тест; ключи удаляются после."""
+
+    def decorator(body):
+        async def main():
+            client = Redis.from_url(redis_url)
+            suffix = uuid.uuid4().hex[:8]
+            monkeypatch.setattr(job_queue, "redis", client)
+            monkeypatch.setattr(job_queue, "STREAM", f"test:jobs:{suffix}")
+            monkeypatch.setattr(job_queue, "DEAD_STREAM", f"test:jobs:{suffix}:dead")
+            try:
+                await job_queue.ensure_group()
+                await body(client)
+            finally:
+                await client.delete(job_queue.STREAM, job_queue.DEAD_STREAM)
+                await client.aclose()
+
+        asyncio.run(main())
+
+    return decorator
+
+
+def test_stale_consumers_without_pending_are_pruned(redis_url, monkeypatch):
+    monkeypatch.setattr(job_queue, "CONSUMER_PRUNE_IDLE_MS", 100)
+
+    @scenario(redis_url, monkeypatch)
+    async def body(client):
+        await job_queue.enqueue_job("photo", user_id=1)
+        # Прошлые запуски: один успел взять задачу и упал, другой просто завершился
+        await client.xreadgroup(job_queue.GROUP, "host-100-0", {job_queue.STREAM: ">"}, count=1)
+        await client.xreadgroup(job_queue.GROUP, "host-101-0", {job_queue.STREAM: ">"}, count=1)
+        await asyncio.sleep(0.2)
+
+        await JobWorker(None, {}, consumer="host-102-0")._prune_consumers()
+
+        names = [c["name"] for c in await client.xinfo_consumers(job_queue.STREAM, job_queue.GROUP)]
+        # С pending остаётся: его задачу ещё заберёт reclaim
+        assert names == [b"host-100-0"]
+
+
+def test_dead_letter_refunds_immediately(redis_url, monkeypatch):
+    monkeypatch.setattr(job_queue, "CLAIM_IDLE_MS", 0)
+    buried = []
+
+    async def dead_letter(bot, kind, **payload):
+        buried.append((bot, kind, payload))
+
+    @scenario(redis_url, monkeypatch)
+    async def body(client):
+        job = dict(chat_id=5, model="nanabanana", user_id=5, hold_id="hold-1", ticket="t-1")
+        message_id = await job_queue.enqueue_job("photo", **job)
+        # Задачу брали и роняли MAX_DELIVERIES раз
+        await client.xreadgroup(job_queue.GROUP, "crashed", {job_queue.STREAM: ">"}, count=1)
+        for _ in range(job_queue.MAX_DELIVERIES - 1):
+            await client.xclaim(job_queue.STREAM, job_queue.GROUP, "crashed", 0, [message_id])
+
+        worker = JobWorker("bot", {}, consumer="alive", dead_letter=dead_letter)
+        await worker._reclaim()
+
+        assert buried == [("bot", "photo", job)]
+        assert not worker.running
+        assert (await client.xpending(job_queue.STREAM, job_queue.GROUP))["pending"] == 0
+        dead = await client.xrange(job_queue.DEAD_STREAM)
+        assert json.loads(dead[0][1][b"payload"]) == job
@@ -0,0 +1,71 @@
+"""Формат /metrics, проверка токена и замер потокового скачивания результата."""
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from app.network import StreamedInputFile, close_polza_client
+from app.services import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "test", ("stage",), buckets=(1, 5))
+    try:
+        for value in (0.5, 2, 2, 10):
+            histogram.observe(value, "x")
+        assert histogram.render()[2:] == [
+            'test_seconds_bucket{stage="x",le="1"} 1',
+            'test_seconds_bucket{stage="x",le="5"} 3',
+            'test_seconds_bucket{stage="x",le="+Inf"} 4',
+            'test_seconds_sum{stage="x"} 14.5',
+            'test_seconds_count{stage="x"} 4',
+        ]
+    finally:
+        metrics.REGISTRY.remove(histogram)
+
+
+def test_metrics_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "secret")
+
+    def status(path, headers=None):
+        request = make_mocked_request("GET", path, headers=headers or {})
+        return asyncio.run(metrics.handle_metrics(request)).status
+
+    assert status("/metrics") == 403
+    assert status("/metrics?token=wrong") == 403
+    assert status("/metrics", {"Authorization": "Bearer wrong"}) == 403
+    assert status("/metrics?token=secret") == 200
+    assert status("/metrics", {"Authorization": "Bearer secret"}) == 200
+
+
+def test_stage_availability_is_exported():
+    text = metrics.render()
+    assert 'bot_stage_available{stage="result_download"} 1' in text
+    assert 'bot_stage_available{stage="ffmpeg"}' in text
+
+
+def test_streamed_result_download_is_observed():
+    body = b"x" * (3 * 256 * 1024 + 10)
+
+    async def result(request):
+        return web.Response(body=body, content_type="image/png")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/result.png", result)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        metrics.current_model.set("test_stream")
+        try:
+            chunks = [chunk async for chunk in StreamedInputFile(f"http://127.0.0.1:{port}/result.png").read(None)]
+        finally:
+            await close_polza_client()
+            await runner.cleanup()
+        return b"".join(chunks)
+
+    assert asyncio.run(main()) == body
+    series = metrics.STAGE_SECONDS.series[("result_download", "test_stream")]
+    assert sum(series[:-1]) == 1
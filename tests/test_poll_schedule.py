@@ -0,0 +1,63 @@
+"""Границы фаз next_delay: до p10, плотная зона вокруг медианы, хвост."""
+from collections import deque
+
+import pytest
+
+from app.services.poll_schedule import CompletionStats, MAX_INTERVAL_FACTOR, MIN_INTERVAL
+
+MODEL = "kling_standard"
+DEFAULT = 10.0
+
+
+@pytest.fixture
+def stats():
+    # Замеры 0..100 с: p10 = 10, p50 = 50, p90 = 90, плотный шаг (90 - 10) / 20 = 4
+    stats = CompletionStats(history_size=500, min_samples=20)
+    stats.samples[MODEL] = deque(map(float, range(101)), maxlen=500)
+    return stats
+
+
+def test_quantiles(stats):
+    assert stats.quantiles(MODEL) == (10.0, 50.0, 90.0)
+
+
+def test_default_interval_until_enough_samples():
+    stats = CompletionStats(min_samples=20)
+    stats.samples[MODEL] = deque(map(float, range(19)))
+    assert stats.quantiles(MODEL) is None
+    assert stats.next_delay(MODEL, 30, DEFAULT) == DEFAULT
+    # История ведётся по модели бота: у другой модели своих замеров нет
+    assert stats.next_delay("seedream", 30, DEFAULT) == DEFAULT
+
+
+def test_before_p10_jumps_to_dense_zone(stats):
+    assert stats.next_delay(MODEL, 0, DEFAULT) == 10
+    assert stats.next_delay(MODEL, 7, DEFAULT) == 3
+    assert stats.next_delay(MODEL, 9.9, DEFAULT) == MIN_INTERVAL
+
+
+def test_dense_zone_is_densest_at_median(stats):
+    assert stats.next_delay(MODEL, 50, DEFAULT) == 4
+    assert stats.next_delay(MODEL, 10, DEFAULT) == 8
+    assert stats.next_delay(MODEL, 30, DEFAULT) == 6
+    assert stats.next_delay(MODEL, 89.9, DEFAULT) == pytest.approx(8, abs=0.01)
+    # К краям зоны пауза не превышает фиксированный интервал модели
+    assert stats.next_delay(MODEL, 10, 5) == 5
+
+
+def test_tail_backs_off_with_lateness(stats):
+    assert stats.next_delay(MODEL, 90, DEFAULT) == 4
+    assert stats.next_delay(MODEL, 110, DEFAULT) == 5
+    assert stats.next_delay(MODEL, 150, DEFAULT) == 15
+    assert stats.next_delay(MODEL, 1000, DEFAULT) == DEFAULT * MAX_INTERVAL_FACTOR
+
+
+def test_dense_step_is_bounded(stats):
+    # Узкое распределение: шаг не меньше MIN_INTERVAL
+    stats.samples[MODEL] = deque([20.0] * 50 + [20.5] * 50)
+    stats._quantiles.clear()
+    assert stats.next_delay(MODEL, 20.25, DEFAULT) == MIN_INTERVAL
+    # Широкое распределение: шаг не больше фиксированного интервала
+    stats.samples[MODEL] = deque(map(float, range(0, 1001, 10)))
+    stats._quantiles.clear()
+    assert stats.next_delay(MODEL, 500, DEFAULT) == DEFAULT
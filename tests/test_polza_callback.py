@@ -0,0 +1,101 @@
+"""Callback Polza — только сигнал к опросу: результат берётся из GET к API, а не из тела запроса."""
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from app.network import close_polza_client
+from app.routers import polza_callback as callback_module
+from app.services import polza_poller as poller_module
+from app.services.poll_schedule import CompletionStats
+from app.services.polza_poller import PolzaPoller
+
+REAL_RESULT = {"status": "completed", "url": "https://cdn.example/real.png"}
+
+
+async def start(app: web.Application) -> tuple:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def test_callback_only_wakes_authoritative_poll(monkeypatch):
+    stats = CompletionStats()
+    monkeypatch.setattr(stats, "record", lambda model, seconds: None)
+    monkeypatch.setattr(poller_module, "completion_stats", stats)
+    monkeypatch.setattr(callback_module, "POLZA_CALLBACK_SECRET", "secret")
+    polls = []
+
+    async def status(request):
+        polls.append(request.match_info["id"])
+        return web.json_response(REAL_RESULT)
+
+    async def main():
+        polza = web.Application()
+        polza.router.add_get("/media/{id}", status)
+        bot = web.Application()
+        bot.router.add_post("/polza/callback", callback_module.polza_callback)
+        polza_runner, polza_url = await start(polza)
+        bot_runner, bot_url = await start(bot)
+        monkeypatch.setattr(poller_module, "BASE_URL", polza_url)
+
+        stats._loaded.add("model")
+        poller = PolzaPoller(tick=0.05, safety_interval=None)
+        monkeypatch.setattr(poller_module, "polza_poller", poller)
+        poller.start()
+        try:
+            # По расписанию опрос был бы через минуту — будит только callback
+            waiting = asyncio.create_task(poller.wait("job-1", "model", interval=60, timeout=120))
+            await asyncio.sleep(0.1)
+            forged = {"id": "job-1", "status": "completed", "url": "https://attacker.example/x.png"}
+
+            async with aiohttp.ClientSession() as session:
+                for token in ("", "wrong"):
+                    async with session.post(f"{bot_url}/polza/callback?token={token}", json=forged) as resp:
+                        assert resp.status == 403
+                assert not waiting.done() and polls == []
+
+                async with session.post(f"{bot_url}/polza/callback?token=secret", json=forged) as resp:
+                    assert resp.status == 200
+
+            result = await asyncio.wait_for(waiting, timeout=2)
+            assert result == REAL_RESULT
+            assert polls == ["job-1"]
+        finally:
+            await poller.close()
+            await close_polza_client()
+            await bot_runner.cleanup()
+            await polza_runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_callback_before_wait_polls_immediately(monkeypatch):
+    stats = CompletionStats()
+    monkeypatch.setattr(stats, "record", lambda model, seconds: None)
+    monkeypatch.setattr(poller_module, "completion_stats", stats)
+
+    async def status(request):
+        return web.json_response(REAL_RESULT)
+
+    async def main():
+        polza = web.Application()
+        polza.router.add_get("/media/{id}", status)
+        runner, url = await start(polza)
+        monkeypatch.setattr(poller_module, "BASE_URL", url)
+        stats._loaded.add("model")
+        poller = PolzaPoller(tick=0.05, safety_interval=None)
+        poller.start()
+        try:
+            assert poller.wake("job-2") is False
+            result = await asyncio.wait_for(poller.wait("job-2", "model", interval=60, timeout=120), timeout=2)
+            assert result == REAL_RESULT
+            assert not poller.early_wakeups
+        finally:
+            await poller.close()
+            await close_polza_client()
+            await runner.cleanup()
+
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""Замер времени выполнения задач Polza общим поллером (локальный HTTP вместо Polza)."""
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from app.network import close_polza_client
+from app.services import metrics, polza_poller as poller_module
+from app.services.poll_schedule import CompletionStats
+from app.services.polza_poller import PolzaPoller
+
+FINISHES_AFTER = 0.6
+INTERVAL = 0.4
+
+
+def test_completion_time_is_keyed_by_bot_model_and_centred_between_polls(monkeypatch):
+    stats = CompletionStats()
+    persisted = []
+
+    async def persist(model, seconds):
+        await asyncio.sleep(0)
+        persisted.append((model, seconds))
+
+    monkeypatch.setattr(stats, "_persist", persist)
+    monkeypatch.setattr(poller_module, "completion_stats", stats)
+    submitted = {}
+
+    async def status(request):
+        done = time.monotonic() - submitted[request.match_info["id"]] >= FINISHES_AFTER
+        return web.json_response({"status": "completed" if done else "processing", "url": "https://cdn/r.png"})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/media/{id}", status)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        monkeypatch.setattr(poller_module, "BASE_URL", f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}")
+        # kling_5 и kling_10 у Polza — одна модель; статистика должна различать их
+        stats._loaded.update({"kling_5", "kling/v2.5"})
+        metrics.current_model.set("kling_5")
+        poller = PolzaPoller(tick=0.05, safety_interval=None)
+        poller.start()
+        try:
+            submitted["job-1"] = time.monotonic()
+            result = await poller.wait("job-1", "kling/v2.5", interval=INTERVAL, timeout=5)
+            assert result["status"] == "completed"
+            assert stats._persisting
+            await asyncio.gather(*stats._persisting)
+        finally:
+            await poller.close()
+            await close_polza_client()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert list(stats.samples) == ["kling_5"]
+    # Завершение увидел опрос на 0.8 с; предыдущий был на 0.4 с — в статистику идёт середина
+    assert stats.samples["kling_5"][0] == pytest.approx(FINISHES_AFTER, abs=0.1)
+    assert persisted == [("kling_5", stats.samples["kling_5"][0])]
+    assert not stats._persisting
+
+
+def test_hung_status_request_does_not_stall_other_jobs(monkeypatch):
+    monkeypatch.setattr(poller_module, "POLL_REQUEST_TIMEOUT", aiohttp.ClientTimeout(total=0.5))
+    stats = CompletionStats()
+    monkeypatch.setattr(stats, "record", lambda model, seconds: None)
+    monkeypatch.setattr(poller_module, "completion_stats", stats)
+    hung_polls = []
+
+    async def status(request):
+        if request.match_info["id"] == "hung":
+            hung_polls.append(time.monotonic())
+            await asyncio.sleep(30)
+        return web.json_response({"status": "completed", "url": "https://cdn/r.png"})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/media/{id}", status)
+        runner = web.AppRunner(app, shutdown_timeout=0.1)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        monkeypatch.setattr(poller_module, "BASE_URL", f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}")
+        stats._loaded.update({"hung", "fast"})
+        poller = PolzaPoller(tick=0.05, safety_interval=None)
+        poller.start()
+        try:
+            hung = asyncio.create_task(poller.wait("hung", "hung", interval=0.1, timeout=1.5))
+            await asyncio.sleep(0.2)
+            started = time.monotonic()
+            # Опрос «hung» висит, но проверка соседней задачи уходит по своему расписанию
+            assert (await poller.wait("fast", "fast", interval=0.1, timeout=5))["status"] == "completed"
+            assert time.monotonic() - started < 0.4
+            assert await hung is None
+        finally:
+            await poller.close()
+            await close_polza_client()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    # Зависший GET обрывается по таймауту опроса, и задачу опрашивают снова (без параллельных дублей)
+    assert len(hung_polls) >= 2
+    assert all(b - a >= 0.45 for a, b in zip(hung_polls, hung_polls[1:]))
@@ -0,0 +1,129 @@
+"""SQL Repository против настоящего Postgres (TEST_DB_DSN): пользователи, платежи, холды генераций."""
+import asyncio
+import logging
+import uuid
+
+import asyncpg
+
+import database
+from app.services import generation
+
+
+def run_with_repo(db_dsn, schema, monkeypatch, body):
+    async def main():
+        pool = await asyncpg.create_pool(db_dsn, min_size=1, max_size=3, server_settings={"search_path": schema})
+        monkeypatch.setattr(database, "db_pool", pool)
+        monkeypatch.setattr(database, "repo", database.Repository(pool))
+        try:
+            await database.ensure_schema()
+            await body(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+async def balance(pool, user_id):
+    return await pool.fetchval("SELECT balance FROM users WHERE user_id = $1", user_id)
+
+
+async def hold_status(pool, hold_id):
+    return await pool.fetchval("SELECT status FROM credit_holds WHERE hold_id = $1", hold_id)
+
+
+def test_reserve_commit_release(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        await database.get_or_create_user(1)
+        await database.update_balance(1, 4)
+
+        first, second = uuid.uuid4().hex, uuid.uuid4().hex
+        assert await database.reserve_credits(1, 3, first, 60) == 2
+        assert await database.reserve_credits(1, 3, second, 60) is None
+        assert await hold_status(pool, second) is None
+
+        assert await database.commit_credits(first) is True
+        assert await database.commit_credits(first) is False
+        assert await database.release_credits(first) is None
+        assert await balance(pool, 1) == 2
+
+        assert await database.reserve_credits(1, 2, second, 60) == 0
+        assert await database.release_credits(second) == 2
+        assert await database.release_credits(second) is None
+        assert await hold_status(pool, second) == "released"
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
+
+
+def test_expired_hold_is_refunded_once(db_dsn, db_schema, monkeypatch, caplog):
+    async def body(pool):
+        await database.get_or_create_user(1)
+        await database.update_balance(1, 4)
+
+        stale = await generation.reserve(1, 2)
+        live = await generation.reserve(1, 1)
+        await pool.execute("UPDATE credit_holds SET expires_at = now() - interval '1 second' WHERE hold_id = $1", stale)
+        assert await balance(pool, 1) == 2
+
+        assert await database.release_expired_holds() == 1
+        assert await database.release_expired_holds() == 0
+        assert await balance(pool, 1) == 4
+        assert await hold_status(pool, live) == "held"
+
+        # Задача всё-таки доставила результат после возврата: второй раз не списываем и не возвращаем
+        with caplog.at_level(logging.WARNING):
+            await generation.settle(1, 2, stale)
+        assert stale in caplog.text
+        await generation.refund(stale)
+        assert await hold_status(pool, stale) == "expired"
+        assert await balance(pool, 1) == 4
+
+        await generation.settle(1, 1, live)
+        assert await hold_status(pool, live) == "committed"
+        assert await balance(pool, 1) == 4
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
+
+
+def test_get_or_create_user(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        repo = database.repo
+        assert await repo.get_or_create_user(1, referrer_id=7) == (1, True)
+        await database.update_balance(1, 4)
+        assert await repo.get_or_create_user(1, referrer_id=8) == (5, False)
+        assert await database.get_referrer(1) == 7
+
+        # Повторный get_balance — только чтение: строку не обновляем и не блокируем
+        version = await pool.fetchval("SELECT xmin::text FROM users WHERE user_id = 1")
+        async with pool.acquire() as locker, locker.transaction():
+            await locker.execute("SELECT 1 FROM users WHERE user_id = 1 FOR UPDATE")
+            assert await asyncio.wait_for(repo.get_or_create_user(1), timeout=2) == (5, False)
+        assert await pool.fetchval("SELECT xmin::text FROM users WHERE user_id = 1") == version
+
+        # Вернувшийся после блокировки пользователь снова активен, баланс не трогаем
+        await database.deactivate_users([1])
+        assert await database.get_users_count() == 0
+        assert await repo.get_or_create_user(1) == (5, False)
+        assert await database.get_users_count() == 1
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
+
+
+def test_settle_payment_is_idempotent(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        await database.get_or_create_user(10)
+        await database.get_or_create_user(11, referrer_id=10)
+
+        assert await database.settle_payment("order-1", 11, 50, 5, {"sum": "500"}) == (51, 10)
+        assert await database.settle_payment("order-1", 11, 50, 5, {"sum": "500"}) is None
+        assert await balance(pool, 11) == 51
+        assert await balance(pool, 10) == 6
+        assert await pool.fetchval("SELECT raw_data->>'sum' FROM payment_logs WHERE order_num = 'order-1'") == "500"
+
+        # Платёж от пользователя, которого ещё нет: создаётся со стартовой генерацией
+        assert await database.settle_payment("order-2", 12, 20, 5) == (21, None)
+        # Сам себя пригласивший бонус не получает
+        await pool.execute("UPDATE users SET referrer_id = user_id WHERE user_id = 12")
+        assert await database.settle_payment("order-3", 12, 20, 5) == (41, None)
+        assert await pool.fetchval("SELECT count(*) FROM payment_logs") == 3
+
+    run_with_repo(db_dsn, db_schema, monkeypatch, body)
@@ -0,0 +1,57 @@
+"""ensure_schema против настоящего Postgres (TEST_DB_DSN)."""
+import asyncio
+
+import asyncpg
+
+import database
+
+
+def run_with_pool(db_dsn, schema, monkeypatch, body):
+    async def main():
+        pool = await asyncpg.create_pool(db_dsn, min_size=1, max_size=3, server_settings={"search_path": schema})
+        monkeypatch.setattr(database, "db_pool", pool)
+        try:
+            await body(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+async def columns(conn, table):
+    return {row[0] for row in await conn.fetch(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = $1",
+        table,
+    )}
+
+
+def test_restart_does_not_take_table_locks(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        await database.ensure_schema()
+        async with pool.acquire() as conn:
+            assert {"order_num", "raw_data"} <= await columns(conn, "payment_logs")
+            assert "is_active" in await columns(conn, "users")
+
+        # Идёт долгая пишущая транзакция: ALTER TABLE (ACCESS EXCLUSIVE) встал бы за ней в очередь
+        async with pool.acquire() as writer:
+            async with writer.transaction():
+                await writer.execute("LOCK TABLE users, payment_logs, credit_holds IN ROW EXCLUSIVE MODE")
+                await asyncio.wait_for(database.ensure_schema(), timeout=2)
+
+    run_with_pool(db_dsn, db_schema, monkeypatch, body)
+
+
+def test_only_missing_objects_are_created(db_dsn, db_schema, monkeypatch):
+    async def body(pool):
+        await database.ensure_schema()
+        async with pool.acquire() as conn:
+            await conn.execute("DROP INDEX payment_logs_order_num_key; ALTER TABLE payment_logs DROP COLUMN raw_data")
+            await conn.execute("INSERT INTO payment_logs (user_id, amount, status, order_num) VALUES (1, 100, 'ok', 'A1')")
+
+            await database.ensure_schema()
+
+            assert "raw_data" in await columns(conn, "payment_logs")
+            assert await conn.fetchval("SELECT to_regclass('payment_logs_order_num_key') IS NOT NULL")
+            assert await conn.fetchval("SELECT count(*) FROM payment_logs") == 1
+
+    run_with_pool(db_dsn, db_schema, monkeypatch, body)
@@ -0,0 +1,75 @@
+"""Супервизор шардов переживает недоступный Redis: апдейты не теряются, процесс не падает."""
+import asyncio
+
+from aiogram.types import Update
+from redis.exceptions import ConnectionError
+
+from app.services import sharding
+from app.services.sharding import ShardRouter, poll_updates
+
+
+def make_update(update_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "u"},
+        },
+    })
+
+
+class FlakyRedis:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.added = []
+
+    async def xadd(self, stream, fields, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Redis недоступен")
+        self.added.append(fields["update"])
+
+
+class FakeBot:
+    def __init__(self, updates, stop):
+        self.updates = updates
+        self.stop = stop
+        self.offsets = []
+
+    async def delete_webhook(self, **kwargs):
+        pass
+
+    async def get_updates(self, offset=None, **kwargs):
+        self.offsets.append(offset)
+        pending = [u for u in self.updates if offset is None or u.update_id >= offset]
+        if not pending:
+            self.stop.set()
+            await asyncio.sleep(3600)
+        return pending
+
+
+class FakeDispatcher:
+    def resolve_used_update_types(self):
+        return ["message"]
+
+
+def test_poll_survives_redis_outage(monkeypatch):
+    redis = FlakyRedis(failures=sharding.ROUTE_ATTEMPTS + 2)
+    monkeypatch.setattr(sharding, "redis", redis)
+    monkeypatch.setattr(sharding, "ROUTE_RETRY_DELAY", 0)
+    monkeypatch.setattr(sharding, "POLL_BACKOFF_MIN", 0.01)
+
+    async def main():
+        stop = asyncio.Event()
+        bot = FakeBot([make_update(1), make_update(2)], stop)
+        router = ShardRouter(shards=2)
+        await asyncio.wait_for(poll_updates(bot, FakeDispatcher(), router, stop), timeout=5)
+        return bot, router
+
+    bot, router = asyncio.run(main())
+    # Первый getUpdates не раздан — его апдейты запрошены снова с того же offset
+    assert bot.offsets[:2] == [None, None]
+    assert bot.offsets[-1] == 3
+    assert len(redis.added) == 2
+    assert router.routed == [1, 1]
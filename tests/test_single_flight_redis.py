@@ -0,0 +1,55 @@
+"""Склейка одинаковых генераций между процессами через Redis (TEST_REDIS_URL)."""
+import asyncio
+import uuid
+
+from redis.asyncio import Redis
+
+from app.services import single_flight as single_flight_module
+from app.services.single_flight import SingleFlight
+
+RESULT = (None, "mp4", "https://cdn.example/result.mp4")
+
+
+def test_leader_keeps_lock_longer_than_its_ttl(redis_url, monkeypatch):
+    monkeypatch.setattr(single_flight_module, "FLIGHT_LOCK_TTL", 1)
+    monkeypatch.setattr(single_flight_module, "FLIGHT_LOCK_RENEW_INTERVAL", 0.2)
+    monkeypatch.setattr(single_flight_module, "FLIGHT_POLL_INTERVAL", 0.05)
+    calls = []
+
+    async def main():
+        client = Redis.from_url(redis_url)
+        monkeypatch.setattr(single_flight_module, "redis", client)
+        prefix = f"test:flight:{uuid.uuid4().hex[:8]}"
+        # Два экземпляра — как два процесса-воркера
+        leader_process = SingleFlight(prefix, distributed=True)
+        follower_process = SingleFlight(prefix, distributed=True)
+
+        async def slow_generation():
+            calls.append("leader")
+            # Генерация идёт дольше FLIGHT_LOCK_TTL: без продления lock истёк бы
+            await asyncio.sleep(2.5)
+            return RESULT
+
+        async def duplicate_generation():
+            calls.append("follower")
+            return None, "mp4", "https://cdn.example/duplicate.mp4"
+
+        try:
+            leader = asyncio.create_task(leader_process.run("key", slow_generation))
+            await asyncio.sleep(0.1)
+            async def joined():
+                calls.append("joined")
+
+            follower = await follower_process.run("key", duplicate_generation, on_join=joined)
+            assert await leader == RESULT
+            assert follower == RESULT
+            assert follower_process.coalesced_remote == 1
+            assert await client.exists(f"{prefix}:lock:key") == 0
+        finally:
+            keys = await client.keys(f"{prefix}:*")
+            if keys:
+                await client.delete(*keys)
+            await client.aclose()
+
+    asyncio.run(main())
+    assert calls == ["leader", "joined"]
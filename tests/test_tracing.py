@@ -0,0 +1,37 @@
+"""Трассы из нескольких процессов: у каждого свой файл, trace_report читает все."""
+import os
+import subprocess
+import sys
+
+from tools.trace_report import read_traces
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WRITER = """
+import sys
+from app.services import tracing
+tracing.set_process_name(sys.argv[1])
+for i in range(int(sys.argv[2])):
+    tracing.start_trace("photo", "nanabanana", i, process=sys.argv[1])
+    tracing.add_span("generate", 0.01)
+    tracing.finish_trace("ok")
+"""
+
+
+def test_processes_write_separate_rotated_files(tmp_path):
+    base = tmp_path / "traces.jsonl"
+    env = {**os.environ, "PYTHONPATH": ROOT, "TRACING": "1", "TRACE_LOG": str(base),
+           "TRACE_LOG_MAX_BYTES": "4096", "TRACE_LOG_BACKUPS": "50"}
+    names = ["bot", "worker-0", "worker-1"]
+    writers = [subprocess.Popen([sys.executable, "-c", WRITER, name, "200"], env=env) for name in names]
+    assert [w.wait(timeout=60) for w in writers] == [0, 0, 0]
+
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert "traces.worker-0.jsonl" in files and "traces.worker-0.jsonl.1" in files
+    assert "traces.jsonl" not in files
+
+    traces = list(read_traces(str(base)))
+    assert len(traces) == 600
+    assert len({t["trace_id"] for t in traces}) == 600
+    for name in names:
+        assert sorted(t["user_id"] for t in traces if t["process"] == name) == list(range(200))
@@ -0,0 +1,82 @@
+"""Транскодинг настоящим ffmpeg и пережатие результата больше лимита Telegram на пути отправки."""
+import asyncio
+import shutil
+import subprocess
+
+import pytest
+from aiohttp import web
+
+from app.network import close_polza_client
+from app.routers import photo
+from app.services.transcode import mp4_duration, transcode_to_fit
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="нужен ffmpeg в PATH")
+
+SECONDS = 4
+
+
+@pytest.fixture(scope="module")
+def source_video(tmp_path_factory) -> bytes:
+    # Шум плохо сжимается: исходник заметно больше лимитов ниже
+    path = tmp_path_factory.mktemp("video") / "source.mp4"
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=25:duration={SECONDS}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={SECONDS}",
+        "-vf", "noise=alls=30:allf=t",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18",
+        "-c:a", "aac", "-shortest", str(path),
+    ], check=True, capture_output=True)
+    return path.read_bytes()
+
+
+def test_transcode_fits_limit_and_keeps_duration(source_video):
+    max_bytes = 150 * 1024
+    assert len(source_video) > max_bytes
+
+    output = asyncio.run(transcode_to_fit(source_video, max_bytes=max_bytes))
+
+    assert len(output) <= max_bytes
+    # moov с длительностью в начале файла (faststart), а не пустой moov фрагментированного MP4
+    assert output.find(b"moov") < output.find(b"mdat")
+    assert mp4_duration(output) == pytest.approx(SECONDS, abs=0.2)
+
+
+def test_transcode_returns_source_on_ffmpeg_error():
+    garbage = b"not a video" * 100
+    assert asyncio.run(transcode_to_fit(garbage, max_bytes=100)) == garbage
+
+
+def test_fit_video_result_transcodes_streamed_result_over_limit(source_video, monkeypatch):
+    limit = 200 * 1024
+    monkeypatch.setattr(photo, "TELEGRAM_UPLOAD_LIMIT", limit)
+    requests = []
+
+    async def video(request):
+        requests.append(request.method)
+        return web.Response(body=source_video, content_type="video/mp4")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/result.mp4", video)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/result.mp4"
+        try:
+            data, ext, result_url = await photo._fit_video_result((None, "mp4", url))
+            assert (ext, result_url) == ("mp4", url)
+            assert data is not None and len(data) <= limit
+            assert mp4_duration(data) == pytest.approx(SECONDS, abs=0.2)
+
+            # Под лимитом результат так и идёт потоком, без скачивания
+            monkeypatch.setattr(photo, "TELEGRAM_UPLOAD_LIMIT", len(source_video))
+            assert await photo._fit_video_result((None, "mp4", url)) == (None, "mp4", url)
+        finally:
+            await close_polza_client()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert requests == ["HEAD", "GET", "HEAD"]
@@ -0,0 +1,77 @@
+"""
+Бенчмарк транскодинга: время кодирования против итогового размера для разных лимитов.
+
+    python -m tools.bench_transcode                       # синтетическое видео 1080p, 10 сек
+    python -m tools.bench_transcode --input result.mp4 --targets 5 7 15 48 --parallel 4
+
+Для каждого лимита (МБ) печатает время, размер и попадание в лимит; --parallel N
+запускает N одинаковых задач сразу, чтобы увидеть влияние TRANSCODE_WORKERS.
+Нужен ffmpeg в PATH.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+from app.services import transcode
+
+
+def synthetic_video(seconds: int, size: str) -> bytes:
+    """Тестовое видео с шумом (плохо сжимается — честная нагрузка на кодер)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        # faststart перезаписывает файл, в pipe его не вывести
+        path = os.path.join(tmp, "synthetic.mp4")
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            "-vf", "noise=alls=30:allf=t",
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18",
+            "-c:a", "aac", "-shortest", "-movflags", "+faststart",
+            "-f", "mp4", path,
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+async def run(data: bytes, targets, parallel: int, preset: str):
+    duration = transcode.mp4_duration(data)
+    print(f"Вход: {len(data) / 1024 / 1024:.1f} MB, {duration:.1f} сек, воркеров: {transcode.TRANSCODE_WORKERS}")
+    print(f"{'лимит MB':>9} {'битрейт':>10} {'время с':>8} {'размер MB':>10} {'от лимита':>10}")
+    for target_mb in targets:
+        max_bytes = int(target_mb * 1024 * 1024)
+        started = time.perf_counter()
+        outputs = await asyncio.gather(*(
+            transcode.transcode_to_fit(data, max_bytes=max_bytes, preset=preset) for _ in range(parallel)
+        ))
+        elapsed = time.perf_counter() - started
+        size = len(outputs[0])
+        bitrate = transcode.target_video_bitrate(duration, max_bytes) // 1000 if duration else 0
+        print(f"{target_mb:>9} {bitrate:>8}k {elapsed:>8.1f} {size / 1024 / 1024:>10.2f} {size / max_bytes:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode benchmark")
+    parser.add_argument("--input", help="MP4-файл (по умолчанию — синтетический)")
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--targets", type=float, nargs="+", default=[5, 7, 15, 48])
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--preset", default="veryfast")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.input:
+        with open(args.input, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_video(args.seconds, args.size)
+    asyncio.run(run(data, args.targets, args.parallel, args.preset))
+
+
+if __name__ == "__main__":
+    main()
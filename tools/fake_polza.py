@@ -0,0 +1,150 @@
+"""
+Локальная заглушка Polza API для проверки polling и callback'ов без реальных генераций.
+
+Запуск:
+    python -m tools.fake_polza --port 8081 --median 8 --sigma 0.4 --fail-rate 0.05
+
+Бот направляем на неё переменными окружения:
+    POLZA_BASE_URL=http://127.0.0.1:8081/api/v1
+    POLZA_CALLBACK_URL=http://127.0.0.1:8443/polza/callback
+    POLZA_CALLBACK_SECRET=<любая строка>
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import aiohttp
+from aiohttp import web
+
+# Минимальные валидные файлы: 1x1 PNG и «видео» из нулей нужного размера
+PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082"
+)
+
+
+@dataclass
+class FakeConfig:
+    median: float = 8.0          # медиана времени генерации, сек
+    sigma: float = 0.4           # разброс логнормального распределения
+    fail_rate: float = 0.0       # доля задач, завершающихся ошибкой
+    submit_latency: float = 0.05 # задержка ответа на POST /media
+    video_size: int = 2 * 1024 * 1024
+    callbacks: bool = True       # слать ли POST на callback_url из запроса
+
+
+@dataclass
+class FakeJob:
+    id: str
+    model: str
+    ready_at: float
+    failed: bool
+    callback_url: Optional[str] = None
+    polls: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def is_video(self) -> bool:
+        return "kling" in self.model
+
+
+def _status_payload(job: FakeJob, base: str) -> dict:
+    now = time.monotonic()
+    if now < job.ready_at:
+        return {"id": job.id, "status": "processing"}
+    if job.failed:
+        return {"id": job.id, "status": "failed", "error": "fake failure"}
+    ext = "mp4" if job.is_video else "png"
+    return {"id": job.id, "status": "completed", "data": {"url": f"{base}/files/{job.id}.{ext}"}}
+
+
+def create_app(config: FakeConfig) -> web.Application:
+    jobs: Dict[str, FakeJob] = {}
+    stats = {"submits": 0, "polls": 0, "downloads": 0, "callbacks": 0, "callback_errors": 0}
+    app = web.Application()
+    app["jobs"] = jobs
+    app["stats"] = stats
+
+    def base_url(request: web.Request) -> str:
+        return f"{request.scheme}://{request.host}"
+
+    async def send_callback(job: FakeJob, base: str):
+        await asyncio.sleep(max(0.0, job.ready_at - time.monotonic()))
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(job.callback_url, json=_status_payload(job, base)) as resp:
+                    stats["callbacks"] += 1
+                    if resp.status != 200:
+                        stats["callback_errors"] += 1
+        except Exception as e:
+            stats["callback_errors"] += 1
+            logging.warning("callback %s failed: %s", job.id, e)
+
+    async def submit(request: web.Request):
+        await asyncio.sleep(config.submit_latency)
+        body = await request.json()
+        duration = random.lognormvariate(0, config.sigma) * config.median
+        job = FakeJob(
+            id=uuid.uuid4().hex,
+            model=str(body.get("model", "")),
+            ready_at=time.monotonic() + duration,
+            failed=random.random() < config.fail_rate,
+            callback_url=body.get("callback_url"),
+        )
+        jobs[job.id] = job
+        stats["submits"] += 1
+        if config.callbacks and job.callback_url:
+            asyncio.create_task(send_callback(job, base_url(request)))
+        return web.json_response({"id": job.id, "status": "pending"}, status=201)
+
+    async def status(request: web.Request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"error": "not found"}, status=404)
+        job.polls += 1
+        stats["polls"] += 1
+        return web.json_response(_status_payload(job, base_url(request)))
+
+    async def download(request: web.Request):
+        job_id, _, ext = request.match_info["name"].partition(".")
+        if job_id not in jobs:
+            return web.Response(status=404)
+        stats["downloads"] += 1
+        if ext == "mp4":
+            return web.Response(body=b"\0" * config.video_size, content_type="video/mp4")
+        return web.Response(body=PNG_1X1, content_type="image/png")
+
+    async def get_stats(request: web.Request):
+        return web.json_response(stats)
+
+    app.router.add_post("/api/v1/media", submit)
+    app.router.add_get("/api/v1/media/{job_id}", status)
+    app.router.add_get("/files/{name}", download)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Polza API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--median", type=float, default=8.0)
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--no-callbacks", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    config = FakeConfig(
+        median=args.median, sigma=args.sigma, fail_rate=args.fail_rate, callbacks=not args.no_callbacks
+    )
+    web.run_app(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
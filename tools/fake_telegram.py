@@ -0,0 +1,190 @@
+"""
+Локальная заглушка Telegram Bot API (и загрузки Telegraph) для нагрузочных тестов.
+
+Запуск отдельно:
+    python -m tools.fake_telegram --port 8082 --send-latency 0.1
+
+Бот направляем на неё переменными окружения:
+    TELEGRAM_API_URL=http://127.0.0.1:8082
+    TELEGRAPH_URL=http://127.0.0.1:8082
+
+Апдейты для getUpdates кладёт FakeTelegram.push() (см. tools/loadtest.py);
+всё, что бот отправил в чат, попадает в FakeTelegram.outgoing(chat_id).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Tuple
+
+from aiohttp import web
+
+# Заголовок JPEG, дальше — нули до нужного размера
+JPEG_HEADER = bytes.fromhex("ffd8ffe000104a46494600010100000100010000")
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+SEND_METHODS = ("sendphoto", "sendvideo", "senddocument", "sendanimation")
+
+
+@dataclass
+class FakeTelegramConfig:
+    file_size: int = 200 * 1024    # размер «фото» пользователя при скачивании
+    api_latency: float = 0.005     # задержка обычных методов
+    send_latency: float = 0.1      # задержка sendPhoto/sendVideo сверх приёма файла
+    get_updates_limit: int = 100
+
+
+class FakeTelegram:
+    def __init__(self, config: FakeTelegramConfig):
+        self.config = config
+        self.updates: Deque[dict] = deque()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1_000_000)
+        self.new_updates = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.outbox: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.stats = defaultdict(int)
+
+    # --- сторона теста ---
+
+    def push(self, update: dict) -> int:
+        update_id = next(self.update_ids)
+        self.updates.append({"update_id": update_id, **update})
+        self.new_updates.set()
+        return update_id
+
+    def next_message_id(self) -> int:
+        return next(self.message_ids)
+
+    async def outgoing(self, chat_id: int) -> Tuple[str, dict]:
+        """Следующий вызов бота в этот чат: (метод в нижнем регистре, поля запроса)."""
+        return await self.outbox[chat_id].get()
+
+    # --- сторона бота ---
+
+    async def _get_updates(self, fields: dict):
+        self.polling.set()
+        offset = int(fields.get("offset") or 0)
+        timeout = min(float(fields.get("timeout") or 0), 25)
+        limit = int(fields.get("limit") or self.config.get_updates_limit)
+
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = list(itertools.islice(self.updates, limit))
+        self.stats["updates_delivered"] += len(batch)
+        return batch
+
+    def _message(self, chat_id: int, fields: dict, method: str) -> dict:
+        message_id = int(fields.get("message_id") or 0) or self.next_message_id()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in fields:
+            message["text"] = fields["text"]
+        if method == "sendphoto":
+            message["photo"] = [{"file_id": f"sent-{message_id}", "file_unique_id": f"sentu-{message_id}",
+                                 "width": 1024, "height": 1024}]
+        elif method == "sendvideo":
+            message["video"] = {"file_id": f"sent-{message_id}", "file_unique_id": f"sentu-{message_id}",
+                                "width": 720, "height": 1280, "duration": 5}
+        elif method == "senddocument":
+            message["document"] = {"file_id": f"sent-{message_id}", "file_unique_id": f"sentu-{message_id}"}
+        return message
+
+    async def _call(self, method: str, fields: dict):
+        if method == "getupdates":
+            return await self._get_updates(fields)
+        if method == "getme":
+            return BOT_USER
+        if method == "getfile":
+            file_id = fields["file_id"]
+            ext = "mp4" if file_id.startswith("vid") else "jpg"
+            return {"file_id": file_id, "file_unique_id": f"u-{file_id}", "file_size": self.config.file_size,
+                    "file_path": f"files/{file_id}.{ext}"}
+
+        await asyncio.sleep(self.config.send_latency if method in SEND_METHODS else self.config.api_latency)
+        chat_id = fields.get("chat_id")
+        if chat_id is None or method in ("sendchataction",):
+            return True
+        chat_id = int(chat_id)
+        self.outbox[chat_id].put_nowait((method, fields))
+        if method.startswith("send") or method.startswith("edit"):
+            return self._message(chat_id, fields, method)
+        return True
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+
+        async def api(request: web.Request):
+            method = request.match_info["method"].lower()
+            self.stats[f"calls:{method}"] += 1
+            fields = {}
+            if request.content_type.startswith("multipart/") or request.content_type.endswith("urlencoded"):
+                for name, value in (await request.post()).items():
+                    if isinstance(value, web.FileField):
+                        self.stats["bytes_uploaded"] += len(value.file.read())
+                        fields[name] = value.filename
+                    else:
+                        fields[name] = value
+            elif request.can_read_body:
+                fields = await request.json()
+            try:
+                result = await self._call(method, fields)
+            except Exception as e:
+                logging.exception("fake telegram %s failed", method)
+                return web.json_response({"ok": False, "error_code": 400, "description": str(e)})
+            return web.json_response({"ok": True, "result": result})
+
+        async def download(request: web.Request):
+            self.stats["downloads"] += 1
+            self.stats["bytes_downloaded"] += self.config.file_size
+            return web.Response(body=JPEG_HEADER + b"\0" * (self.config.file_size - len(JPEG_HEADER)),
+                                content_type="image/jpeg")
+
+        async def telegraph_upload(request: web.Request):
+            await request.read()
+            self.stats["telegraph_uploads"] += 1
+            return web.json_response([{"src": f"/file/{uuid.uuid4().hex}.jpg"}])
+
+        async def telegraph_file(request: web.Request):
+            return web.Response(body=JPEG_HEADER, content_type="image/jpeg")
+
+        async def get_stats(request: web.Request):
+            return web.json_response(dict(self.stats))
+
+        app.router.add_route("*", "/bot{token}/{method}", api)
+        app.router.add_get("/file/bot{token}/{path:.+}", download)
+        app.router.add_post("/upload", telegraph_upload)
+        app.router.add_get("/file/{name}", telegraph_file)
+        app.router.add_get("/stats", get_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--file-size", type=int, default=200 * 1024)
+    parser.add_argument("--send-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    fake = FakeTelegram(FakeTelegramConfig(file_size=args.file_size, send_latency=args.send_latency))
+    web.run_app(fake.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
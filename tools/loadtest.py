@@ -0,0 +1,428 @@
+"""
+Сквозной нагрузочный тест: настоящий бот (main.py, по желанию с worker.py) против
+локальных заглушек Polza (tools/fake_polza.py) и Telegram Bot API (tools/fake_telegram.py).
+
+    python -m tools.loadtest --users 2000 --ramp 60 --jobs 2
+    python -m tools.loadtest --users 500 --mix nanabanana=1 --median 2 --fail-rate 0.05
+    python -m tools.loadtest --users 1000 --workers 2      # GENERATION_QUEUE=redis + worker.py
+    python -m tools.loadtest --users 1000 --label "http pool 400" --out logs/loadtest.jsonl
+
+Каждый синтетический пользователь проходит настоящие роутеры app/routers/photo.py:
+кнопка меню → выбор модели → фото → промпт → ждём sendPhoto/sendVideo (или сообщение об ошибке).
+Задержка «от промпта до результата» — сквозная: getUpdates, FSM, admission, Polza, отправка файла.
+
+Отчёт: задачи/с, p50/p95/p99 задержки, пиковый RSS и число открытых сокетов процессов бота
+(main.py и всех его потомков, по /proc). Каждый прогон дописывается строкой JSON в --out,
+чтобы сравнивать прогоны до и после изменения.
+
+Нужны Redis и Postgres, как для самого бота (тестовые! DB_*/REDIS_URL из .env):
+пользователи --user-base.. создаются с балансом на все задачи и удаляются в конце.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+import database as db
+from tools.fake_polza import FakeConfig, create_app as create_polza_app
+from tools.fake_telegram import FakeTelegram, FakeTelegramConfig
+
+TOKEN = "123456:LOADTEST"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Кнопка меню, с которой начинается сценарий модели
+MENU_BUTTON = {"kling_5": "🎬 Оживить фото", "kling_10": "🎬 Оживить фото"}
+PHOTO_MENU_BUTTON = "📸 Начать фотосессию"
+RESULT_METHODS = ("sendphoto", "sendvideo")
+# Сообщения бота, после которых результата уже не будет
+ERROR_PREFIXES = ("⚠️", "❌", "🚦")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        model, _, weight = item.partition("=")
+        mix[model.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# --- Процессы бота: RSS и сокеты по /proc ---
+
+def process_tree(root_pid: int) -> List[int]:
+    children = defaultdict(list)
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # pid (comm) state ppid ... — comm может содержать пробелы
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(name))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+
+def process_usage(pid: int):
+    """(RSS в байтах, пиковый RSS процесса VmHWM, открытые сокеты)."""
+    rss = hwm = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    hwm = int(line.split()[1]) * 1024
+        sockets = 0
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                if os.readlink(f"/proc/{pid}/fd/{fd}").startswith("socket:"):
+                    sockets += 1
+            except OSError:
+                continue
+    except OSError:
+        return 0, 0, 0
+    return rss, hwm, sockets
+
+
+class ResourceSampler:
+    def __init__(self, root_pids: List[int], interval: float = 0.5):
+        self.root_pids = root_pids
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_sockets = 0
+        self.hwm: Dict[int, int] = {}
+
+    def sample(self):
+        rss_total = sockets_total = 0
+        for root in self.root_pids:
+            for pid in process_tree(root):
+                rss, hwm, sockets = process_usage(pid)
+                rss_total += rss
+                sockets_total += sockets
+                self.hwm[pid] = max(self.hwm.get(pid, 0), hwm)
+        self.peak_rss = max(self.peak_rss, rss_total)
+        self.peak_sockets = max(self.peak_sockets, sockets_total)
+
+    async def run(self):
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+
+# --- Синтетические пользователи ---
+
+class Driver:
+    def __init__(self, telegram: FakeTelegram, args):
+        self.telegram = telegram
+        self.args = args
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.first_prompt: Optional[float] = None
+        self.last_result: Optional[float] = None
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+
+    def _message(self, user_id: int, **content) -> dict:
+        return {
+            "message_id": self.telegram.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **content,
+        }
+
+    def send_text(self, user_id: int, text: str):
+        self.telegram.push({"message": self._message(user_id, text=text)})
+
+    def send_photo(self, user_id: int, file_id: str):
+        photo = {"file_id": file_id, "file_unique_id": f"u-{file_id}", "width": 1024, "height": 1024,
+                 "file_size": self.telegram.config.file_size}
+        self.telegram.push({"message": self._message(user_id, photo=[photo])})
+
+    def press(self, user_id: int, data: str):
+        self.telegram.push({"callback_query": {
+            "id": str(self.telegram.next_message_id()),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": self._message(user_id, text="menu"),
+        }})
+
+    async def expect(self, user_id: int, accept) -> Optional[tuple]:
+        """Ждём вызов бота в чат пользователя, для которого accept(method, fields) истинно."""
+        deadline = time.monotonic() + self.args.timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            try:
+                method, fields = await asyncio.wait_for(self.telegram.outgoing(user_id), left)
+            except asyncio.TimeoutError:
+                return None
+            if accept(method, fields):
+                return method, fields
+
+    async def expect_message(self, user_id: int) -> bool:
+        return await self.expect(user_id, lambda m, f: m == "sendmessage") is not None
+
+    async def run_job(self, user_id: int, job: int, model: str):
+        self.send_text(user_id, MENU_BUTTON.get(model, PHOTO_MENU_BUTTON))
+        if not await self.expect_message(user_id):
+            return self._outcome(model, "timeout_menu")
+        self.press(user_id, f"model_{model}")
+        if not await self.expect_message(user_id):
+            return self._outcome(model, "timeout_model")
+        # Одинаковые фото у всех пользователей (--same-photo) проверяют кэш и single-flight
+        file_id = "photo-shared" if self.args.same_photo else f"photo-{user_id}-{job}"
+        self.send_photo(user_id, file_id)
+        if not await self.expect_message(user_id):
+            return self._outcome(model, "timeout_photo")
+
+        prompt = "loadtest" if self.args.same_photo else f"loadtest {user_id} {job} {random.random():.6f}"
+        started = time.perf_counter()
+        self.first_prompt = self.first_prompt or started
+        self.send_text(user_id, prompt)
+        reply = await self.expect(user_id, lambda m, f: m in RESULT_METHODS or (
+            m == "sendmessage" and f.get("text", "").startswith(ERROR_PREFIXES)
+        ))
+        finished = time.perf_counter()
+        if reply is None:
+            return self._outcome(model, "timeout")
+        if reply[0] in RESULT_METHODS:
+            self.latencies[model].append(finished - started)
+            self.last_result = finished
+            return self._outcome(model, "ok")
+        return self._outcome(model, "error")
+
+    def _outcome(self, model: str, outcome: str):
+        self.outcomes[outcome] += 1
+        self.outcomes[f"{model}:{outcome}"] += 1
+
+    async def run_user(self, index: int, user_id: int, models: List[str]):
+        await asyncio.sleep(self.args.ramp * index / max(1, self.args.users))
+        for job, model in enumerate(models):
+            await self.run_job(user_id, job, model)
+            if self.args.think:
+                await asyncio.sleep(random.expovariate(1 / self.args.think))
+
+
+# --- Запуск ---
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def seed_users(user_ids: List[int], balance: int):
+    semaphore = asyncio.Semaphore(20)
+
+    async def one(user_id):
+        async with semaphore:
+            current = await db.get_or_create_user(user_id)
+            await db.update_balance(user_id, balance - current)
+
+    await asyncio.gather(*(one(u) for u in user_ids))
+
+
+async def delete_users(first: int, last: int):
+    async with db.db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM credit_holds WHERE user_id >= $1 AND user_id <= $2", first, last)
+        await conn.execute("DELETE FROM users WHERE user_id >= $1 AND user_id <= $2", first, last)
+
+
+async def spawn(script: str, env: dict, log_path: str, *extra):
+    log = open(log_path, "ab")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, script, *extra, cwd=ROOT, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT,
+    )
+    log.close()
+    return process
+
+
+async def stop(process: asyncio.subprocess.Process):
+    if process.returncode is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), 30)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run(args):
+    os.makedirs(os.path.join(ROOT, "logs"), exist_ok=True)
+    polza_port, telegram_port, bot_port = free_port(), free_port(), free_port()
+
+    telegram = FakeTelegram(FakeTelegramConfig(file_size=args.file_size, send_latency=args.send_latency))
+    polza_app = create_polza_app(FakeConfig(
+        median=args.median, sigma=args.sigma, fail_rate=args.fail_rate, video_size=args.video_size,
+        callbacks=args.callbacks,
+    ))
+    runners = [await start_site(polza_app, polza_port), await start_site(telegram.create_app(), telegram_port)]
+
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "POLZA_API_KEY": "loadtest",
+        "POLZA_BASE_URL": f"http://127.0.0.1:{polza_port}/api/v1",
+        "POLZA_CALLBACK_URL": f"http://127.0.0.1:{bot_port}/polza/callback" if args.callbacks else "",
+        "POLZA_CALLBACK_SECRET": "loadtest",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram_port}",
+        "TELEGRAPH_URL": f"http://127.0.0.1:{telegram_port}",
+        "WEBHOOK_PORT": str(bot_port),
+        "TELEGRAM_UPDATES": "polling",
+        "GENERATION_QUEUE": "redis" if args.workers else "local",
+        "TRACE_LOG": os.path.join(ROOT, "logs", "loadtest-traces.jsonl"),
+    }
+
+    first_user = args.user_base
+    user_ids = list(range(first_user, first_user + args.users))
+    mix = parse_mix(args.mix)
+    plans = [random.choices(list(mix), weights=list(mix.values()), k=args.jobs) for _ in user_ids]
+    max_cost = args.jobs * 10
+
+    await db.init_db()
+    processes = []
+    sampler_task = None
+    try:
+        print(f"Готовим {len(user_ids)} пользователей...")
+        await seed_users(user_ids, max_cost)
+
+        processes.append(await spawn("main.py", env, os.path.join(ROOT, "logs", "loadtest-bot.log")))
+        if args.workers:
+            processes.append(await spawn("worker.py", env, os.path.join(ROOT, "logs", "loadtest-worker.log"),
+                                         "--processes", str(args.workers)))
+        await asyncio.wait_for(telegram.polling.wait(), 60)
+        print(f"Бот запущен (pid {processes[0].pid}), нагрузка: {args.users} пользователей × {args.jobs}")
+
+        sampler = ResourceSampler([p.pid for p in processes])
+        sampler_task = asyncio.create_task(sampler.run())
+        driver = Driver(telegram, args)
+        started = time.perf_counter()
+        await asyncio.gather(*(driver.run_user(i, u, plans[i]) for i, u in enumerate(user_ids)))
+        wall = time.perf_counter() - started
+        sampler.sample()
+    finally:
+        if sampler_task:
+            sampler_task.cancel()
+        for process in processes:
+            await stop(process)
+        for runner in runners:
+            await runner.cleanup()
+        await delete_users(user_ids[0], user_ids[-1])
+        await db.close_db()
+
+    report(args, driver, sampler, wall, telegram.stats, polza_app["stats"])
+
+
+def report(args, driver: Driver, sampler: ResourceSampler, wall: float, telegram_stats, polza_stats):
+    latencies = [v for values in driver.latencies.values() for v in values]
+    ok = driver.outcomes.get("ok", 0)
+    # Пропускная способность — по окну от первого промпта до последнего результата
+    window = (driver.last_result - driver.first_prompt) if driver.last_result and driver.first_prompt else wall
+    result = {
+        "label": args.label,
+        "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "users": args.users,
+        "jobs_per_user": args.jobs,
+        "mix": args.mix,
+        "workers": args.workers,
+        "polza_median": args.median,
+        "wall_seconds": round(wall, 2),
+        "jobs_ok": ok,
+        "jobs_per_second": round(ok / window, 2) if window > 0 else 0,
+        "p50": round(percentile(latencies, 0.5), 3),
+        "p95": round(percentile(latencies, 0.95), 3),
+        "p99": round(percentile(latencies, 0.99), 3),
+        "max": round(max(latencies), 3) if latencies else 0,
+        "peak_rss_mb": round(sampler.peak_rss / 2 ** 20, 1),
+        "sum_hwm_mb": round(sum(sampler.hwm.values()) / 2 ** 20, 1),
+        "peak_sockets": sampler.peak_sockets,
+        "outcomes": dict(driver.outcomes),
+        "by_model": {
+            model: {"n": len(v), "p50": round(percentile(v, 0.5), 3), "p99": round(percentile(v, 0.99), 3)}
+            for model, v in driver.latencies.items()
+        },
+        "telegram": dict(telegram_stats),
+        "polza": dict(polza_stats),
+    }
+
+    print(f"\n=== {args.label or 'loadtest'}: {args.users} пользователей, {wall:.1f}s")
+    print(f"  задач: ok={ok} " + " ".join(
+        f"{k}={v}" for k, v in sorted(driver.outcomes.items()) if ":" not in k and k != "ok"))
+    print(f"  пропускная способность: {result['jobs_per_second']} задач/с")
+    print(f"  задержка: p50 {result['p50']:.2f}s  p95 {result['p95']:.2f}s  p99 {result['p99']:.2f}s  "
+          f"max {result['max']:.2f}s")
+    for model, stats in sorted(result["by_model"].items()):
+        print(f"    {model:<16} n={stats['n']:<6} p50 {stats['p50']:.2f}s  p99 {stats['p99']:.2f}s")
+    print(f"  пиковый RSS: {result['peak_rss_mb']} MB (сумма VmHWM процессов {result['sum_hwm_mb']} MB), "
+          f"сокетов: {result['peak_sockets']}")
+    print(f"  Polza: {polza_stats}  Telegram: отправок файлов "
+          f"{telegram_stats.get('calls:sendphoto', 0) + telegram_stats.get('calls:sendvideo', 0)}, "
+          f"скачиваний {telegram_stats.get('downloads', 0)}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"  записано в {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--jobs", type=int, default=1, help="задач на пользователя")
+    parser.add_argument("--ramp", type=float, default=30, help="секунды на подключение всех пользователей")
+    parser.add_argument("--think", type=float, default=0, help="средняя пауза между задачами, сек")
+    parser.add_argument("--mix", default="nanabanana=6,seedream=3,kling_5=1")
+    parser.add_argument("--same-photo", action="store_true", help="одинаковые запросы (кэш/single-flight)")
+    parser.add_argument("--workers", type=int, default=0, help="процессов worker.py (0 — задачи в боте)")
+    parser.add_argument("--median", type=float, default=8.0, help="медиана генерации Polza, сек")
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--no-callbacks", dest="callbacks", action="store_false")
+    parser.add_argument("--video-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--file-size", type=int, default=200 * 1024)
+    parser.add_argument("--send-latency", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=900, help="ожидание ответа бота, сек")
+    parser.add_argument("--user-base", type=int, default=8_000_000_000)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", default=os.path.join("logs", "loadtest.jsonl"))
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
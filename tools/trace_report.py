@@ -0,0 +1,166 @@
+"""
+Разбор трасс генерации: файлы всех процессов logs/traces.<процесс>.jsonl
+(вместе с ротированными .1, .2, ...).
+
+    python -m tools.trace_report                          # сводка по моделям и этапам
+    python -m tools.trace_report --model kling_motion --since 24
+    python -m tools.trace_report --user 123456789         # трассы пользователя, новые сверху
+    python -m tools.trace_report --trace 3f2a9c0d1e4b5a67 # водопад одной задачи
+
+Критический путь — цепочка этапов, которая определила общее время задачи: идём от конца
+задачи назад и каждый раз берём этап, закончившийся последним (вложенный — раньше внешнего).
+Промежутки без этапов относятся к самому узкому охватывающему этапу или к «untracked».
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+
+EPS = 0.001
+
+
+def trace_files(path: str):
+    """Файлы трасс всех процессов для базового пути TRACE_LOG (и сам путь — от старых версий)."""
+    root, ext = os.path.splitext(path)
+    return sorted(set(glob.glob(f"{glob.escape(root)}.*{ext}")) | {path})
+
+
+def read_traces(path: str):
+    for name in trace_files(path):
+        # RotatingFileHandler: .1 — самый свежий из старых, большие номера — старше
+        rotated = [p for p in glob.glob(f"{glob.escape(name)}.*") if p.rsplit(".", 1)[1].isdigit()]
+        rotated.sort(key=lambda p: -int(p.rsplit(".", 1)[1]))
+        for file_name in rotated + [name]:
+            if not os.path.exists(file_name):
+                continue
+            with open(file_name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+def critical_path(trace: dict):
+    """[(этап, секунды на критическом пути)] от начала задачи к концу."""
+    spans = [s for s in trace.get("spans", []) if s.get("duration", 0) > 0]
+    for s in spans:
+        s["end"] = s["start"] + s["duration"]
+    used = set()
+    path = []
+    cursor = trace["total"]
+    while cursor > EPS:
+        candidates = [(i, s) for i, s in enumerate(spans) if i not in used and s["end"] <= cursor + EPS]
+        if not candidates:
+            path.append(("untracked", cursor))
+            break
+        latest = max(s["end"] for _, s in candidates)
+        index, chosen = min(((i, s) for i, s in candidates if s["end"] >= latest - EPS),
+                            key=lambda item: item[1]["duration"])
+        gap = cursor - chosen["end"]
+        if gap > EPS:
+            path.append((_enclosing(spans, chosen["end"], cursor), gap))
+        path.append((chosen["name"], chosen["duration"]))
+        used.add(index)
+        cursor = chosen["start"]
+    return list(reversed(path))
+
+
+def _enclosing(spans, start: float, end: float) -> str:
+    covering = [s for s in spans if s["start"] <= start and s["end"] >= end]
+    if not covering:
+        return "untracked"
+    return min(covering, key=lambda s: s["duration"])["name"] + " (self)"
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(traces, top: int):
+    by_model = defaultdict(list)
+    for trace in traces:
+        by_model[trace["model"]].append(trace)
+
+    for model, items in sorted(by_model.items()):
+        totals = [t["total"] for t in items]
+        statuses = defaultdict(int)
+        for t in items:
+            statuses[t["status"]] += 1
+        print(f"\n=== {model}: {len(items)} задач, p50 {percentile(totals, 0.5):.1f}s, "
+              f"p95 {percentile(totals, 0.95):.1f}s, max {max(totals):.1f}s | "
+              + " ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+
+        stage_times = defaultdict(list)
+        critical = defaultdict(float)
+        for t in items:
+            for s in t.get("spans", []):
+                stage_times[s["name"]].append(s["duration"])
+            for name, seconds in critical_path(t):
+                critical[name] += seconds
+        critical_total = sum(critical.values()) or 1
+
+        print(f"  {'этап':<24} {'n':>6} {'p50':>8} {'p95':>8} {'max':>8} {'крит. путь':>11}")
+        for name, values in sorted(stage_times.items(), key=lambda kv: -critical.get(kv[0], 0)):
+            print(f"  {name:<24} {len(values):>6} {percentile(values, 0.5):>7.2f}s {percentile(values, 0.95):>7.2f}s "
+                  f"{max(values):>7.2f}s {critical.get(name, 0) / critical_total:>10.0%}")
+        for name in sorted(set(critical) - set(stage_times)):
+            print(f"  {name:<24} {'':>6} {'':>8} {'':>8} {'':>8} {critical[name] / critical_total:>10.0%}")
+
+        print("  Самые долгие:")
+        for t in sorted(items, key=lambda t: -t["total"])[:top]:
+            path = " → ".join(f"{name} {seconds:.1f}s" for name, seconds in critical_path(t) if seconds >= 0.05)
+            print(f"    {t['trace_id']} user={t.get('user_id')} {t['total']:.1f}s [{t['status']}]: {path}")
+
+
+def waterfall(trace: dict, width: int = 50):
+    total = trace["total"] or 1
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace["started_at"]))
+    print(f"{trace['trace_id']} {trace['kind']} {trace['model']} user={trace.get('user_id')} "
+          f"{started} total={trace['total']:.2f}s status={trace['status']}")
+    for s in sorted(trace.get("spans", []), key=lambda s: s["start"]):
+        offset = int(s["start"] / total * width)
+        length = max(1, int(s["duration"] / total * width))
+        print(f"  {s['name']:<22} {' ' * offset}{'█' * length:<{width - offset}} {s['start']:>8.2f}s +{s['duration']:.2f}s")
+    print("  Критический путь: " + " → ".join(f"{n} {sec:.2f}s" for n, sec in critical_path(trace)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace report")
+    parser.add_argument("--file", default=os.getenv("TRACE_LOG", "logs/traces.jsonl"))
+    parser.add_argument("--model")
+    parser.add_argument("--user", type=int)
+    parser.add_argument("--trace")
+    parser.add_argument("--since", type=float, help="за последние N часов")
+    parser.add_argument("--status", help="ok / error / cached / coalesced")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    since = time.time() - args.since * 3600 if args.since else 0
+    traces = [
+        t for t in read_traces(args.file)
+        if t.get("started_at", 0) >= since
+        and (not args.model or t.get("model") == args.model)
+        and (not args.user or t.get("user_id") == args.user)
+        and (not args.trace or t.get("trace_id") == args.trace)
+        and (not args.status or t.get("status") == args.status)
+    ]
+    if not traces:
+        print("Трасс не найдено")
+        return
+
+    if args.trace or args.user:
+        for trace in sorted(traces, key=lambda t: -t["started_at"])[:args.top if args.user else None]:
+            waterfall(trace)
+            print()
+        return
+    summary(traces, args.top)
+
+
+if __name__ == "__main__":
+    main()
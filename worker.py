@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(process)d - %(message)s"
+)
+
+from app.bot import create_bot
+from app.network import init_polza_client, close_polza_client
+from app.services.polza_poller import close_polza_poller, get_polza_poller
+from app.services.job_queue import JobWorker
+from app.services.metrics import METRICS_PORT, start_metrics_server
+from app.services import tracing
+from app.routers.photo import background_photo_gen, background_video_gen_combined, dead_job
+import database as db
+
+HANDLERS = {
+    "photo": background_photo_gen,
+    "video": background_video_gen_combined,
+}
+
+
+async def run_worker(index: int):
+    tracing.set_process_name(f"worker-{index}")
+    await db.init_db()
+    await init_polza_client()
+    bot = create_bot()
+    get_polza_poller().subscribe_callbacks()
+    # У каждого процесса свои метрики — и свой порт
+    metrics_runner = await start_metrics_server(METRICS_PORT + index) if METRICS_PORT else None
+
+    worker = JobWorker(bot, HANDLERS, consumer=f"{socket.gethostname()}-{os.getpid()}-{index}", dead_letter=dead_job)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        await close_polza_poller()
+        await close_polza_client()
+        await db.close_db()
+        logging.info("🛑 Воркер %s остановлен", index)
+
+
+def _process_main(index: int):
+    asyncio.run(run_worker(index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры генерации из очереди Redis")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1)))
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _process_main(0)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_process_main, args=(i,), name=f"gen-worker-{i}") for i in range(args.processes)]
+    for p in processes:
+        p.start()
+    logging.info("🚀 Запущено %s процессов-воркеров", len(processes))
+
+    def forward(signum, _frame):
+        for p in processes:
+            if p.is_alive():
+                os.kill(p.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()